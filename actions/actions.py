@@ -2,11 +2,42 @@ from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
-from .utils import llm_client, UNIGROW_SYSTEM_PROMPT
+from .utils import (
+    llm_client,
+    llm_stream_message,
+    STREAM_INPUT_CHANNEL,
+    UNIGROW_SYSTEM_PROMPT,
+    DEFAULT_FALLBACK_RESPONSE,
+    start_metrics_server,
+)
+from .resilience import PRIORITY_HIGH, PRIORITY_NORMAL
+from .retrieval import faq_index, format_passages
+from .extraction import extract, normalize_age, normalize_height
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Export metrics của LLM client trong action server (ví dụ LLM_METRICS_PORT=9105).
+# Khởi động ở đây chứ không trong utils: app.py cũng import utils và sẽ
+# bind trùng cổng khi hai process dùng chung env
+if os.getenv("LLM_METRICS_PORT"):
+    start_metrics_server(llm_client, int(os.getenv("LLM_METRICS_PORT")))
+
+# Số đoạn FAQ đưa vào prompt khi không trả lời thẳng được
+FAQ_TOP_K = int(os.getenv("FAQ_TOP_K", 3))
+
+# Intent thuộc luồng mua hàng: được ưu tiên khi hàng đợi LLM đông
+PURCHASE_INTENTS = {"ask_price", "ask_purchase", "ask_guarantee", "affirm"}
+
+
+def llm_priority(tracker: Tracker) -> int:
+    """Độ ưu tiên LLM cho lượt hiện tại: luồng mua hàng trước, chit-chat sau"""
+    intent = (tracker.latest_message.get("intent") or {}).get("name")
+    if intent in PURCHASE_INTENTS:
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
 class ActionQueryLLMFallback(Action):
     """
     Dùng Mistral LLM để trả lời các câu hỏi phức tạp
@@ -16,7 +47,7 @@ class ActionQueryLLMFallback(Action):
     def name(self) -> Text:
         return "action_query_llm_fallback"
     
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -28,19 +59,40 @@ class ActionQueryLLMFallback(Action):
         
         logger.info(f"LLM Fallback triggered for: {user_message}")
         
-        # Tạo prompt cho LLM
-        prompt = f"""User hỏi: {user_message}
+        # Câu hỏi đã có trong FAQ: trả lời thẳng, không gọi LLM
+        direct, passages = faq_index.answer(user_message, k=FAQ_TOP_K)
+        if direct is not None:
+            logger.info(f"FAQ direct answer: {direct.id}")
+            dispatcher.utter_message(text=direct.answer)
+            return []
+        
+        # Tạo prompt cho LLM (kèm các đoạn FAQ liên quan nhất)
+        reference = ""
+        if passages:
+            reference = f"Thông tin tham khảo từ FAQ Unigrow:\n{format_passages(passages)}\n\n"
+        
+        prompt = f"""{reference}User hỏi: {user_message}
 
-Hãy trả lời theo hướng dẫn ở trên về Unigrow và phát triển chiều cao."""
+Hãy trả lời theo hướng dẫn ở trên về Unigrow và phát triển chiều cao, ưu tiên thông tin tham khảo nếu liên quan."""
         
-        # Gọi Mistral 7B
-        response = llm_client.generate_response(
+        llm_args = dict(
             prompt=prompt,
             system_prompt=UNIGROW_SYSTEM_PROMPT,
             temperature=0.7,
-            max_tokens=512
+            max_tokens=512,
+            cache_key=user_message,
+            priority=llm_priority(tracker),
+            sender_id=tracker.sender_id
         )
         
+        # Web UI dạng stream: app.py tự stream token từ Ollama tới trình duyệt
+        if tracker.get_latest_input_channel() == STREAM_INPUT_CHANNEL:
+            dispatcher.utter_message(json_message=llm_stream_message(**llm_args))
+            return []
+        
+        # Gọi Mistral 7B (không chặn event loop của action server)
+        response = await llm_client.generate_response_async(**llm_args)
+        
         dispatcher.utter_message(text=response)
         return []
 
@@ -57,16 +109,18 @@ class ActionGetUserAge(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        # Extract age từ entities
-        age = next(
+        # Extract age từ entities, không có thì tìm trong câu
+        age = normalize_age(next(
             (entity["value"] for entity in tracker.latest_message.get("entities", [])
              if entity["entity"] == "age"),
             None
-        )
+        ))
+        if age is None:
+            age = extract(tracker.latest_message.get("text", "")).age
         
         if age:
             dispatcher.utter_message(text=f"Bạn {age} tuổi - tuổi phát triển tốt! 💪")
-            return [SlotSet("user_age", age)]
+            return [SlotSet("user_age", str(age))]
         else:
             dispatcher.utter_message(text="Có thể cho mình biết bạn bao nhiêu tuổi?")
             return []
@@ -84,23 +138,28 @@ class ActionStoreHeightInfo(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        current_height = next(
+        current_height = normalize_height(next(
             (entity["value"] for entity in tracker.latest_message.get("entities", [])
              if entity["entity"] == "current_height"),
             None
-        )
+        ))
         
-        target_height = next(
+        target_height = normalize_height(next(
             (entity["value"] for entity in tracker.latest_message.get("entities", [])
              if entity["entity"] == "target_height"),
             None
-        )
+        ))
+        
+        if current_height is None or target_height is None:
+            found = extract(tracker.latest_message.get("text", ""))
+            current_height = current_height or found.height
+            target_height = target_height or found.target_height
         
         events = []
         if current_height:
-            events.append(SlotSet("user_height", current_height))
+            events.append(SlotSet("user_height", str(current_height)))
         if target_height:
-            events.append(SlotSet("target_height", target_height))
+            events.append(SlotSet("target_height", str(target_height)))
         
         if current_height and target_height:
             dispatcher.utter_message(
@@ -123,22 +182,14 @@ class ActionDefaultFallback(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        dispatcher.utter_message(
-            text="Xin lỗi, mình không hiểu câu hỏi của bạn. "
-                 "Bạn có thể hỏi về:\n"
-                 "- Chiều cao & cách phát triển\n"
-                 "- Unigrow & cách dùng\n"
-                 "- Giá cả & mua hàng\n"
-                 "Hoặc nhắn lại với cách hỏi khác nhé! 😊"
-        )
+        dispatcher.utter_message(text=DEFAULT_FALLBACK_RESPONSE)
         return []
 from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet, ActionReverted
-from .utils import llm_client, UNIGROW_SYSTEM_PROMPT
+from .utils import llm_client, llm_stream_message, STREAM_INPUT_CHANNEL, UNIGROW_SYSTEM_PROMPT
 import logging
-import re
 
 logger = logging.getLogger(__name__)
 
@@ -157,24 +208,10 @@ class ActionExtractAgeEntity(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        user_message = tracker.latest_message.get("text", "").lower()
-        
-        # Regex pattern để tìm tuổi
-        age_patterns = [
-            r'(\d{1,2})\s*tuổi',
-            r'tôi\s+(\d{1,2})',
-            r'mình\s+(\d{1,2})',
-            r'em\s+(\d{1,2})',
-        ]
-        
-        for pattern in age_patterns:
-            match = re.search(pattern, user_message)
-            if match:
-                age = match.group(1)
-                # Validate age (phải từ 0-150)
-                if 0 <= int(age) <= 150:
-                    logger.info(f"Extracted age: {age}")
-                    return [SlotSet("user_age", age)]
+        age = extract(tracker.latest_message.get("text", "")).age
+        if age is not None:
+            logger.info(f"Extracted age: {age}")
+            return [SlotSet("user_age", str(age))]
         
         return []
 
@@ -191,28 +228,23 @@ class ActionValidateHeight(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        user_message = tracker.latest_message.get("text", "").lower()
-        
-        # Pattern để tìm chiều cao (150cm, 160 cm, 1m70, etc)
-        height_patterns = [
-            r'(\d{2,3})\s*cm',
-            r'(\d)m(\d{2})',
-            r'(\d\.\d{2})\s*m',
-        ]
+        # 150cm, 160 cm, 1m70, 1.70m... đều quy về cm
+        found = extract(tracker.latest_message.get("text", ""))
         
-        heights = []
-        for pattern in height_patterns:
-            matches = re.findall(pattern, user_message)
-            if matches:
-                heights.extend(matches)
-        
-        if heights:
-            logger.info(f"Found heights: {heights}")
-            dispatcher.utter_message(
-                text=f"Mình hiểu bạn cao khoảng {heights[0]}. Bạn muốn cao bao nhiêu nữa?"
-            )
+        events = []
+        if found.height is not None:
+            events.append(SlotSet("user_height", str(found.height)))
+        if found.target_height is not None:
+            events.append(SlotSet("target_height", str(found.target_height)))
+        
+        if found.heights:
+            logger.info(f"Found heights: {found.heights}")
+            if found.target_height is None:
+                dispatcher.utter_message(
+                    text=f"Mình hiểu bạn cao khoảng {found.heights[0]}cm. Bạn muốn cao bao nhiêu nữa?"
+                )
         
-        return []
+        return events
 
 class ActionConfirmPurchaseIntent(Action):
     """Xác nhận ý định mua của user"""
@@ -227,9 +259,9 @@ class ActionConfirmPurchaseIntent(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        user_age = tracker.get_slot("user_age")
-        user_height = tracker.get_slot("user_height")
-        target_height = tracker.get_slot("target_height")
+        user_age = normalize_age(tracker.get_slot("user_age"))
+        user_height = normalize_height(tracker.get_slot("user_height"))
+        target_height = normalize_height(tracker.get_slot("target_height"))
         
         # Xây dựng message based on thông tin user
         message_parts = []
@@ -304,12 +336,12 @@ class ActionGetProductRecommendation(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        user_age = tracker.get_slot("user_age")
+        user_age = normalize_age(tracker.get_slot("user_age"))
         
         recommendation = "Unigrow phù hợp cho tất cả lứa tuổi từ 8-30 tuổi. "
         
         if user_age:
-            age_int = int(user_age)
+            age_int = user_age
             if age_int < 18:
                 recommendation += (
                     f"Ở tuổi {user_age}, bạn vẫn đang trong giai đoạn phát triển vàng. "
@@ -344,9 +376,9 @@ class ActionSummarizeConversation(Action):
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
         
-        user_age = tracker.get_slot("user_age")
-        user_height = tracker.get_slot("user_height")
-        target_height = tracker.get_slot("target_height")
+        user_age = normalize_age(tracker.get_slot("user_age"))
+        user_height = normalize_height(tracker.get_slot("user_height"))
+        target_height = normalize_height(tracker.get_slot("target_height"))
         
         summary = "**📋 Tóm Tắt Thông Tin:**\n\n"
         
@@ -375,7 +407,7 @@ class ActionQueryLLMAdvanced(Action):
     def name(self) -> Text:
         return "action_query_llm_advanced"
     
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -383,8 +415,8 @@ class ActionQueryLLMAdvanced(Action):
     ) -> List[Dict[Text, Any]]:
         
         user_message = tracker.latest_message.get("text", "")
-        user_age = tracker.get_slot("user_age")
-        user_height = tracker.get_slot("user_height")
+        user_age = normalize_age(tracker.get_slot("user_age"))
+        user_height = normalize_height(tracker.get_slot("user_height"))
         
         # Xây dựng context từ slots
         context = ""
@@ -399,12 +431,22 @@ class ActionQueryLLMAdvanced(Action):
 
 Hãy trả lời theo hướng dẫn ở trên về Unigrow và phát triển chiều cao."""
         
-        response = llm_client.generate_response(
+        llm_args = dict(
             prompt=prompt,
             system_prompt=UNIGROW_SYSTEM_PROMPT,
             temperature=0.7,
-            max_tokens=512
+            max_tokens=512,
+            cache_key=user_message,
+            cache_context=context,
+            priority=llm_priority(tracker),
+            sender_id=tracker.sender_id
         )
         
+        if tracker.get_latest_input_channel() == STREAM_INPUT_CHANNEL:
+            dispatcher.utter_message(json_message=llm_stream_message(**llm_args))
+            return []
+        
+        response = await llm_client.generate_response_async(**llm_args)
+        
         dispatcher.utter_message(text=response)
         return []
@@ -0,0 +1,129 @@
+import queue
+import threading
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    """Hàng đợi riêng của một recipient"""
+
+    __slots__ = ("jobs", "scheduled", "current")
+
+    def __init__(self):
+        self.jobs: deque = deque()
+        # Lane đang nằm trong ready queue hoặc đang được một worker xử lý
+        self.scheduled = False
+        # ID job đang gửi, hoặc job đang chờ retry (lane bị chặn tới khi nó quay lại)
+        self.current: Optional[int] = None
+
+
+class RecipientDispatcher:
+    """
+    Pool worker có giới hạn, mỗi recipient tối đa một job đang gửi.
+
+    Job của cùng recipient_id được gửi lần lượt theo thứ tự submit; các
+    recipient khác nhau chạy song song trên `workers` thread. handler(job)
+    trả về False nếu job đã được lên lịch thử lại: lane của recipient đó
+    dừng lại cho tới khi chính job ấy được submit lại (hoặc unblock()),
+    để tin sau không vượt tin trước.
+    """
+
+    def __init__(self, handler: Callable[[Any], bool], workers: int = 8):
+        self.handler = handler
+        self.workers = workers
+
+        self._lanes: Dict[str, _Lane] = {}
+        self._ready: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+        self.processed = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"scheduler-dispatch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._ready.put(None)
+        self._threads = []
+
+    def _schedule(self, recipient_id: str, lane: _Lane):
+        lane.scheduled = True
+        self._ready.put(recipient_id)
+
+    def submit(self, job):
+        """Đưa job vào lane của recipient (giữ thứ tự trong cùng recipient)"""
+        with self._lock:
+            lane = self._lanes.get(job.recipient_id)
+            if lane is None:
+                lane = self._lanes[job.recipient_id] = _Lane()
+
+            if lane.current == job.id:
+                # Job retry quay lại: gửi trước các tin đang chờ phía sau
+                lane.jobs.appendleft(job)
+                if lane.scheduled:
+                    return
+                lane.current = None
+            else:
+                lane.jobs.append(job)
+
+            if not lane.scheduled and lane.current is None:
+                self._schedule(job.recipient_id, lane)
+
+    def unblock(self, recipient_id: str, job_id: int):
+        """Bỏ chặn lane đang chờ job_id (job đã bị huỷ)"""
+        with self._lock:
+            lane = self._lanes.get(recipient_id)
+            if lane is None or lane.current != job_id or lane.scheduled:
+                return
+            lane.current = None
+            if lane.jobs:
+                self._schedule(recipient_id, lane)
+            else:
+                del self._lanes[recipient_id]
+
+    def _run(self):
+        while True:
+            recipient_id = self._ready.get()
+            if recipient_id is None:
+                return
+
+            with self._lock:
+                lane = self._lanes[recipient_id]
+                job = lane.jobs.popleft()
+                lane.current = job.id
+
+            try:
+                done = self.handler(job)
+            except Exception as e:
+                logger.error(f"Dispatch handler error: {e}")
+                done = True
+
+            with self._lock:
+                self.processed += 1
+                if done or (lane.jobs and lane.jobs[0] is job):
+                    lane.current = None
+
+                if lane.current is None and lane.jobs:
+                    self._ready.put(recipient_id)
+                else:
+                    lane.scheduled = False
+                    if lane.current is None:
+                        del self._lanes[recipient_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "lanes": len(self._lanes),
+                "ready": self._ready.qsize(),
+                "processed": self.processed
+            }
@@ -0,0 +1,142 @@
+import re
+import unicodedata
+from typing import Any, List, Optional
+
+# Khoảng giá trị hợp lệ
+AGE_RANGE = (1, 120)
+HEIGHT_RANGE = (50, 250)  # cm
+
+# Mọi mẫu gộp trong một alternation: mỗi tin nhắn chỉ quét một lần.
+# Thứ tự nhánh quan trọng: dạng có đơn vị đứng trước số trần. Lookahead
+# đầu tiên loại nhanh các vị trí không thể bắt đầu nhánh nào (ký tự đầu
+# của số và các từ khoá) thay vì thử lần lượt từng nhánh.
+_PATTERN = re.compile(
+    r"""
+    (?=[\dtmecbưđl])
+    (?:
+      (?P<m_cm>\b(?P<m_cm_m>[12])\s*m\s*(?P<m_cm_cm>\d{1,2})\b)             # 1m70, 1m7, 1 m 65
+    | (?P<dec>\b(?P<dec_m>[12])[.,](?P<dec_frac>\d{1,2})\s*(?:m|mét|met)\b)  # 1.70m, 1,7 m
+    | (?P<cm>\b(?P<cm_v>\d{2,3})\s*(?:cm|phân)\b)                          # 170 cm, 170cm, 170 phân
+    | (?P<age>\b(?P<age_v>\d{1,3})\s*tuổi\b)                                # 20 tuổi
+    | (?P<age_post>\btuổi\s+(?P<age_post_v>\d{1,2})\b(?!\s*(?:cm|phân|m\b)))  # ở tuổi 20
+    | (?P<age_pre>\b(?:tôi|mình|em|con|cháu|bé)\s+(?:năm\s+nay\s+|nay\s+)?
+        (?P<age_pre_v>\d{1,2})\b(?![.,]\d)(?!\s*(?:cm|phân|m\b|mét|kg|k\b|hộp|viên|tháng|năm|lần)))  # em 16
+    | (?P<bare>(?:\bcao\s+(?:khoảng\s+|tầm\s+|được\s+)?)?
+        \b(?P<bare_v>1\d{2}|2[0-4]\d)\b(?![.,]\d)(?!\s*(?:k\b|nghìn|ngàn|tr\b|triệu|đ\b|đồng|vnd|hộp|viên|%|kg)))  # cao 165 / muốn 170
+    | (?P<goal>\b(?:muốn|mong|mục\s+tiêu|ước|đạt|lên)\b)
+    )
+    """,
+    re.VERBOSE | re.IGNORECASE
+)
+_DIGIT = re.compile(r"\d")
+
+
+class Measurements:
+    """Tuổi / chiều cao (cm) trích từ một tin nhắn"""
+
+    __slots__ = ("age", "height", "target_height", "heights")
+
+    def __init__(self):
+        self.age: Optional[int] = None
+        self.height: Optional[int] = None
+        self.target_height: Optional[int] = None
+        # Mọi chiều cao gặp được, theo thứ tự trong câu
+        self.heights: List[int] = []
+
+    def __repr__(self) -> str:
+        return (
+            f"Measurements(age={self.age}, height={self.height}, "
+            f"target_height={self.target_height})"
+        )
+
+
+def _in_range(value: int, bounds) -> Optional[int]:
+    return value if bounds[0] <= value <= bounds[1] else None
+
+
+def _height(match) -> Optional[int]:
+    kind = match.lastgroup
+    if kind == "m_cm":
+        cm = match.group("m_cm_cm")
+        value = int(match.group("m_cm_m")) * 100 + int(cm) * (10 if len(cm) == 1 else 1)
+    elif kind == "dec":
+        frac = match.group("dec_frac")
+        value = int(match.group("dec_m")) * 100 + int(frac) * (10 if len(frac) == 1 else 1)
+    elif kind == "cm":
+        value = int(match.group("cm_v"))
+    else:
+        value = int(match.group("bare_v"))
+    return _in_range(value, HEIGHT_RANGE)
+
+
+def extract(text: str) -> Measurements:
+    """
+    Trích tuổi, chiều cao hiện tại và chiều cao mong muốn (đơn vị cm)
+
+    Chiều cao đứng sau từ chỉ mục tiêu ("muốn", "mục tiêu", "lên"...) là
+    target_height, còn lại là chiều cao hiện tại. Số trần (không đơn vị)
+    chỉ được coi là chiều cao khi có "cao" phía trước hoặc sau từ mục tiêu.
+    """
+    result = Measurements()
+    if not _DIGIT.search(text):
+        # Không có số thì không có tuổi / chiều cao: bỏ qua phần lớn tin nhắn
+        return result
+
+    goal = False
+    for match in _PATTERN.finditer(unicodedata.normalize("NFC", text)):
+        kind = match.lastgroup
+        if kind == "goal":
+            goal = True
+            continue
+
+        if kind.startswith("age"):
+            age = _in_range(int(match.group(f"{kind}_v")), AGE_RANGE)
+            if age is not None and result.age is None:
+                result.age = age
+            continue
+
+        if kind == "bare" and not goal and match.group(0)[:3].lower() != "cao":
+            continue
+        height = _height(match)
+        if height is None:
+            continue
+        result.heights.append(height)
+        if goal and result.target_height is None:
+            result.target_height = height
+        elif not goal and result.height is None:
+            result.height = height
+    return result
+
+
+def normalize_age(value: Any) -> Optional[int]:
+    """Giá trị slot / entity tuổi ("20", "20 tuổi", 20) -> int"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return _in_range(int(value), AGE_RANGE)
+    text = str(value).strip()
+    if text.isdigit():
+        return _in_range(int(text), AGE_RANGE)
+    return extract(text).age
+
+
+def normalize_height(value: Any) -> Optional[int]:
+    """Giá trị slot / entity chiều cao ("1m70", "1.70m", "170 cm", 170) -> cm"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, float) and value < 3:
+        value = round(value * 100)  # 1.7 (mét)
+    if isinstance(value, (int, float)):
+        return _in_range(int(value), HEIGHT_RANGE)
+    text = str(value).strip()
+    if text.isdigit():
+        return _in_range(int(text), HEIGHT_RANGE)
+    try:
+        return normalize_height(float(text.replace(",", ".")))
+    except ValueError:
+        pass
+    match = _PATTERN.fullmatch(text)
+    if match is not None and match.lastgroup in ("m_cm", "dec", "cm", "bare"):
+        return _height(match)
+    heights = extract(text).heights
+    return heights[0] if heights else None
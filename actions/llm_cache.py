@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import math
+import threading
+import unicodedata
+import logging
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Số kèm đơn vị ngay sau nó: "15 tuổi", "6 hộp", "1m60", "1,7m"
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?\s*[^\W\d_]*")
+
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hoá câu hỏi: NFC, chữ thường, gộp khoảng trắng"""
+    text = unicodedata.normalize("NFC", text).lower()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def char_wb_ngrams(text: str, min_n: int = 1, max_n: int = 4) -> Counter:
+    """
+    N-gram ký tự trong phạm vi từ (giống analyzer "char_wb" của
+    CountVectorsFeaturizer trong config.yml)
+    """
+    grams = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for n in range(min_n, max_n + 1):
+            for i in range(len(padded) - n + 1):
+                grams[padded[i:i + n]] += 1
+    return grams
+
+
+def numeric_tokens(text: str) -> tuple:
+    """Các số (kèm đơn vị) trong câu, không tính thứ tự và khoảng trắng"""
+    return tuple(sorted(match.replace(" ", "") for match in _NUMBER.findall(text)))
+
+
+class _Entry:
+    __slots__ = ("query", "scope", "response", "vector", "norm", "numbers")
+
+    def __init__(self, query: str, scope: str, response: str, vector: Counter):
+        self.query = query
+        self.scope = scope
+        self.response = response
+        self.vector = vector
+        self.norm = math.sqrt(sum(v * v for v in vector.values()))
+        self.numbers = numeric_tokens(query)
+
+
+class SemanticCache:
+    """
+    Cache câu trả lời LLM theo độ tương đồng câu hỏi.
+
+    Câu hỏi mới được so với các câu đã trả lời (cosine trên n-gram
+    ký tự 1-4); nếu độ tương đồng >= threshold thì dùng lại câu trả lời.
+    Chỉ so trong cùng scope (system prompt + context slot), nên khi
+    context khác nhau cache tự động bị bỏ qua. Hai câu phải có cùng các
+    số kèm đơn vị ("15 tuổi" khác "45 tuổi", "1 hộp" khác "6 hộp"):
+    n-gram ký tự gần như không phân biệt được chúng.
+    """
+
+    # Chỉ n-gram dài mới dùng để chọn ứng viên (1-2 gram quá phổ biến)
+    INDEX_MIN_N = 3
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        threshold: float = None,
+        max_entries: int = None,
+        save_every: int = None
+    ):
+        self.path = path if path is not None else os.getenv("LLM_CACHE_PATH", "llm_cache.json")
+        self.threshold = threshold or float(os.getenv("LLM_CACHE_THRESHOLD", 0.9))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2000))
+        self.save_every = save_every or int(os.getenv("LLM_CACHE_SAVE_EVERY", 20))
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._index: Dict[tuple, Set[int]] = {}
+        self._next_id = 0
+        self._unsaved = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        self.load()
+
+    # ---------- index ----------
+
+    def _index_keys(self, entry: _Entry):
+        return [(entry.scope, gram) for gram in entry.vector if len(gram) >= self.INDEX_MIN_N]
+
+    def _add(self, query: str, scope: str, response: str):
+        entry = _Entry(query, scope, response, char_wb_ngrams(query))
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        for key in self._index_keys(entry):
+            self._index.setdefault(key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            old_id, old = self._entries.popitem(last=False)
+            for key in self._index_keys(old):
+                ids = self._index.get(key)
+                if ids:
+                    ids.discard(old_id)
+                    if not ids:
+                        del self._index[key]
+            self.evictions += 1
+
+    # ---------- API ----------
+
+    def lookup(self, query: str, scope: str = "") -> Optional[str]:
+        """Tìm câu trả lời cho câu hỏi gần giống trong cùng scope"""
+        query = normalize_query(query)
+        vector = char_wb_ngrams(query)
+        numbers = numeric_tokens(query)
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        if not norm:
+            return None
+
+        with self._lock:
+            candidates = set()
+            for gram in vector:
+                if len(gram) >= self.INDEX_MIN_N:
+                    candidates |= self._index.get((scope, gram), set())
+
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.numbers != numbers:
+                    continue
+                dot = sum(count * entry.vector.get(gram, 0) for gram, count in vector.items())
+                score = dot / (norm * entry.norm)
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                logger.info(f"LLM cache hit (similarity={best_score:.3f})")
+                return self._entries[best_id].response
+
+            self.misses += 1
+            return None
+
+    def store(self, query: str, scope: str, response: str):
+        """Lưu câu trả lời mới"""
+        with self._lock:
+            self._add(normalize_query(query), scope, response)
+            self.stores += 1
+            self._unsaved += 1
+            if self.path and self._unsaved >= self.save_every:
+                self.save()
+
+    def save(self):
+        """Ghi cache xuống đĩa (ghi file tạm rồi rename)"""
+        if not self.path:
+            return
+        with self._lock:
+            data = [
+                {"query": e.query, "scope": e.scope, "response": e.response}
+                for e in self._entries.values()
+            ]
+            self._unsaved = 0
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Không ghi được LLM cache: {e}")
+
+    def load(self):
+        """Nạp cache đã lưu (nếu có)"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                for item in data:
+                    self._add(item["query"], item["scope"], item["response"])
+            logger.info(f"Loaded {len(self._entries)} LLM cache entries from {self.path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Không đọc được LLM cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class ConversationContextCache:
+    """
+    Lưu mảng `context` (token) Ollama trả về theo từng sender.
+
+    Lượt sau của cùng sender gửi lại context này nên model chỉ phải
+    prefill phần câu hỏi mới. Giới hạn theo số sender và tổng số token,
+    bỏ sender ít dùng nhất (LRU) khi vượt.
+    """
+
+    def __init__(self, max_senders: int = None, max_tokens: int = None, max_context: int = None):
+        self.max_senders = max_senders or int(os.getenv("LLM_CONTEXT_MAX_SENDERS", 1000))
+        self.max_tokens = max_tokens or int(os.getenv("LLM_CONTEXT_MAX_TOKENS", 4000000))
+        # Context dài hơn mức này thì bỏ (tránh vượt cửa sổ context của model)
+        self.max_context = max_context or int(os.getenv("LLM_CONTEXT_MAX_LENGTH", 6000))
+
+        self._contexts: "OrderedDict[str, list]" = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, sender_id: str) -> Optional[list]:
+        with self._lock:
+            context = self._contexts.get(sender_id)
+            if context is None:
+                self.misses += 1
+                return None
+            self._contexts.move_to_end(sender_id)
+            self.hits += 1
+            return context
+
+    def put(self, sender_id: str, context: Optional[list]):
+        with self._lock:
+            old = self._contexts.pop(sender_id, None)
+            if old is not None:
+                self._tokens -= len(old)
+
+            if not context or len(context) > self.max_context:
+                return
+
+            self._contexts[sender_id] = context
+            self._tokens += len(context)
+
+            while self._contexts and (
+                len(self._contexts) > self.max_senders or self._tokens > self.max_tokens
+            ):
+                _, evicted = self._contexts.popitem(last=False)
+                self._tokens -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "senders": len(self._contexts),
+                "tokens": self._tokens,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
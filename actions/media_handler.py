@@ -1,81 +1,275 @@
 import os
+import time
+import threading
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import json
 import logging
 
+try:
+    from PIL import Image
+except ImportError:  # Pillow là tuỳ chọn: không có thì không tạo thumbnail
+    Image = None
+
 logger = logging.getLogger(__name__)
 
+MEDIA_KINDS = ("images", "documents", "videos")
+
+# Thư mục con (trong images/) chứa ảnh thu nhỏ: .thumbs/<width>/<name>
+THUMBNAIL_DIR = ".thumbs"
+
+# Thư mục gốc của project (actions/..): đường dẫn media không phụ thuộc CWD
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+class MediaFile:
+    """Một file trong catalog (thông tin lấy từ một lần stat())"""
+
+    __slots__ = ("name", "path", "size", "mtime", "mtime_ns")
+
+    def __init__(self, name: str, path: str, size: int, mtime_ns: int):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.mtime = mtime_ns / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "size": self.size, "modified": self.mtime}
+
+
 class MediaHandler:
-    """Quản lý hình ảnh, PDF, video"""
-    
-    def __init__(self, media_dir: str = "data/knowledge_base"):
-        self.media_dir = Path(media_dir)
+    """
+    Quản lý hình ảnh, PDF, video
+
+    Catalog được giữ trong RAM ({kind: {name: MediaFile}}), nên tra cứu chỉ
+    là dict lookup. refresh() chỉ quét lại thư mục có mtime thay đổi (thêm /
+    xoá / đổi tên file) và giữ nguyên entry của file không đổi. Sửa nội dung
+    file tại chỗ không đổi mtime thư mục, nên cứ rescan_interval giây quét
+    toàn bộ một lần.
+    """
+
+    def __init__(
+        self,
+        media_dir: str = None,
+        refresh_interval: float = None,
+        rescan_interval: float = None
+    ):
+        # Đường dẫn tuyệt đối: send_file của Flask hiểu đường dẫn tương đối
+        # theo app.root_path, không theo CWD lúc quét catalog
+        media_dir = media_dir or os.getenv("MEDIA_DIR", "data/knowledge_base")
+        self.media_dir = (PROJECT_DIR / media_dir).resolve()
         self.images_dir = self.media_dir / "images"
         self.documents_dir = self.media_dir / "documents"
         self.videos_dir = self.media_dir / "videos"
-    
+        self.dirs = {
+            "images": self.images_dir,
+            "documents": self.documents_dir,
+            "videos": self.videos_dir
+        }
+
+        # Tra cứu trong khoảng này không stat() thư mục
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(
+            os.getenv("MEDIA_REFRESH_INTERVAL", 2.0)
+        )
+        self.rescan_interval = rescan_interval if rescan_interval is not None else float(
+            os.getenv("MEDIA_RESCAN_INTERVAL", 60.0)
+        )
+        # Các chiều rộng thumbnail cho phép (tránh tạo file theo tham số tuỳ ý)
+        self.thumbnail_widths = tuple(
+            int(w) for w in os.getenv("MEDIA_THUMBNAIL_WIDTHS", "160,320,640").split(",") if w.strip()
+        )
+
+        self._catalog: Dict[str, Dict[str, MediaFile]] = {kind: {} for kind in MEDIA_KINDS}
+        self._dir_stamps: Dict[str, Optional[int]] = {kind: None for kind in MEDIA_KINDS}
+        self._thumbnails: Dict[Tuple[str, int], MediaFile] = {}
+        self._checked_at = 0.0
+        self._rescanned_at = 0.0
+        self._lock = threading.Lock()
+        self._thumbnail_lock = threading.Lock()
+
+        self.scans = 0
+        self.files_updated = 0
+        self.thumbnails_generated = 0
+
+        self.refresh(force=True)
+
+    # ---------- catalog ----------
+
+    def refresh(self, force: bool = False):
+        """Cập nhật catalog theo mtime của từng thư mục"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return
+
+        with self._lock:
+            full = force or now - self._rescanned_at >= self.rescan_interval
+            for kind, directory in self.dirs.items():
+                try:
+                    stamp = os.stat(directory).st_mtime_ns
+                except OSError:
+                    stamp = None
+
+                if stamp == self._dir_stamps[kind] and not full:
+                    continue
+
+                self._catalog[kind] = self._scan(directory, self._catalog[kind]) if stamp else {}
+                self._dir_stamps[kind] = stamp
+
+            if full:
+                self._rescanned_at = now
+            self._checked_at = now
+
+    def _scan(self, directory: Path, previous: Dict[str, MediaFile]) -> Dict[str, MediaFile]:
+        """Quét một thư mục, dùng lại entry cũ nếu size/mtime không đổi"""
+        catalog = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+
+                    old = previous.get(entry.name)
+                    if old is not None and old.mtime_ns == st.st_mtime_ns and old.size == st.st_size:
+                        catalog[entry.name] = old
+                    else:
+                        catalog[entry.name] = MediaFile(entry.name, entry.path, st.st_size, st.st_mtime_ns)
+                        self.files_updated += 1
+        except OSError as e:
+            logger.warning(f"Không quét được {directory}: {e}")
+
+        self.scans += 1
+        return catalog
+
+    def get(self, kind: str, name: str) -> Optional[MediaFile]:
+        """Tra một file trong catalog"""
+        self.refresh()
+        return self._catalog.get(kind, {}).get(name)
+
+    # ---------- thumbnail ----------
+
+    def thumbnail_width(self, width: int) -> Optional[int]:
+        """Chiều rộng thumbnail nhỏ nhất >= width (None nếu lớn hơn mọi mức)"""
+        return next((w for w in sorted(self.thumbnail_widths) if w >= width), None)
+
+    def get_thumbnail(self, name: str, width: int) -> Optional[MediaFile]:
+        """
+        Ảnh thu nhỏ của một ảnh trong catalog
+
+        Thumbnail được tạo sẵn trong images/.thumbs/<width>/ và tạo lại khi
+        ảnh gốc đổi; ảnh gốc đã đủ nhỏ thì trả về chính nó. Trả về None nếu
+        không có Pillow hoặc không tạo được thumbnail.
+        """
+        source = self.get("images", name)
+        width = self.thumbnail_width(width)
+        if source is None or width is None or Image is None:
+            return None
+
+        key = (name, width)
+        thumb = self._thumbnails.get(key)
+        if thumb is not None and thumb.mtime_ns >= source.mtime_ns:
+            return thumb
+
+        with self._thumbnail_lock:
+            thumb = self._thumbnails.get(key)
+            if thumb is None or thumb.mtime_ns < source.mtime_ns:
+                thumb = self._make_thumbnail(source, width)
+                if thumb is not None:
+                    self._thumbnails[key] = thumb
+        return thumb
+
+    def _make_thumbnail(self, source: MediaFile, width: int) -> Optional[MediaFile]:
+        path = self.images_dir / THUMBNAIL_DIR / str(width) / source.name
+        try:
+            st = os.stat(path)
+            if st.st_mtime_ns >= source.mtime_ns:
+                # Đã tạo từ lần chạy trước
+                return MediaFile(source.name, str(path), st.st_size, st.st_mtime_ns)
+        except OSError:
+            pass
+
+        try:
+            with Image.open(source.path) as image:
+                if image.width <= width:
+                    # Ảnh gốc đã đủ nhỏ: dùng luôn ảnh gốc
+                    return source
+                image_format = image.format
+                image.thumbnail((width, image.height * width // image.width + 1))
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{path.name}.tmp")
+                image.save(tmp_path, format=image_format)
+            os.replace(tmp_path, path)
+            st = os.stat(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không tạo được thumbnail {source.name} ({width}px): {e}")
+            return None
+
+        self.thumbnails_generated += 1
+        return MediaFile(source.name, str(path), st.st_size, st.st_mtime_ns)
+
+    def pregenerate_thumbnails(self):
+        """Tạo trước thumbnail cho mọi ảnh (chạy ở background khi khởi động)"""
+        if Image is None:
+            return
+        for name in self.list_available_images():
+            for width in self.thumbnail_widths:
+                self.get_thumbnail(name, width)
+
+    def _lookup(self, kind: str, name: str) -> Optional[str]:
+        media = self.get(kind, name)
+        if media is not None:
+            return media.path
+        logger.warning(f"{kind} not found: {name}")
+        return None
+
+    # ---------- API ----------
+
     def get_product_image(self, product_name: str = "unigrow") -> Optional[str]:
         """Lấy ảnh sản phẩm"""
-        image_path = self.images_dir / f"{product_name}.png"
-        if image_path.exists():
-            logger.info(f"Found image: {image_path}")
-            return str(image_path)
-        logger.warning(f"Image not found: {image_path}")
-        return None
-    
+        return self._lookup("images", f"{product_name}.png")
+
     def get_document_path(self, doc_name: str) -> Optional[str]:
         """Lấy đường dẫn PDF/document"""
-        doc_path = self.documents_dir / doc_name
-        if doc_path.exists():
-            logger.info(f"Found document: {doc_path}")
-            return str(doc_path)
-        logger.warning(f"Document not found: {doc_path}")
-        return None
-    
+        return self._lookup("documents", doc_name)
+
+    def get_video_path(self, video_name: str) -> Optional[str]:
+        """Lấy đường dẫn video"""
+        return self._lookup("videos", video_name)
+
     def list_available_documents(self) -> List[str]:
         """Liệt kê các tài liệu có sẵn"""
-        if self.documents_dir.exists():
-            docs = [f.name for f in self.documents_dir.glob("*")]
-            logger.info(f"Found {len(docs)} documents")
-            return docs
-        return []
-    
+        self.refresh()
+        return sorted(self._catalog["documents"])
+
     def list_available_images(self) -> List[str]:
         """Liệt kê các ảnh có sẵn"""
-        if self.images_dir.exists():
-            images = [f.name for f in self.images_dir.glob("*")]
-            logger.info(f"Found {len(images)} images")
-            return images
-        return []
-    
+        self.refresh()
+        return sorted(self._catalog["images"])
+
+    def list_available_videos(self) -> List[str]:
+        """Liệt kê các video có sẵn"""
+        self.refresh()
+        return sorted(self._catalog["videos"])
+
     def get_media_metadata(self) -> Dict[str, Any]:
         """Lấy metadata của tất cả media"""
-        metadata = {
-            "images": [],
-            "documents": [],
-            "videos": []
+        self.refresh()
+        return {
+            kind: [self._catalog[kind][name].to_dict() for name in sorted(self._catalog[kind])]
+            for kind in MEDIA_KINDS
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **{kind: len(self._catalog[kind]) for kind in MEDIA_KINDS},
+            "scans": self.scans,
+            "files_updated": self.files_updated,
+            "thumbnails_generated": self.thumbnails_generated
         }
-        
-        # Images
-        for img in self.list_available_images():
-            img_path = self.images_dir / img
-            metadata["images"].append({
-                "name": img,
-                "size": img_path.stat().st_size,
-                "modified": img_path.stat().st_mtime
-            })
-        
-        # Documents
-        for doc in self.list_available_documents():
-            doc_path = self.documents_dir / doc
-            metadata["documents"].append({
-                "name": doc,
-                "size": doc_path.stat().st_size,
-                "modified": doc_path.stat().st_mtime
-            })
-        
-        return metadata
 
 # Global media handler instance
 media_handler = MediaHandler()
@@ -0,0 +1,378 @@
+import heapq
+import os
+import random
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có flock, chỉ giới hạn trong từng process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Circuit breaker đang mở: không gọi backend"""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff với full jitter: random(0, min(cap, base * 2^attempt))"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker đơn giản (closed -> open -> half-open).
+
+    Sau failure_threshold lỗi liên tiếp, breaker mở và mọi lời gọi bị
+    từ chối ngay trong reset_timeout giây. Hết thời gian đó, một lời gọi
+    thử (half-open) được đi qua: thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Lời gọi bị huỷ giữa chừng: trả lượt probe half-open, không tính đúng/sai"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                    logger.warning(f"Circuit breaker opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+
+
+class TokenBucket:
+    """
+    Token bucket giới hạn tốc độ: `rate` token/giây, tích tối đa `burst` token.
+
+    reserve() đặt trước một token (số token có thể âm) và trả về thời gian
+    phải chờ tới lượt; acquire() ngủ đúng khoảng đó ngoài lock, nên các
+    luồng chờ được phục vụ theo thứ tự gọi.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.throttled = 0
+
+    def reserve(self) -> float:
+        """Đặt trước một token; trả về số giây phải chờ trước khi dùng nó"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            self.throttled += 1
+            return -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        """Lấy một token, chờ nếu cần; trả về thời gian đã chờ (giây)"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class OverloadedError(Exception):
+    """Hàng đợi LLM quá sâu hoặc thời gian chờ ước tính quá lâu: bỏ request"""
+
+
+# Độ ưu tiên (số nhỏ được phục vụ trước)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "granted", "evicted", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.evicted = False
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """
+    Giới hạn số lời gọi LLM chạy đồng thời, có hàng đợi ưu tiên.
+
+    Khi hết slot, request vào hàng đợi theo priority (FIFO trong cùng
+    priority). Request bị từ chối ngay (OverloadedError) nếu hàng đợi đã
+    đầy hoặc thời gian chờ ước tính (theo EWMA thời gian phục vụ) vượt
+    max_wait; request đã vào hàng nhưng chờ quá max_wait cũng bị từ chối.
+    Khi hàng đầy, request ưu tiên cao đẩy request ưu tiên thấp nhất ra.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        max_queue: int = 16,
+        max_wait: float = 10.0,
+        initial_service_time: float = 5.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.service_time = initial_service_time
+
+        self._active = 0
+        self._queue: List[_Waiter] = []
+        self._seq = 0
+        self._cond = threading.Condition()
+
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.wait_time_sum = 0.0
+        self.wait_time_max = 0.0
+
+    def estimated_wait(self, position: int) -> float:
+        """Thời gian chờ ước tính cho request đứng thứ `position` trong hàng"""
+        return (position // self.max_concurrency + 1) * self.service_time
+
+    def acquire(self, priority: int = PRIORITY_NORMAL) -> float:
+        """
+        Chờ tới khi có slot
+
+        Returns:
+            Thời gian đã chờ (giây)
+
+        Raises:
+            OverloadedError: bị shed
+        """
+        with self._cond:
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self._record_admit(0.0)
+                return 0.0
+
+            ahead = sum(1 for w in self._queue if w.priority <= priority)
+            if self.estimated_wait(ahead) > self.max_wait:
+                self.shed += 1
+                raise OverloadedError()
+
+            if len(self._queue) >= self.max_queue:
+                worst = max(self._queue)
+                if worst.priority <= priority:
+                    self.shed += 1
+                    raise OverloadedError()
+                # Nhường chỗ: bỏ request ưu tiên thấp nhất đang chờ
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                worst.evicted = True
+                self._cond.notify_all()
+
+            self._seq += 1
+            waiter = _Waiter(priority, self._seq)
+            heapq.heappush(self._queue, waiter)
+
+            deadline = waiter.enqueued_at + self.max_wait
+            while not waiter.granted:
+                if waiter.evicted:
+                    self.shed += 1
+                    raise OverloadedError()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+                    self.timed_out += 1
+                    self.shed += 1
+                    raise OverloadedError()
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - waiter.enqueued_at
+            self._record_admit(waited)
+            return waited
+
+    def _record_admit(self, waited: float):
+        self.admitted += 1
+        self.wait_time_sum += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def release(self, service_time: Optional[float] = None):
+        """Trả slot; slot được chuyển thẳng cho request ưu tiên nhất đang chờ"""
+        with self._cond:
+            if service_time is not None:
+                # EWMA thời gian phục vụ để ước tính thời gian chờ
+                self.service_time = 0.8 * self.service_time + 0.2 * service_time
+
+            if self._queue:
+                waiter = heapq.heappop(self._queue)
+                waiter.granted = True
+                self._cond.notify_all()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_NORMAL):
+        self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "estimated_service_time": self.service_time,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "timed_out": self.timed_out,
+                "wait_time_sum": self.wait_time_sum,
+                "wait_time_max": self.wait_time_max
+            }
+
+
+class SharedSlots:
+    """
+    Semaphore dùng chung giữa các process trên cùng máy (action server và
+    mọi worker gunicorn của web server) trước một backend duy nhất.
+
+    Mỗi slot là một file trong `directory`, giữ bằng flock(LOCK_EX): process
+    chết thì kernel tự nhả lock, không có slot bị kẹt. Process không lấy
+    được slot nào thì thử lại sau `poll` giây cho tới hết timeout.
+    """
+
+    supported = fcntl is not None
+
+    def __init__(self, directory: str, slots: int, poll: float = 0.02):
+        self.directory = directory
+        self.slots = slots
+        self.poll = poll
+        os.makedirs(directory, exist_ok=True)
+        self._paths = [os.path.join(directory, f"slot-{i}.lock") for i in range(slots)]
+
+        self.acquired = 0
+        self.timed_out = 0
+        self.wait_time_sum = 0.0
+
+    def _try_acquire(self) -> Optional[int]:
+        # Bắt đầu từ slot ngẫu nhiên để các process không cùng tranh slot 0
+        start = random.randrange(self.slots)
+        for i in range(self.slots):
+            fd = os.open(self._paths[(start + i) % self.slots], os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+            except BaseException:
+                os.close(fd)
+                raise
+        return None
+
+    def acquire(self, timeout: float) -> int:
+        """
+        Chờ tới khi có slot
+
+        Returns:
+            Lease (file descriptor), trả lại bằng release()
+
+        Raises:
+            OverloadedError: hết timeout mà không có slot
+        """
+        started = time.monotonic()
+        while True:
+            fd = self._try_acquire()
+            if fd is not None:
+                self.acquired += 1
+                self.wait_time_sum += time.monotonic() - started
+                return fd
+            if time.monotonic() - started + self.poll > timeout:
+                self.timed_out += 1
+                raise OverloadedError()
+            time.sleep(self.poll)
+
+    def release(self, lease: int):
+        # Đóng fd là nhả flock
+        os.close(lease)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "directory": self.directory,
+            "acquired": self.acquired,
+            "timed_out": self.timed_out,
+            "wait_time_sum": self.wait_time_sum
+        }
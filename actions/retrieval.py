@@ -0,0 +1,299 @@
+import os
+import re
+import json
+import math
+import threading
+import unicodedata
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tăng khi đổi cách tokenize / cấu trúc index để index cũ tự build lại
+INDEX_VERSION = 1
+
+_QUESTION = re.compile(r"^###\s*Q(\d+)\s*:\s*(.+?)\s*$")
+_ANSWER = re.compile(r"^\*\*A:\*\*\s*")
+_SECTION = re.compile(r"^##\s+(?!#)(.+?)\s*$")
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tách từ cho tiếng Việt: NFC, chữ thường, âm tiết + cặp âm tiết liền kề
+
+    Từ tiếng Việt thường gồm nhiều âm tiết ("chiều cao", "tác dụng phụ")
+    nên thêm bigram để khớp cụm từ chặt hơn so với từng âm tiết rời.
+    """
+    words = _WORD.findall(unicodedata.normalize("NFC", text).lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class FaqEntry:
+    __slots__ = ("id", "section", "question", "answer")
+
+    def __init__(self, id: str, section: str, question: str, answer: str):
+        self.id = id
+        self.section = section
+        self.question = question
+        self.answer = answer
+
+    def to_dict(self) -> Dict[str, str]:
+        return {
+            "id": self.id,
+            "section": self.section,
+            "question": self.question,
+            "answer": self.answer
+        }
+
+
+def parse_faq(text: str) -> List[FaqEntry]:
+    """Tách FAQ.md thành các cặp "### Qn: câu hỏi" / "**A:** câu trả lời" """
+    entries = []
+    section = ""
+    current = None
+
+    for line in text.splitlines():
+        question = _QUESTION.match(line)
+        heading = _SECTION.match(line)
+        if question or heading:
+            if current is not None:
+                entries.append(current)
+                current = None
+            if heading:
+                section = heading.group(1)
+            else:
+                current = FaqEntry(f"Q{question.group(1)}", section, question.group(2), "")
+        elif current is not None:
+            current.answer += _ANSWER.sub("", line) + "\n"
+
+    if current is not None:
+        entries.append(current)
+
+    for entry in entries:
+        # Bỏ dòng kẻ "---" cuối file
+        entry.answer = entry.answer.strip().rstrip("-").strip()
+    return [entry for entry in entries if entry.answer]
+
+
+class FaqIndex:
+    """
+    Inverted index BM25 trên FAQ.md.
+
+    Index được ghi ra file JSON kèm mtime/size của FAQ; lần khởi động sau
+    nạp lại luôn nếu FAQ không đổi. Câu hỏi có trọng số gấp đôi câu trả lời.
+    Trong top-k, entry có câu hỏi khớp câu hỏi user đủ chặt (confidence()
+    >= direct_threshold) được dùng làm câu trả lời thẳng, không gọi LLM.
+    """
+
+    K1 = 1.5
+    B = 0.75
+    QUESTION_WEIGHT = 2
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        index_path: Optional[str] = None,
+        direct_threshold: float = None,
+        min_score: float = None
+    ):
+        self.path = path or os.getenv("FAQ_PATH", "data/knowledge_base/FAQ.md")
+        self.index_path = index_path if index_path is not None else os.getenv("FAQ_INDEX_PATH", "faq_index.json")
+        self.direct_threshold = direct_threshold or float(os.getenv("FAQ_DIRECT_THRESHOLD", 0.8))
+        self.min_score = min_score or float(os.getenv("FAQ_MIN_SCORE", 1.0))
+
+        self.entries: List[FaqEntry] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._idf: Dict[str, float] = {}
+        self._question_terms: List[set] = []
+        self._doc_len: List[int] = []
+        self._avgdl = 0.0
+        self._source: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.direct_hits = 0
+        self.builds = 0
+
+        self.refresh()
+
+    # ---------- build / load ----------
+
+    def _source_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def refresh(self):
+        """Nạp lại index nếu FAQ.md đã thay đổi (một lần stat())"""
+        stamp = self._source_stamp()
+        if stamp == self._source:
+            return
+        with self._lock:
+            if stamp == self._source:
+                return
+            if stamp is None:
+                logger.warning(f"Không tìm thấy FAQ: {self.path}")
+                self._set([], {}, [])
+            elif not self._load(stamp):
+                self._build(stamp)
+            self._source = stamp
+
+    def _build(self, stamp: Tuple[int, int]):
+        with open(self.path, encoding="utf-8") as f:
+            entries = parse_faq(f.read())
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_len = []
+        for doc_id, entry in enumerate(entries):
+            terms = Counter(tokenize(entry.answer))
+            for term in tokenize(entry.question):
+                terms[term] += self.QUESTION_WEIGHT
+            doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        self._set(entries, postings, doc_len)
+        self.builds += 1
+        logger.info(f"Built FAQ index: {len(entries)} entries, {len(postings)} terms")
+
+        if self.index_path:
+            self._save(stamp)
+
+    def _set(self, entries, postings, doc_len):
+        n = len(entries)
+        self.entries = entries
+        self._postings = postings
+        self._doc_len = doc_len
+        self._avgdl = sum(doc_len) / n if n else 0.0
+        self._idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+        self._question_terms = [
+            {t for t in tokenize(e.question) if " " not in t} for e in entries
+        ]
+
+    def _save(self, stamp: Tuple[int, int]):
+        data = {
+            "version": INDEX_VERSION,
+            "source": {"path": self.path, "mtime_ns": stamp[0], "size": stamp[1]},
+            "entries": [e.to_dict() for e in self.entries],
+            "postings": self._postings,
+            "doc_len": self._doc_len
+        }
+        try:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.error(f"Không ghi được FAQ index: {e}")
+
+    def _load(self, stamp: Tuple[int, int]) -> bool:
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+            source = data["source"]
+            if (
+                data.get("version") != INDEX_VERSION
+                or source["path"] != self.path
+                or (source["mtime_ns"], source["size"]) != stamp
+            ):
+                return False
+            entries = [FaqEntry(**item) for item in data["entries"]]
+            postings = {
+                term: [tuple(p) for p in docs] for term, docs in data["postings"].items()
+            }
+            self._set(entries, postings, data["doc_len"])
+            logger.info(f"Loaded FAQ index ({len(entries)} entries) from {self.index_path}")
+            return True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Không đọc được FAQ index: {e}")
+            return False
+
+    # ---------- search ----------
+
+    def _search(self, query: str, k: int) -> List[Tuple[float, int]]:
+        self.refresh()
+        postings, idf = self._postings, self._idf
+        doc_len, avgdl = self._doc_len, self._avgdl
+        if not doc_len:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            for doc_id, tf in postings.get(term, ()):
+                norm = self.K1 * (1 - self.B + self.B * doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * tf * (self.K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, doc_id) for doc_id, score in ranked if score >= self.min_score]
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[float, FaqEntry]]:
+        """Top-k entry theo điểm BM25 (bỏ các entry dưới min_score)"""
+        return [(score, self.entries[doc_id]) for score, doc_id in self._search(query, k)]
+
+    def confidence(self, query: str, doc_id: int) -> float:
+        """
+        Độ khớp giữa câu hỏi user và câu hỏi FAQ (0..1)
+
+        Trung bình điều hoà của hai tỉ lệ trọng số IDF: phần câu hỏi user
+        có trong câu hỏi FAQ và phần câu hỏi FAQ có trong câu hỏi user.
+        Chỉ xét từng âm tiết để không phụ thuộc thứ tự từ.
+        """
+        terms = {t for t in tokenize(query) if " " not in t}
+        question_terms = self._question_terms[doc_id]
+        if not terms or not question_terms:
+            return 0.0
+        # Từ không có trong FAQ coi như hiếm nhất (câu lạc đề -> độ tin cậy thấp)
+        unknown = max(self._idf.values(), default=1.0)
+        common = sum(self._idf[t] for t in terms & question_terms)
+        query_weight = sum(self._idf.get(t, unknown) for t in terms)
+        question_weight = sum(self._idf[t] for t in question_terms)
+        if not common:
+            return 0.0
+        recall, precision = common / query_weight, common / question_weight
+        return 2 * recall * precision / (recall + precision)
+
+    def answer(self, query: str, k: int = 3) -> Tuple[Optional[FaqEntry], List[FaqEntry]]:
+        """
+        Tra FAQ cho một câu hỏi
+
+        Returns:
+            (entry trả lời thẳng hoặc None, top-k entry làm ngữ cảnh cho LLM)
+        """
+        results = self._search(query, k)
+        self.lookups += 1
+        if not results:
+            return None, []
+
+        passages = [self.entries[doc_id] for _, doc_id in results]
+        confidence, doc_id = max((self.confidence(query, doc_id), doc_id) for _, doc_id in results)
+        if confidence >= self.direct_threshold:
+            self.direct_hits += 1
+            return self.entries[doc_id], passages
+        return None, passages
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "terms": len(self._postings),
+            "builds": self.builds,
+            "lookups": self.lookups,
+            "direct_hits": self.direct_hits
+        }
+
+
+def format_passages(entries: List[FaqEntry]) -> str:
+    """Ghép các entry FAQ thành đoạn ngữ cảnh cho prompt"""
+    return "\n\n".join(f"Hỏi: {e.question}\nĐáp: {e.answer}" for e in entries)
+
+
+# Global FAQ index
+faq_index = FaqIndex()
@@ -0,0 +1,113 @@
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Set
+
+# fetch(after, limit) -> tối đa `limit` recipient_id đứng sau `after` (None = từ đầu)
+CohortFetcher = Callable[[Optional[str], int], List[str]]
+
+_DAILY = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+# (tên trường, min, max)
+_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 6),
+)
+
+
+def _parse_field(text: str, low: int, high: int) -> Set[int]:
+    values = set()
+    for part in text.split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = high
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Giá trị cron không hợp lệ: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    Lịch dạng cron 5 trường "phút giờ ngày tháng thứ" (0 = Chủ nhật),
+    hỗ trợ *, danh sách, khoảng và bước. "HH:MM" là viết tắt của lịch
+    hằng ngày. Tính theo giờ địa phương giống schedule_daily_reminder.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec.strip()
+        daily = _DAILY.match(self.spec)
+        fields = (
+            [daily.group(2), daily.group(1), "*", "*", "*"] if daily else self.spec.split()
+        )
+        if len(fields) != 5:
+            raise ValueError(f"Lịch không hợp lệ: {spec}")
+
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(text, low, high) for text, (_, low, high) in zip(fields, _FIELDS)
+        )
+        # Giống cron: nếu giới hạn cả ngày trong tháng và thứ thì khớp một trong hai
+        self._day_any = fields[2] == "*"
+        self._weekday_any = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._day_any or self._weekday_any:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """Thời điểm khớp lịch đầu tiên sau `after` (nhảy theo tháng/ngày/giờ)"""
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after + timedelta(days=366 * 5)
+        while dt <= limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Lịch không bao giờ khớp: {self.spec}")
+
+
+def sqlite_cohort(db_path: str, table: str, column: str, where: str = "") -> CohortFetcher:
+    """
+    Cohort đọc recipient từ một bảng SQLite theo keyset (column > after),
+    mỗi lần một trang; không giữ danh sách recipient trong RAM
+    """
+    condition = f" AND ({where})" if where else ""
+    query = (
+        f'SELECT "{column}" FROM "{table}" '
+        f'WHERE "{column}" > ?{condition} ORDER BY "{column}" LIMIT ?'
+    )
+
+    def fetch(after: Optional[str], limit: int) -> List[str]:
+        with closing(sqlite3.connect(db_path)) as conn:
+            rows = conn.execute(query, (_keyset_value(after), limit)).fetchall()
+        return [str(row[0]) for row in rows]
+
+    return fetch
+
+
+def _keyset_value(after: Optional[str]):
+    # Cursor lưu dạng text; id số phải so sánh như số. SQLite xếp số trước
+    # text nên số nhỏ nhất đứng trước mọi giá trị của cột.
+    if after is None:
+        return -2 ** 63
+    return int(after) if after.lstrip("-").isdigit() else after
@@ -1,27 +1,246 @@
+import os
+import math
 import time
+import uuid
+import socket
+import heapq
+import itertools
 import threading
-from datetime import datetime, timedelta
-from typing import List, Callable, Dict, Any
-import json
+from datetime import datetime
+from typing import List, Callable, Dict, Any, Optional, Tuple
 import logging
 
+from .dispatcher import RecipientDispatcher
+from .resilience import TokenBucket, backoff_delay
+from .schedule_rules import CohortFetcher, CronSchedule, sqlite_cohort
+from .scheduler_store import ScheduledMessageStore
+
+# Kênh mặc định của tin nhắn (mỗi kênh có rate limit riêng)
+DEFAULT_CHANNEL = "default"
+
 logger = logging.getLogger(__name__)
 
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, Optional[float]]]:
+    """"zalo=5:10,*=20" -> {"zalo": (5.0, 10.0), "*": (20.0, None)}"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        channel, value = item.split("=", 1)
+        rate, _, burst = value.partition(":")
+        limits[channel.strip()] = (float(rate), float(burst) if burst else None)
+    return limits
+
+class ScheduledJob:
+    """Một tin nhắn đã lên lịch (phần tử của heap, sắp theo thời gian gửi)"""
+    
+    __slots__ = (
+        "id", "recipient_id", "message", "scheduled_time", "channel", "callback", "attempts",
+        "cancelled", "reserved", "shard"
+    )
+    
+    def __init__(
+        self,
+        job_id: int,
+        recipient_id: str,
+        message: str,
+        scheduled_time: float,
+        channel: str = DEFAULT_CHANNEL,
+        callback: Optional[Callable] = None,
+        attempts: int = 0,
+        shard: int = 0
+    ):
+        self.id = job_id
+        self.recipient_id = recipient_id
+        self.message = message
+        self.scheduled_time = scheduled_time
+        self.channel = channel
+        self.callback = callback
+        self.attempts = attempts
+        self.cancelled = False
+        # Đã đặt trước token rate limit (job bị hoãn vì throttle)
+        self.reserved = False
+        # Shard của job (job tạm của rule: shard của rule)
+        self.shard = shard
+    
+    def __lt__(self, other: "ScheduledJob") -> bool:
+        return (self.scheduled_time, self.id) < (other.scheduled_time, other.id)
+
 class MessageScheduler:
-    """Scheduler để gửi tin nhắn tự động theo lịch"""
+    """
+    Scheduler để gửi tin nhắn tự động theo lịch
+    
+    Job nằm trong min-heap theo scheduled_time. Worker ngủ đúng tới job
+    gần nhất và được đánh thức sớm khi có job mới sớm hơn. Huỷ job chỉ
+    đánh dấu (lazy deletion); heap được dọn khi job đã huỷ chiếm quá nửa.
+    
+    Khi có db_path, mọi job được lưu trong SQLite (ScheduledMessageStore).
+    Heap chỉ giữ các job tới mốc _loaded_until (khoảng `window` giây sắp
+    tới, tối đa max_loaded job); phần còn lại nằm trên đĩa và được nạp dần
+    theo trang khi mốc tiến tới. Callback không lưu được xuống đĩa nên sẽ
+    mất nếu restart trước khi gửi.
+    
+    Job đến hạn được gửi trên pool `workers` thread (RecipientDispatcher):
+    tin của cùng recipient theo đúng thứ tự, mỗi kênh có token bucket
+    riêng, gửi lỗi thì thử lại với exponential backoff.
+    
+    Lịch lặp lại (schedule_recurring) chỉ lưu một dòng rule; tới giờ, thread
+    rule đọc cohort theo từng trang page_size recipient và tạo job tạm (id
+    âm, không ghi SQLite). Trang sau chỉ được đọc khi trang trước đã gửi
+    xong và cursor đã lưu, nên RAM không phụ thuộc cỡ cohort; restart giữa
+    chừng thì gửi tiếp từ cursor (tối đa một trang bị gửi lại).
+    
+    Nhiều process / máy dùng chung db_path: mỗi instance chỉ nạp và gửi job,
+    rule của các shard mình đang giữ lease (thread scheduler-leases heartbeat
+    mỗi lease_ttl/3 giây, shard của instance chết được nhận lại sau tối đa
+    lease_ttl giây). Trước khi gửi, job được claim trong SQLite nên một job
+    không bị hai instance cùng gửi; job do instance khác thêm được phát hiện
+    sau tối đa poll_interval giây. Đồng hồ các máy cần được đồng bộ (NTP).
+    """
     
-    def __init__(self):
-        self.scheduled_messages: List[Dict[str, Any]] = []
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        window: float = None,
+        max_loaded: int = None,
+        max_attempts: int = None,
+        workers: int = None,
+        rate_limits: Optional[str] = None
+    ):
+        db_path = db_path if db_path is not None else os.getenv("SCHEDULER_DB", "scheduler.db")
+        self.store = ScheduledMessageStore(db_path) if db_path else None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = float(os.getenv("SCHEDULER_LEASE_TTL", 10.0))
+        self.poll_interval = float(os.getenv("SCHEDULER_POLL_INTERVAL", 1.0))
+        # Shard được trả / sắp hết hạn chỉ đổi chủ sau khoảng này (job đang gửi kịp xong)
+        self._lease_grace = self.lease_ttl / 3
+        self.window = window or float(os.getenv("SCHEDULER_WINDOW", 3600))
+        self.max_loaded = max_loaded or int(os.getenv("SCHEDULER_MAX_LOADED", 100000))
+        self.page_size = min(self.max_loaded, 10000)
+        self.max_attempts = max_attempts or int(os.getenv("SCHEDULER_MAX_ATTEMPTS", 5))
+        self.retry_base = float(os.getenv("SCHEDULER_RETRY_BASE", 2.0))
+        self.retry_cap = float(os.getenv("SCHEDULER_RETRY_CAP", 300.0))
+        
+        # "kênh=rate[:burst]" phân cách bằng dấu phẩy; "*" áp dụng cho kênh còn lại
+        self.rate_limits = parse_rate_limits(
+            rate_limits if rate_limits is not None else os.getenv("SCHEDULER_RATE_LIMITS", "*=20")
+        )
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+        
+        self.send_function: Optional[Callable] = None
+        self.dispatcher = RecipientDispatcher(
+            self._deliver,
+            workers=workers or int(os.getenv("SCHEDULER_WORKERS", 8))
+        )
+        self._sent_ids: List[int] = []
+        self._sent_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        
+        # Rule lặp lại (ở chế độ không có db_path vẫn dùng SQLite trong RAM)
+        self._rules = self.store or ScheduledMessageStore(":memory:")
+        self._cohorts: Dict[str, CohortFetcher] = {}
+        self._rules_wakeup = threading.Event()
+        self._rules_thread = None
+        self._rule_job_ids = itertools.count(-1, -1)
+        self._rule_jobs = 0
+        self._rule_jobs_cond = threading.Condition()
+        
+        # Shard đang giữ lease (chỉ dùng khi có store) và hạn dùng phía local
+        self._owned: frozenset = frozenset()
+        self._lease_valid_until = 0.0
+        self._seen_id = self.store.max_id() if self.store else 0
+        self._lease_thread = None
+        
+        self._heap: List[ScheduledJob] = []
+        self._jobs: Dict[int, ScheduledJob] = {}
+        self._callbacks: Dict[int, Callable] = {}
+        self._ids = itertools.count(1)
+        self._cancelled = 0
+        # Mọi job pending có (scheduled_time, id) <= mốc này đều đã ở trong heap
+        self._loaded_until = (-math.inf, 0) if self.store else (math.inf, 0)
+        self._cond = threading.Condition()
         self.running = False
         self.thread = None
+        
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0
+        self.rule_runs = 0
+    
+    # ---------- heap ----------
+    
+    def _enqueue(self, job: ScheduledJob):
+        """Đưa job vào heap nếu nằm trong khoảng đã nạp (gọi khi giữ _cond)"""
+        if (job.scheduled_time, job.id) > self._loaded_until:
+            return
+        if self.store and job.shard not in self._owned:
+            return
+        self._jobs[job.id] = job
+        heapq.heappush(self._heap, job)
+        # Job mới là job sớm nhất: đánh thức worker để tính lại thời gian ngủ
+        if self._heap[0] is job:
+            self._cond.notify()
+    
+    def _refill(self, now: float):
+        """Nạp thêm job từ SQLite tới mốc now + window (gọi khi giữ _cond)"""
+        horizon = now + self.window
+        while self._loaded_until[0] < horizon and len(self._jobs) < self.max_loaded:
+            rows = self.store.load_pending(self._loaded_until, horizon, self.page_size, self._owned)
+            self._push_rows(rows)
+            
+            if len(rows) < self.page_size:
+                self._loaded_until = (horizon, math.inf)
+            else:
+                self._loaded_until = (rows[-1][3], rows[-1][0])
+    
+    def _push_rows(self, rows):
+        """Đưa các dòng đọc từ SQLite vào heap (bỏ qua job đã có)"""
+        for job_id, recipient_id, message, scheduled_time, channel, attempts, shard in rows:
+            if job_id in self._jobs:
+                continue
+            job = ScheduledJob(
+                job_id, recipient_id, message, scheduled_time, channel,
+                self._callbacks.get(job_id), attempts, shard
+            )
+            self._jobs[job_id] = job
+            heapq.heappush(self._heap, job)
+    
+    def _needs_refill(self, now: float) -> bool:
+        return (
+            self.store is not None
+            and self._loaded_until[0] < now + self.window / 2
+            and len(self._jobs) < self.max_loaded
+        )
+    
+    # ---------- API ----------
+    
+    def _schedule(
+        self,
+        rows: List[Tuple[str, str, float, str]],
+        callbacks: List[Optional[Callable]]
+    ) -> List[int]:
+        with self._cond:
+            if self.store:
+                job_ids = self.store.add(rows)
+            else:
+                job_ids = [next(self._ids) for _ in rows]
+            
+            for job_id, row, callback in zip(job_ids, rows, callbacks):
+                if callback:
+                    self._callbacks[job_id] = callback
+                shard = self.store.shard(row[0]) if self.store else 0
+                self._enqueue(ScheduledJob(job_id, *row, callback=callback, shard=shard))
+        return job_ids
     
     def schedule_message(
         self,
         recipient_id: str,
         message: str,
         delay_seconds: int = 0,
-        callback: Callable = None
-    ):
+        callback: Callable = None,
+        channel: str = DEFAULT_CHANNEL
+    ) -> int:
         """
         Lên lịch gửi tin nhắn
         
@@ -30,22 +249,54 @@ class MessageScheduler:
             message: Nội dung tin
             delay_seconds: Độ trễ (giây)
             callback: Hàm gọi sau khi gửi
+            channel: Kênh gửi (để áp rate limit)
+        
+        Returns:
+            ID của job (dùng để cancel)
         """
         scheduled_time = time.time() + delay_seconds
-        self.scheduled_messages.append({
-            "recipient_id": recipient_id,
-            "message": message,
-            "scheduled_time": scheduled_time,
-            "callback": callback
-        })
-        logger.info(f"Scheduled message for {recipient_id} at {scheduled_time}")
+        job_id = self._schedule([(recipient_id, message, scheduled_time, channel)], [callback])[0]
+        logger.debug(f"Scheduled message for {recipient_id} at {scheduled_time}")
+        return job_id
+    
+    def cancel(self, job_id: int) -> bool:
+        """Huỷ một job chưa gửi"""
+        with self._cond:
+            cancelled = self.store.cancel(job_id) if self.store else False
+            self._callbacks.pop(job_id, None)
+            
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return cancelled
+            self._drop(job)
+            return True
+    
+    def _drop(self, job: ScheduledJob):
+        """Bỏ một job khỏi heap (lazy) - gọi khi giữ _cond, job đã pop khỏi _jobs"""
+        job.cancelled = True
+        self._cancelled += 1
+        # Job đang chờ retry thì lane của recipient đang bị chặn bởi nó
+        self.dispatcher.unblock(job.recipient_id, job.id)
+        
+        if self._cancelled > len(self._heap) // 2:
+            self._heap = [j for j in self._heap if not j.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+    
+    def pending(self) -> int:
+        """Số job chưa gửi"""
+        if self.store:
+            return self.store.count_pending()
+        with self._cond:
+            return len(self._jobs)
     
     def schedule_sequence(
         self,
         recipient_id: str,
         messages: List[str],
-        delay_between_messages: int = 5
-    ):
+        delay_between_messages: int = 5,
+        channel: str = DEFAULT_CHANNEL
+    ) -> List[int]:
         """
         Lên lịch gửi chuỗi tin nhắn
         
@@ -53,76 +304,434 @@ class MessageScheduler:
             recipient_id: ID người nhận
             messages: Danh sách tin nhắn
             delay_between_messages: Độ trễ giữa các tin (giây)
+            channel: Kênh gửi
         """
-        current_delay = 0
-        for i, message in enumerate(messages):
-            self.schedule_message(
-                recipient_id=recipient_id,
-                message=message,
-                delay_seconds=current_delay
-            )
-            current_delay += delay_between_messages
-            logger.info(f"Scheduled message {i+1}/{len(messages)}")
+        # Cả chuỗi được ghi trong một transaction
+        now = time.time()
+        rows = [
+            (recipient_id, message, now + i * delay_between_messages, channel)
+            for i, message in enumerate(messages)
+        ]
+        job_ids = self._schedule(rows, [None] * len(rows))
+        logger.info(f"Scheduled {len(messages)} messages for {recipient_id}")
+        return job_ids
     
     def schedule_daily_reminder(
         self,
         recipient_id: str,
         message: str,
-        time_of_day: str = "09:00"  # Format: HH:MM
-    ):
+        time_of_day: str = "09:00",  # Format: HH:MM
+        channel: str = DEFAULT_CHANNEL
+    ) -> int:
         """
-        Lên lịch nhắc nhở hàng ngày
+        Lên lịch nhắc nhở một lần vào lần tới của giờ time_of_day (hôm nay
+        nếu chưa qua, không thì ngày mai); nhắc lặp lại: schedule_daily_rule
         
         Args:
             recipient_id: ID người nhận
             message: Nội dung tin
             time_of_day: Giờ gửi (HH:MM)
+            channel: Kênh gửi
+        
+        Returns:
+            ID của job (dùng để cancel)
         """
-        # Tính toán thời gian gửi tiếp theo
         now = datetime.now()
-        target_time = datetime.strptime(time_of_day, "%H:%M").replace(
-            year=now.year, month=now.month, day=now.day
+        target_time = CronSchedule(time_of_day).next_after(now)
+        return self.schedule_message(
+            recipient_id=recipient_id,
+            message=message,
+            delay_seconds=int((target_time - now).total_seconds()),
+            channel=channel
         )
+    
+    def schedule_daily_rule(
+        self,
+        recipient_id: str,
+        message: str,
+        time_of_day: str = "09:00",  # Format: HH:MM
+        channel: str = DEFAULT_CHANNEL
+    ) -> int:
+        """
+        Nhắc nhở hằng ngày cho một recipient, lặp lại tới khi cancel_daily_rule
         
-        if target_time <= now:
-            # Nếu giờ đã qua, lên lịch cho ngày mai
-            target_time += timedelta(days=1)
+        Args:
+            recipient_id: ID người nhận
+            message: Nội dung tin
+            time_of_day: Giờ gửi (HH:MM)
+            channel: Kênh gửi
         
-        delay = (target_time - now).total_seconds()
-        self.schedule_message(
-            recipient_id=recipient_id,
+        Returns:
+            ID của rule (gọi lại với cùng recipient_id thì cập nhật rule cũ)
+        """
+        return self.schedule_recurring(
+            name=self._daily_rule_name(recipient_id),
+            cohort=f"recipient:{recipient_id}",
             message=message,
-            delay_seconds=int(delay)
+            schedule=time_of_day,
+            channel=channel
+        )
+    
+    def cancel_daily_rule(self, recipient_id: str) -> bool:
+        """Tắt nhắc nhở hằng ngày đã tạo bằng schedule_daily_rule"""
+        return self.cancel_recurring(self._daily_rule_name(recipient_id))
+    
+    @staticmethod
+    def _daily_rule_name(recipient_id: str) -> str:
+        return f"daily-reminder:{recipient_id}"
+    
+    # ---------- lịch lặp lại ----------
+    
+    def register_cohort(self, name: str, fetch: CohortFetcher):
+        """
+        Đăng ký nguồn recipient cho rule
+        
+        Args:
+            name: Tên cohort dùng trong schedule_recurring
+            fetch: fetch(after, limit) -> tối đa limit recipient_id sau after (keyset)
+        """
+        self._cohorts[name] = fetch
+    
+    def _cohort_fetcher(self, cohort: str) -> Optional[CohortFetcher]:
+        if cohort.startswith("recipient:"):
+            recipient_id = cohort.split(":", 1)[1]
+            return lambda after, limit: [recipient_id] if after is None else []
+        return self._cohorts.get(cohort)
+    
+    def schedule_recurring(
+        self,
+        name: str,
+        cohort: str,
+        message: str,
+        schedule: str,
+        channel: str = DEFAULT_CHANNEL
+    ) -> int:
+        """
+        Lên lịch gửi lặp lại cho cả một cohort
+        
+        Args:
+            name: Tên rule (gọi lại cùng tên thì cập nhật rule cũ)
+            cohort: Tên cohort đã register_cohort, hoặc "recipient:<id>"
+            message: Nội dung tin
+            schedule: "HH:MM" (hằng ngày) hoặc cron "phút giờ ngày tháng thứ"
+            channel: Kênh gửi
+        
+        Returns:
+            ID của rule
+        """
+        next_run = CronSchedule(schedule).next_after(datetime.now()).timestamp()
+        rule_id = self._rules.upsert_rule(name, cohort, message, schedule, channel, next_run)
+        self._rules_wakeup.set()
+        logger.info(f"Recurring schedule '{name}' ({schedule}) for cohort {cohort}")
+        return rule_id
+    
+    def cancel_recurring(self, name: str) -> bool:
+        """Tắt một rule lặp lại"""
+        cancelled = self._rules.deactivate_rule(name)
+        self._rules_wakeup.set()
+        return cancelled
+    
+    def _run_rules(self):
+        while self.running:
+            self._rules_wakeup.clear()
+            rule = self._rules.next_rule(self._owned_now() if self.store else None)
+            now = time.time()
+            if rule is None or rule[6] > now:
+                timeout = 60.0 if rule is None else min(60.0, rule[6] - now)
+                self._rules_wakeup.wait(timeout)
+                continue
+            try:
+                self._expand_rule(*rule)
+            except Exception as e:
+                logger.error(f"Recurring schedule '{rule[1]}' failed: {e}")
+                self._rules_wakeup.wait(self.retry_base)
+    
+    def _expand_rule(self, rule_id, name, cohort, message, schedule, channel, next_run, cursor, shard):
+        """Gửi một lượt của rule: đọc cohort theo trang, trang sau khi trang trước xong"""
+        fetch = self._cohort_fetcher(cohort)
+        if fetch is None:
+            logger.error(f"Unknown cohort '{cohort}' for recurring schedule '{name}'")
+        else:
+            while self.running:
+                if not self._owns(shard):
+                    # Mất lease: instance nhận shard sẽ gửi tiếp từ cursor
+                    return
+                recipients = fetch(cursor, self.page_size)
+                with self._rule_jobs_cond:
+                    self._rule_jobs += len(recipients)
+                for recipient_id in recipients:
+                    self.dispatcher.submit(ScheduledJob(
+                        next(self._rule_job_ids), recipient_id, message, next_run, channel, shard=shard
+                    ))
+                
+                with self._rule_jobs_cond:
+                    while self.running and self._rule_jobs > 0 and self._owns(shard):
+                        self._rule_jobs_cond.wait(1.0)
+                if not self.running or not self._owns(shard):
+                    return
+                
+                if len(recipients) < self.page_size:
+                    break
+                cursor = recipients[-1]
+                self._rules.set_rule_cursor(rule_id, cursor)
+        
+        # Lỡ nhiều lượt (server tắt) thì chỉ gửi bù một lượt
+        following = CronSchedule(schedule).next_after(
+            datetime.fromtimestamp(max(next_run, time.time()))
         )
+        self._rules.finish_rule(rule_id, following.timestamp())
+        self.rule_runs += 1
+        logger.info(f"Recurring schedule '{name}' done, next run {following}")
+    
+    def _rule_job_done(self, job: ScheduledJob):
+        if job.id < 0:
+            with self._rule_jobs_cond:
+                self._rule_jobs -= 1
+                if self._rule_jobs <= 0:
+                    self._rule_jobs_cond.notify_all()
+    
+    # ---------- nhiều instance ----------
+    
+    def _owns(self, shard: int) -> bool:
+        """Instance còn giữ lease của shard (luôn đúng khi không có store)"""
+        return self.store is None or shard in self._owned_now()
+    
+    def _owned_now(self) -> frozenset:
+        # Heartbeat không thành công kịp thì coi như đã mất mọi lease
+        return self._owned if time.time() < self._lease_valid_until else frozenset()
+    
+    def _heartbeat(self):
+        started = time.time()
+        owned = frozenset(self.store.heartbeat(self.owner, self.lease_ttl, self._lease_grace))
+        self._lease_valid_until = started + self.lease_ttl - self._lease_grace
+        
+        with self._cond:
+            lost, gained = self._owned - owned, owned - self._owned
+            self._owned = owned
+            if lost:
+                for job in [j for j in self._jobs.values() if j.shard in lost]:
+                    del self._jobs[job.id]
+                    self._callbacks.pop(job.id, None)
+                    self._drop(job)
+                    self._rule_job_done(job)
+            if gained:
+                # Job của shard mới nhận nằm trong khoảng heap đã nạp
+                after = (-math.inf, 0)
+                while after < self._loaded_until:
+                    rows = self.store.load_pending(after, self._loaded_until[0], self.page_size, gained)
+                    self._push_rows(
+                        row for row in rows if (row[3], row[0]) <= self._loaded_until
+                    )
+                    if len(rows) < self.page_size:
+                        break
+                    after = (rows[-1][3], rows[-1][0])
+            self._cond.notify()
+        
+        if lost or gained:
+            self._rules_wakeup.set()
+            logger.info(
+                f"Scheduler {self.owner} holds {len(owned)}/{self.store.shards} shards "
+                f"(+{len(gained)} -{len(lost)})"
+            )
+    
+    def _poll_new(self):
+        """Nạp job do instance khác thêm vào shard của mình"""
+        with self._cond:
+            self._seen_id, rows = self.store.load_new(
+                self._seen_id, self._loaded_until[0], self._owned
+            )
+            if rows:
+                self._push_rows(row for row in rows if (row[3], row[0]) <= self._loaded_until)
+                self._cond.notify()
+    
+    def _run_leases(self):
+        heartbeat_at = 0.0
+        while self.running:
+            now = time.time()
+            try:
+                if now - heartbeat_at >= self.lease_ttl / 3:
+                    self._heartbeat()
+                    heartbeat_at = now
+                self._poll_new()
+            except Exception as e:
+                logger.error(f"Scheduler lease heartbeat failed: {e}")
+            time.sleep(min(self.poll_interval, self.lease_ttl / 3))
+    
+    def _claim(self, due: List[ScheduledJob]) -> List[ScheduledJob]:
+        """Claim job đến hạn trong SQLite; job không claim được (huỷ / mất lease) bị bỏ"""
+        job_ids = [job.id for job in due if job.id > 0]
+        if not job_ids:
+            return due
+        claimed = set(self.store.claim(job_ids, self.owner, time.time() + self._lease_grace))
+        kept = []
+        for job in due:
+            if job.id < 0 or job.id in claimed:
+                kept.append(job)
+            else:
+                self._callbacks.pop(job.id, None)
+        return kept
+    
+    def _next_due(self) -> Optional[List[ScheduledJob]]:
+        """Chờ tới khi có job đến hạn; trả về các job đến hạn (None nếu đã dừng)"""
+        with self._cond:
+            while self.running:
+                now = time.time()
+                if self._needs_refill(now):
+                    self._refill(now)
+                
+                while self._heap and self._heap[0].cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+                
+                # Thức dậy khi job đầu đến hạn hoặc khi cần nạp thêm từ SQLite
+                timeout = None
+                if self._heap:
+                    timeout = self._heap[0].scheduled_time - now
+                if self.store is not None and len(self._jobs) < self.max_loaded:
+                    refill_in = self._loaded_until[0] - self.window / 2 - now
+                    timeout = refill_in if timeout is None else min(timeout, refill_in)
+                
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                
+                due = []
+                while self._heap and self._heap[0].scheduled_time <= now:
+                    job = heapq.heappop(self._heap)
+                    if job.cancelled:
+                        self._cancelled -= 1
+                        continue
+                    del self._jobs[job.id]
+                    due.append(job)
+                if self.store is not None:
+                    # Trong _cond để _poll_new không nạp lại job vừa lấy ra
+                    due = self._claim(due)
+                return due
+            return None
+    
+    # ---------- dispatch ----------
+    
+    def _bucket(self, channel: str) -> Optional[TokenBucket]:
+        bucket = self._buckets.get(channel, False)
+        if bucket is False:
+            limit = self.rate_limits.get(channel, self.rate_limits.get("*"))
+            bucket = TokenBucket(*limit) if limit else None
+            self._buckets[channel] = bucket
+        return bucket
+    
+    def _deliver(self, job: ScheduledJob) -> bool:
+        """
+        Gửi một job (chạy trên worker của dispatcher)
+        
+        Returns:
+            False nếu job được lên lịch thử lại (lane của recipient phải chờ)
+        """
+        if job.cancelled or not self._owns(job.shard):
+            # Shard đã chuyển sang instance khác: instance đó sẽ gửi
+            self._rule_job_done(job)
+            return True
+        
+        bucket = self._bucket(job.channel)
+        if bucket is not None and not job.reserved:
+            wait = bucket.reserve()
+            if wait > 0:
+                # Không giữ worker để chờ: hoãn job tới lượt token đã đặt trước
+                self.throttled += 1
+                job.reserved = True
+                self._defer(job, time.time() + wait)
+                return False
+        job.reserved = False
+        
+        try:
+            self.send_function(job.recipient_id, job.message)
+        except Exception as e:
+            logger.error(f"Failed to send message: {e}")
+            return self._retry(job, e)
+        
+        self.sent += 1
+        logger.info(f"Sent message to {job.recipient_id}")
+        self._rule_job_done(job)
+        if self.store and job.id > 0:
+            with self._sent_lock:
+                self._sent_ids.append(job.id)
+            self._flush_sent()
+        
+        self._callbacks.pop(job.id, None)
+        if job.callback:
+            try:
+                job.callback()
+            except Exception as e:
+                logger.error(f"Scheduler callback error: {e}")
+        return True
+    
+    def _defer(self, job: ScheduledJob, when: float):
+        """Đưa job lại vào heap (không ghi SQLite: dòng trong DB vẫn pending)"""
+        with self._cond:
+            job.scheduled_time = when
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, job)
+            if self._heap[0] is job:
+                self._cond.notify()
+    
+    def _flush_sent(self):
+        """Ghi trạng thái sent theo lô: một worker ghi hộ các id tích được"""
+        while self._sent_ids:
+            if not self._flush_lock.acquire(blocking=False):
+                return
+            try:
+                while True:
+                    with self._sent_lock:
+                        job_ids, self._sent_ids = self._sent_ids, []
+                    if not job_ids:
+                        break
+                    self.store.mark_sent(job_ids)
+            finally:
+                self._flush_lock.release()
+    
+    def _retry(self, job: ScheduledJob, error: Exception) -> bool:
+        """
+        Gửi lỗi: thử lại sau exponential backoff (có jitter), quá
+        max_attempts thì đánh dấu failed
+        
+        Returns:
+            True nếu đã bỏ cuộc (không còn retry)
+        """
+        job.attempts += 1
+        if job.cancelled or job.attempts >= self.max_attempts:
+            self._callbacks.pop(job.id, None)
+            self._rule_job_done(job)
+            if not job.cancelled:
+                self.failed += 1
+                if self.store and job.id > 0:
+                    self.store.mark_failed(job.id, str(error))
+                logger.error(f"Giving up on message {job.id} after {job.attempts} attempts")
+            return True
+        
+        self.retried += 1
+        delay = self.retry_base + backoff_delay(job.attempts - 1, self.retry_base, self.retry_cap)
+        if job.id < 0:
+            # Job tạm của rule: chỉ nằm trong RAM
+            self._defer(job, time.time() + delay)
+            return False
+        
+        job.scheduled_time = time.time() + delay
+        with self._cond:
+            if self.store:
+                self.store.reschedule(job.id, job.scheduled_time, job.attempts, str(error))
+            self._enqueue(job)
+        return False
     
     def process_scheduled_messages(self, send_function: Callable):
-        """Xử lý tin nhắn theo lịch"""
+        """Xử lý tin nhắn theo lịch: chuyển job đến hạn cho pool worker"""
+        self.send_function = send_function
         self.running = True
+        self.dispatcher.start()
         logger.info("Scheduler started")
         
         while self.running:
-            current_time = time.time()
-            messages_to_send = []
-            
-            # Tìm tin nhắn cần gửi
-            for i, scheduled in enumerate(self.scheduled_messages):
-                if scheduled["scheduled_time"] <= current_time:
-                    messages_to_send.append((i, scheduled))
-            
-            # Gửi tin nhắn (theo thứ tự ngược để tránh index shifts)
-            for idx, scheduled in sorted(messages_to_send, key=lambda x: x[0], reverse=True):
-                try:
-                    send_function(scheduled["recipient_id"], scheduled["message"])
-                    logger.info(f"Sent message to {scheduled['recipient_id']}")
-                    
-                    if scheduled["callback"]:
-                        scheduled["callback"]()
-                    
-                    self.scheduled_messages.pop(idx)
-                except Exception as e:
-                    logger.error(f"Failed to send message: {e}")
-            
-            time.sleep(1)  # Check mỗi giây
+            due = self._next_due()
+            for job in due or ():
+                self.dispatcher.submit(job)
     
     def start(self, send_function: Callable):
         """Bắt đầu scheduler trong background thread"""
@@ -130,21 +739,83 @@ class MessageScheduler:
             logger.warning("Scheduler already running")
             return
         
+        self.running = True
         self.thread = threading.Thread(
             target=self.process_scheduled_messages,
             args=(send_function,),
             daemon=True
         )
         self.thread.start()
+        
+        if self.store:
+            self._lease_thread = threading.Thread(target=self._run_leases, name="scheduler-leases", daemon=True)
+            self._lease_thread.start()
+        self._rules_thread = threading.Thread(target=self._run_rules, name="scheduler-rules", daemon=True)
+        self._rules_thread.start()
         logger.info("Scheduler thread started")
     
     def stop(self):
         """Dừng scheduler"""
-        self.running = False
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        self._rules_wakeup.set()
+        with self._rule_jobs_cond:
+            self._rule_jobs_cond.notify_all()
+        self.dispatcher.stop()
+        if self.store:
+            self._flush_sent()
+            self.store.release(self.owner, self._lease_grace)
+            self._owned = frozenset()
         logger.info("Scheduler stopped")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = {
+                "loaded": len(self._jobs),
+                "heap_size": len(self._heap),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "throttled": self.throttled,
+                "rule_runs": self.rule_runs,
+                "rule_jobs_in_flight": self._rule_jobs,
+                "owner": self.owner,
+                "shards_owned": len(self._owned_now()),
+                "dispatcher": self.dispatcher.stats()
+            }
+        if self.store:
+            stats["store"] = self.store.stats()
+            stats["leases"] = self.store.leases()
+        return stats
+
+# Scheduler dùng chung, tạo khi được dùng lần đầu: import module không
+# được mở / tạo scheduler.db trong thư mục hiện tại
+_scheduler: Optional[MessageScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> MessageScheduler:
+    """Scheduler dùng chung của process (tạo lần đầu khi gọi)"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                instance = MessageScheduler()
+                # Cohort toàn bộ user đã đăng ký (bảng user của Flask app)
+                instance.register_cohort(
+                    "all_users",
+                    sqlite_cohort(os.getenv("USERS_DB", "instance/chatbot.db"), "user", "id")
+                )
+                _scheduler = instance
+    return _scheduler
+
 
-# Global scheduler instance
-scheduler = MessageScheduler()
+def __getattr__(name: str) -> Any:
+    # `from actions.scheduler import scheduler` vẫn dùng được
+    if name == "scheduler":
+        return get_scheduler()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Ví dụ: Lead nurturing sequence
 UNIGROW_NURTURE_SEQUENCE = [
@@ -157,7 +828,7 @@ UNIGROW_NURTURE_SEQUENCE = [
 
 def schedule_nurture_sequence(user_id: str):
     """Lên lịch lead nurturing sequence"""
-    scheduler.schedule_sequence(
+    get_scheduler().schedule_sequence(
         recipient_id=user_id,
         messages=UNIGROW_NURTURE_SEQUENCE,
         delay_between_messages=10  # Cách nhau 10 giây
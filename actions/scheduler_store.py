@@ -0,0 +1,468 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Trạng thái của một tin nhắn đã lên lịch
+STATE_PENDING = "pending"
+# Đã được một instance claim và đang gửi (hoặc đang chờ token rate limit)
+STATE_SENDING = "sending"
+STATE_SENT = "sent"
+STATE_FAILED = "failed"
+STATE_CANCELLED = "cancelled"
+
+# (id, recipient_id, message, scheduled_time, channel, attempts, shard)
+JobRow = Tuple[int, str, str, float, str, int, int]
+
+_JOB_COLUMNS = "id, recipient_id, message, scheduled_time, channel, attempts, shard"
+
+
+def shard_of(key: str, shards: int) -> int:
+    """Shard cố định của một recipient / rule (ổn định giữa các process)"""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def _in(values: List) -> str:
+    return ", ".join("?" * len(values))
+
+
+class ScheduledMessageStore:
+    """
+    Lưu tin nhắn đã lên lịch trong SQLite để không mất khi restart.
+
+    Index một phần (chỉ các dòng pending) theo (scheduled_time, id) nên đọc
+    một khoảng thời gian sắp tới không phụ thuộc số dòng đã gửi. Ghi theo
+    lô: một transaction cho cả chuỗi tin / cả lô trạng thái.
+
+    Nhiều instance dùng chung một DB: job và rule được chia vào `shards`
+    shard theo hash của recipient_id / tên rule, mỗi shard có một lease
+    (scheduler_leases) do đúng một instance giữ. heartbeat() gia hạn lease,
+    chia lại shard cho đều giữa các instance còn sống và nhận shard có
+    lease hết hạn. claim() chuyển job pending -> sending trong một UPDATE,
+    chỉ thành công khi instance còn giữ lease của shard.
+    """
+
+    def __init__(self, db_path: str = "scheduler.db", retention_days: float = None, shards: int = None):
+        self.db_path = db_path
+        self.retention_days = retention_days or float(os.getenv("SCHEDULER_RETENTION_DAYS", 7))
+        self.shards = shards or int(os.getenv("SCHEDULER_SHARDS", 16))
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.create_function("shard_of", 1, self.shard, deterministic=True)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scheduled_messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "recipient_id TEXT NOT NULL, "
+                "message TEXT NOT NULL, "
+                "scheduled_time REAL NOT NULL, "
+                "channel TEXT NOT NULL DEFAULT 'default', "
+                "state TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "last_error TEXT, "
+                "updated_at REAL NOT NULL)"
+            )
+            # Bảng tạo từ phiên bản trước chưa có các cột này
+            self._add_column("scheduled_messages", "channel", "TEXT NOT NULL DEFAULT 'default'")
+            self._add_column("scheduled_messages", "shard", "INTEGER NOT NULL DEFAULT 0")
+            self._add_column("scheduled_messages", "claimed_by", "TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_scheduled_pending "
+                "ON scheduled_messages (scheduled_time, id) WHERE state = 'pending'"
+            )
+            # Lịch lặp lại: mỗi rule một dòng, cursor != NULL là đang gửi dở
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedule_rules ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "name TEXT NOT NULL UNIQUE, "
+                "cohort TEXT NOT NULL, "
+                "message TEXT NOT NULL, "
+                "schedule TEXT NOT NULL, "
+                "channel TEXT NOT NULL DEFAULT 'default', "
+                "shard INTEGER NOT NULL DEFAULT 0, "
+                "next_run REAL NOT NULL, "
+                "cursor TEXT, "
+                "active INTEGER NOT NULL DEFAULT 1, "
+                "updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_schedule_rules_next_run "
+                "ON schedule_rules (next_run) WHERE active = 1"
+            )
+            self._add_column("schedule_rules", "shard", "INTEGER NOT NULL DEFAULT 0")
+            # owner NULL + expires_at tương lai: shard vừa được trả, chờ job đang gửi xong
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scheduler_leases ("
+                "shard INTEGER PRIMARY KEY, "
+                "owner TEXT, "
+                "expires_at REAL NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scheduler_instances ("
+                "owner TEXT PRIMARY KEY, "
+                "heartbeat_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._reshard()
+
+        self.prune()
+
+    def shard(self, key: str) -> int:
+        return shard_of(key, self.shards)
+
+    def _add_column(self, table: str, column: str, definition: str):
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _reshard(self):
+        """Tạo lease cho từng shard; đổi số shard thì tính lại shard của mọi dòng"""
+        count = self._conn.execute("SELECT COUNT(*) FROM scheduler_leases").fetchone()[0]
+        if count == self.shards:
+            return
+        live = self._conn.execute(
+            "SELECT COUNT(*) FROM scheduler_leases WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+        if live:
+            raise RuntimeError(
+                f"SCHEDULER_SHARDS={self.shards} khác số shard đang dùng ({count}); "
+                "dừng mọi instance trước khi đổi"
+            )
+
+        self._conn.execute("DELETE FROM scheduler_leases")
+        self._conn.executemany(
+            "INSERT INTO scheduler_leases (shard) VALUES (?)", [(i,) for i in range(self.shards)]
+        )
+        self._conn.execute(
+            "UPDATE scheduled_messages SET shard = shard_of(recipient_id) "
+            "WHERE state IN ('pending', 'sending')"
+        )
+        self._conn.execute("UPDATE schedule_rules SET shard = shard_of(name)")
+        self._conn.commit()
+        logger.info(f"Scheduler store resharded to {self.shards} shards")
+
+    def add(self, rows: Iterable[Tuple[str, str, float, str]]) -> List[int]:
+        """Lưu một lô (recipient_id, message, scheduled_time, channel), trả về các id"""
+        now = time.time()
+        rows = [(*row, self.shard(row[0]), now) for row in rows]
+        if not rows:
+            return []
+        with self._lock:
+            # Cả lô nằm trong một transaction giữ write lock nên id liên tiếp
+            self._conn.executemany(
+                "INSERT INTO scheduled_messages "
+                "(recipient_id, message, scheduled_time, channel, shard, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            last_id = self._conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            self._conn.commit()
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def load_pending(
+        self,
+        after: Tuple[float, float],
+        until: float,
+        limit: int,
+        shards: Optional[Iterable[int]] = None
+    ) -> List[JobRow]:
+        """
+        Các job pending có (scheduled_time, id) > after và scheduled_time <= until
+        (chỉ trong `shards` nếu có)
+        """
+        condition, params = "", []
+        if shards is not None:
+            params = sorted(shards)
+            if not params:
+                return []
+            condition = f"AND shard IN ({_in(params)}) "
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM scheduled_messages "
+                "WHERE state = 'pending' AND (scheduled_time, id) > (?, ?) "
+                f"AND scheduled_time <= ? {condition}"
+                "ORDER BY scheduled_time, id LIMIT ?",
+                (after[0], after[1], until, *params, limit)
+            ).fetchall()
+
+    def max_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM scheduled_messages").fetchone()[0]
+
+    def load_new(self, after_id: int, until: float, shards: Iterable[int]) -> Tuple[int, List[JobRow]]:
+        """
+        Job pending mới thêm (id > after_id, có thể do instance khác ghi) trong
+        `shards` với scheduled_time <= until. Trả về (id lớn nhất đã xét, rows).
+        """
+        shards = sorted(shards)
+        with self._lock:
+            max_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM scheduled_messages").fetchone()[0]
+            if max_id <= after_id or not shards:
+                return max(max_id, after_id), []
+            rows = self._conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM scheduled_messages "
+                "WHERE id > ? AND id <= ? AND state = 'pending' AND scheduled_time <= ? "
+                f"AND shard IN ({_in(shards)})",
+                (after_id, max_id, until, *shards)
+            ).fetchall()
+        return max_id, rows
+
+    def claim(self, job_ids: List[int], owner: str, valid_until: float) -> List[int]:
+        """
+        Nhận các job sắp gửi: pending -> sending trong một UPDATE, chỉ với
+        job thuộc shard mà `owner` còn giữ lease tới sau valid_until.
+        Job đã do chính owner claim (đang chờ rate limit) được claim lại.
+        """
+        claimed = []
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(job_ids), 500):
+                chunk = job_ids[i:i + 500]
+                claimed += [row[0] for row in self._conn.execute(
+                    "UPDATE scheduled_messages SET state = 'sending', claimed_by = ?, updated_at = ? "
+                    f"WHERE id IN ({_in(chunk)}) "
+                    "AND (state = 'pending' OR (state = 'sending' AND claimed_by = ?)) "
+                    "AND shard IN (SELECT shard FROM scheduler_leases WHERE owner = ? AND expires_at > ?) "
+                    "RETURNING id",
+                    (owner, now, *chunk, owner, owner, valid_until)
+                ).fetchall()]
+            self._conn.commit()
+        return claimed
+
+    def mark_sent(self, job_ids: List[int]):
+        self._set_state(job_ids, STATE_SENT)
+
+    def mark_failed(self, job_id: int, error: str):
+        self._set_state([job_id], STATE_FAILED, error)
+
+    def _set_state(self, job_ids: List[int], state: str, error: Optional[str] = None):
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE scheduled_messages SET state = ?, last_error = COALESCE(?, last_error), "
+                "updated_at = ? WHERE id = ?",
+                [(state, error, now, job_id) for job_id in job_ids]
+            )
+            self._conn.commit()
+
+    def reschedule(self, job_id: int, scheduled_time: float, attempts: int, error: str):
+        """Lùi lịch một job gửi lỗi (trở lại pending)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scheduled_messages SET state = 'pending', claimed_by = NULL, "
+                "scheduled_time = ?, attempts = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (scheduled_time, attempts, error, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def cancel(self, job_id: int) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE scheduled_messages SET state = ?, updated_at = ? "
+                "WHERE id = ? AND state IN ('pending', 'sending')",
+                (STATE_CANCELLED, time.time(), job_id)
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    # ---------- leases ----------
+
+    def heartbeat(self, owner: str, ttl: float, grace: float) -> List[int]:
+        """
+        Gia hạn lease của `owner` và cân bằng lại shard (một transaction)
+
+        Mỗi instance còn sống giữ tối đa ceil(shards / số instance) shard:
+        giữ thừa thì trả bớt, thiếu thì nhận shard có lease đã hết hạn. Shard
+        được trả chỉ cho instance khác nhận sau `grace` giây để job đang gửi
+        kịp xong; shard nhận về thì job 'sending' của owner cũ trở lại pending.
+
+        Returns:
+            Các shard owner đang giữ
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO scheduler_instances (owner, heartbeat_at) VALUES (?, ?) "
+                    "ON CONFLICT(owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                    (owner, now)
+                )
+                conn.execute("DELETE FROM scheduler_instances WHERE heartbeat_at < ?", (now - ttl,))
+                live = conn.execute("SELECT COUNT(*) FROM scheduler_instances").fetchone()[0]
+                fair = -(-self.shards // live)
+
+                conn.execute(
+                    "UPDATE scheduler_leases SET expires_at = ? WHERE owner = ?", (now + ttl, owner)
+                )
+                owned = [row[0] for row in conn.execute(
+                    "SELECT shard FROM scheduler_leases WHERE owner = ? ORDER BY shard", (owner,)
+                )]
+
+                if len(owned) > fair:
+                    surplus = owned[fair:]
+                    conn.execute(
+                        "UPDATE scheduler_leases SET owner = NULL, expires_at = ? "
+                        f"WHERE shard IN ({_in(surplus)})",
+                        (now + grace, *surplus)
+                    )
+                    owned = owned[:fair]
+                elif len(owned) < fair:
+                    gained = [row[0] for row in conn.execute(
+                        "UPDATE scheduler_leases SET owner = ?, expires_at = ? "
+                        "WHERE shard IN (SELECT shard FROM scheduler_leases "
+                        "WHERE expires_at < ? ORDER BY shard LIMIT ?) RETURNING shard",
+                        (owner, now + ttl, now, fair - len(owned))
+                    )]
+                    if gained:
+                        conn.execute(
+                            "UPDATE scheduled_messages SET state = 'pending', claimed_by = NULL "
+                            f"WHERE state = 'sending' AND shard IN ({_in(gained)})",
+                            gained
+                        )
+                        owned = sorted(owned + gained)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return owned
+
+    def release(self, owner: str, grace: float):
+        """Trả mọi lease của owner (khi dừng) để instance khác nhận ngay sau grace"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scheduler_leases SET owner = NULL, expires_at = ? WHERE owner = ?",
+                (time.time() + grace, owner)
+            )
+            self._conn.execute(
+                "UPDATE scheduled_messages SET state = 'pending', claimed_by = NULL "
+                "WHERE state = 'sending' AND claimed_by = ?",
+                (owner,)
+            )
+            self._conn.execute("DELETE FROM scheduler_instances WHERE owner = ?", (owner,))
+            self._conn.commit()
+
+    def leases(self) -> Dict[str, int]:
+        """Số shard mỗi instance đang giữ"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT owner, COUNT(*) FROM scheduler_leases "
+                "WHERE owner IS NOT NULL AND expires_at > ? GROUP BY owner",
+                (time.time(),)
+            ).fetchall()
+        return dict(rows)
+
+    # ---------- rules ----------
+
+    def upsert_rule(
+        self,
+        name: str,
+        cohort: str,
+        message: str,
+        schedule: str,
+        channel: str,
+        next_run: float
+    ) -> int:
+        """Tạo hoặc cập nhật rule theo tên (next_run giữ nguyên nếu lịch không đổi)"""
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO schedule_rules "
+                "(name, cohort, message, schedule, channel, shard, next_run, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET "
+                "next_run = CASE WHEN schedule = excluded.schedule AND active = 1 "
+                "THEN next_run ELSE excluded.next_run END, "
+                "cohort = excluded.cohort, message = excluded.message, "
+                "schedule = excluded.schedule, channel = excluded.channel, "
+                "active = 1, updated_at = excluded.updated_at "
+                "RETURNING id",
+                (name, cohort, message, schedule, channel, self.shard(name), next_run, time.time())
+            ).fetchone()
+            self._conn.commit()
+            return row[0]
+
+    def next_rule(self, shards: Optional[Iterable[int]] = None) -> Optional[Tuple]:
+        """
+        Rule active có next_run sớm nhất (chỉ trong `shards` nếu có):
+        (id, name, cohort, message, schedule, channel, next_run, cursor, shard)
+        """
+        condition, params = "", []
+        if shards is not None:
+            params = sorted(shards)
+            if not params:
+                return None
+            condition = f"AND shard IN ({_in(params)}) "
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, name, cohort, message, schedule, channel, next_run, cursor, shard "
+                f"FROM schedule_rules WHERE active = 1 {condition}ORDER BY next_run LIMIT 1",
+                params
+            ).fetchone()
+
+    def set_rule_cursor(self, rule_id: int, cursor: Optional[str]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE schedule_rules SET cursor = ?, updated_at = ? WHERE id = ?",
+                (cursor, time.time(), rule_id)
+            )
+            self._conn.commit()
+
+    def finish_rule(self, rule_id: int, next_run: float):
+        """Đã gửi xong một lượt: xoá cursor, đặt lượt kế tiếp"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE schedule_rules SET cursor = NULL, next_run = ?, updated_at = ? WHERE id = ?",
+                (next_run, time.time(), rule_id)
+            )
+            self._conn.commit()
+
+    def deactivate_rule(self, name: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE schedule_rules SET active = 0, cursor = NULL, updated_at = ? "
+                "WHERE name = ? AND active = 1",
+                (time.time(), name)
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def count_pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM scheduled_messages WHERE state IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+    def prune(self):
+        """Xoá các dòng đã xong (sent/failed/cancelled) quá retention_days"""
+        cutoff = time.time() - self.retention_days * 86400
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM scheduled_messages "
+                "WHERE state IN ('sent', 'failed', 'cancelled') AND updated_at < ?",
+                (cutoff,)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Pruned {cursor.rowcount} finished scheduled messages")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM scheduled_messages GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,29 +1,261 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from typing import Dict, Any, Optional
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Dict, Any, Callable, Iterator, Optional, Tuple
 import os
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+try:
+    import aiohttp
+except ImportError:  # không có aiohttp: bản async chạy bản sync trong thread pool
+    aiohttp = None
+from .llm_cache import ConversationContextCache, SemanticCache, normalize_query
+from .resilience import (
+    AdmissionController,
+    CircuitBreaker,
+    CircuitOpenError,
+    OverloadedError,
+    PRIORITY_NORMAL,
+    SharedSlots,
+    backoff_delay,
+)
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Câu trả lời khi LLM đang quá tải/không phản hồi (circuit breaker mở)
+LLM_UNAVAILABLE_RESPONSE = (
+    "Xin lỗi, hệ thống tư vấn đang bận. "
+    "Bạn có thể hỏi về chiều cao, cách dùng Unigrow, giá cả & mua hàng, "
+    "hoặc nhắn lại sau ít phút nhé! 😊"
+)
+
+# Câu trả lời tĩnh của ActionDefaultFallback (dùng cả khi LLM quá tải và bị shed)
+DEFAULT_FALLBACK_RESPONSE = (
+    "Xin lỗi, mình không hiểu câu hỏi của bạn. "
+    "Bạn có thể hỏi về:\n"
+    "- Chiều cao & cách phát triển\n"
+    "- Unigrow & cách dùng\n"
+    "- Giá cả & mua hàng\n"
+    "Hoặc nhắn lại với cách hỏi khác nhé! 😊"
+)
+
+# Mã lỗi HTTP đáng thử lại
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi trùng nhau đang chạy song song (single-flight).
+
+    Thread đầu tiên với một key thực hiện lời gọi; các thread khác đến
+    trong lúc đó chờ và nhận chung kết quả (hoặc exception).
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.saved = 0
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            (kết quả, shared) - shared=True nếu kết quả lấy từ lời gọi của thread khác
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.saved += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"in_flight": in_flight, "upstream_calls": self.leaders, "requests_saved": self.saved}
+
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight cho coroutine: lời gọi chạy trong task riêng, mọi người
+    cùng key chờ chung task đó. Người chờ bị huỷ (client ngắt, timeout)
+    không làm huỷ lời gọi của người khác; task chỉ bị huỷ khi không còn
+    ai chờ.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, _AsyncCall] = {}
+        self.leaders = 0
+        self.saved = 0
+
+    async def do(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            self.saved += 1
+        else:
+            self.leaders += 1
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # Mọi người chờ đã bỏ đi: huỷ lời gọi upstream, người đến sau gọi mới
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: Any, call: _AsyncCall):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "upstream_calls": self.leaders, "requests_saved": self.saved}
+
+
 class MistralLLMClient:
     """Client để gọi Mistral 7B thông qua Ollama"""
     
     def __init__(
         self,
         model_name: str = None,
-        base_url: str = None
+        base_url: str = None,
+        cache_path: Optional[str] = None
     ):
         self.model_name = model_name or os.getenv("MISTRAL_MODEL_NAME", "mistral")
         self.base_url = base_url or os.getenv("MISTRAL_BASE_URL", "http://localhost:11434")
         self.api_endpoint = f"{self.base_url}/api/generate"
+        
+        # Connection pool keep-alive tới Ollama (không mở TCP mới mỗi lần gọi)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=int(os.getenv("LLM_POOL_SIZE", 10)),
+            max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # Deadline riêng cho connect và read
+        self.timeout = (
+            float(os.getenv("LLM_CONNECT_TIMEOUT", 2)),
+            float(os.getenv("LLM_READ_TIMEOUT", 30))
+        )
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 2))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE", 0.2))
+        self.backoff_cap = float(os.getenv("LLM_BACKOFF_CAP", 2.0))
+        self.retries = 0
+        
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", 30))
+        )
+        
+        # Các câu hỏi giống hệt nhau đang chờ Ollama dùng chung một request
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        
+        # Pool aiohttp cho bản async (gắn với event loop tạo ra nó)
+        self._aio_session = None
+        self._aio_loop = None
+        
+        # Giới hạn số generation đồng thời + hàng đợi ưu tiên, shed khi quá tải
+        self.admission = AdmissionController(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 2)),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", 16)),
+            max_wait=float(os.getenv("LLM_MAX_QUEUE_WAIT", 10))
+        )
+        # Admission ở trên chỉ giới hạn trong process này; slot chung giới hạn
+        # tổng số generation của mọi process (action server + từng worker web)
+        # gọi cùng một Ollama. 0 = tắt
+        global_concurrency = int(os.getenv("LLM_GLOBAL_CONCURRENCY", self.admission.max_concurrency))
+        if global_concurrency > 0 and SharedSlots.supported:
+            self.shared_slots = SharedSlots(
+                os.getenv("LLM_SLOTS_DIR", os.path.join(tempfile.gettempdir(), "unigrow-llm-slots")),
+                global_concurrency
+            )
+        else:
+            self.shared_slots = None
+        # Thread chờ slot cho bản async: đủ cho mọi request đang chạy + trong hàng
+        self._admission_pool = ThreadPoolExecutor(
+            max_workers=self.admission.max_concurrency + self.admission.max_queue + 1,
+            thread_name_prefix="llm-admission"
+        )
+        
+        # Giữ model trong RAM của Ollama giữa các lần gọi
+        self.keep_alive = os.getenv("LLM_KEEP_ALIVE", "30m")
+        
+        # Context token của Ollama theo sender (lượt sau chỉ prefill câu hỏi mới)
+        self.contexts = ConversationContextCache()
+        
+        # Cache câu trả lời theo độ tương đồng câu hỏi
+        if os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true":
+            self.cache = SemanticCache(path=cache_path)
+            atexit.register(self.cache.save)
+        else:
+            self.cache = None
     
     def generate_response(
         self,
         prompt: str,
         temperature: float = None,
         max_tokens: int = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        cache_key: Optional[str] = None,
+        cache_context: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+        sender_id: Optional[str] = None
     ) -> str:
         """
         Gọi Mistral 7B để generate response
@@ -33,47 +265,532 @@ class MistralLLMClient:
             temperature: Độ ngẫu nhiên (0-1)
             max_tokens: Số token tối đa
             system_prompt: System prompt (hướng dẫn cho model)
+            cache_key: Câu hỏi gốc của user để tra semantic cache (None = không dùng cache)
+            cache_context: Context slot; chỉ dùng lại câu trả lời có cùng context
+            priority: PRIORITY_HIGH (luồng mua hàng) / PRIORITY_NORMAL / PRIORITY_LOW
+            sender_id: ID hội thoại; dùng lại context Ollama của lượt trước
         
         Returns:
             Response từ model
         """
         
-        temperature = temperature or float(os.getenv("MISTRAL_TEMPERATURE", 0.7))
-        max_tokens = max_tokens or int(os.getenv("MISTRAL_MAX_TOKENS", 512))
+        payload = self._build_payload(
+            prompt, temperature, max_tokens, system_prompt, stream=False, sender_id=sender_id
+        )
         
-        # Thêm system prompt nếu có
-        if system_prompt:
-            full_prompt = f"{system_prompt}\n\n{prompt}"
-        else:
-            full_prompt = prompt
+        cache_scope = self._cache_scope(system_prompt, cache_context)
+        use_cache = self._use_cache(cache_key)
+        if use_cache:
+            cached = self.cache.lookup(cache_key, cache_scope)
+            if cached is not None:
+                return cached
         
-        payload = {
-            "model": self.model_name,
-            "prompt": full_prompt,
-            "temperature": temperature,
-            "top_p": 0.9,
-            "num_predict": max_tokens,
-            "stream": False
-        }
+        try:
+            result, shared = self.flight.do(
+                self._flight_key(payload),
+                lambda: self._admitted_post(payload, priority)
+            )
+            text = result.get("response", "").strip()
+            if sender_id:
+                self.contexts.put(sender_id, result.get("context"))
+        
+        except OverloadedError:
+            return DEFAULT_FALLBACK_RESPONSE
+        except CircuitOpenError:
+            return LLM_UNAVAILABLE_RESPONSE
+        except requests.exceptions.ConnectionError:
+            return "⚠️ Lỗi kết nối đến LLM. Vui lòng kiểm tra Ollama đang chạy."
+        except Exception as e:
+            return f"⚠️ Lỗi: {str(e)}"
+        
+        # Chỉ request dẫn đầu lưu cache, tránh lưu trùng cùng một câu trả lời
+        if use_cache and text and not shared and self._cacheable(payload):
+            self.cache.store(cache_key, cache_scope, text)
+        
+        return text
+    
+    async def generate_response_async(
+        self,
+        prompt: str,
+        temperature: float = None,
+        max_tokens: int = None,
+        system_prompt: Optional[str] = None,
+        cache_key: Optional[str] = None,
+        cache_context: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+        sender_id: Optional[str] = None
+    ) -> str:
+        """
+        Bản async của generate_response: không chặn event loop khi chờ Ollama
+        
+        Args: như generate_response
+        
+        Returns:
+            Response từ model
+        """
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    self.generate_response, prompt, temperature, max_tokens, system_prompt,
+                    cache_key, cache_context, priority, sender_id
+                )
+            )
+        
+        payload = self._build_payload(
+            prompt, temperature, max_tokens, system_prompt, stream=False, sender_id=sender_id
+        )
+        
+        cache_scope = self._cache_scope(system_prompt, cache_context)
+        use_cache = self._use_cache(cache_key)
+        if use_cache:
+            cached = self.cache.lookup(cache_key, cache_scope)
+            if cached is not None:
+                return cached
         
         try:
-            response = requests.post(
+            result, shared = await self.async_flight.do(
+                self._flight_key(payload),
+                lambda: self._admitted_post_async(payload, priority)
+            )
+            text = result.get("response", "").strip()
+            if sender_id:
+                self.contexts.put(sender_id, result.get("context"))
+        
+        except OverloadedError:
+            return DEFAULT_FALLBACK_RESPONSE
+        except CircuitOpenError:
+            return LLM_UNAVAILABLE_RESPONSE
+        except aiohttp.ClientConnectionError:
+            return "⚠️ Lỗi kết nối đến LLM. Vui lòng kiểm tra Ollama đang chạy."
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return f"⚠️ Lỗi: {str(e) or type(e).__name__}"
+        
+        if use_cache and text and not shared and self._cacheable(payload):
+            self.cache.store(cache_key, cache_scope, text)
+        
+        return text
+    
+    def generate_stream(
+        self,
+        prompt: str,
+        temperature: float = None,
+        max_tokens: int = None,
+        system_prompt: Optional[str] = None,
+        cache_key: Optional[str] = None,
+        cache_context: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+        sender_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Giống generate_response nhưng yield từng token ngay khi Ollama sinh ra
+        
+        Args: như generate_response
+        
+        Yields:
+            Từng đoạn text; câu trả lời từ cache hoặc thông báo lỗi được yield một lần
+        """
+        
+        payload = self._build_payload(
+            prompt, temperature, max_tokens, system_prompt, stream=True, sender_id=sender_id
+        )
+        
+        cache_scope = self._cache_scope(system_prompt, cache_context)
+        use_cache = self._use_cache(cache_key)
+        if use_cache:
+            cached = self.cache.lookup(cache_key, cache_scope)
+            if cached is not None:
+                yield cached
+                return
+        
+        try:
+            lease = self._acquire_slot(priority)
+        except OverloadedError:
+            yield DEFAULT_FALLBACK_RESPONSE
+            return
+        
+        # Hỏi breaker sau khi đã có slot (như _admitted_post): probe half-open
+        # không bị kẹt nếu request bị shed
+        if not self.breaker.allow_request():
+            self._release_slot(lease)
+            yield LLM_UNAVAILABLE_RESPONSE
+            return
+        
+        chunks = []
+        started = time.monotonic()
+        
+        try:
+            with self.session.post(
                 self.api_endpoint,
                 json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
+                timeout=self.timeout,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                
+                # Ollama stream: mỗi dòng là một JSON {"response": "...", "done": bool};
+                # chunk_size=None để nhận từng chunk ngay, không đợi đầy buffer
+                for line in response.iter_lines(chunk_size=None):
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    token = chunk.get("response", "")
+                    if token:
+                        chunks.append(token)
+                        yield token
+                    if chunk.get("done"):
+                        if sender_id:
+                            self.contexts.put(sender_id, chunk.get("context"))
+                        break
             
-            result = response.json()
-            return result.get("response", "").strip()
+            self.breaker.record_success()
         
+        except GeneratorExit:
+            # Người dùng ngắt giữa chừng, backend vẫn bình thường
+            self.breaker.record_success()
+            raise
         except requests.exceptions.ConnectionError:
-            return "⚠️ Lỗi kết nối đến LLM. Vui lòng kiểm tra Ollama đang chạy."
+            self.breaker.record_failure()
+            yield "⚠️ Lỗi kết nối đến LLM. Vui lòng kiểm tra Ollama đang chạy."
+            return
         except Exception as e:
-            return f"⚠️ Lỗi: {str(e)}"
+            self.breaker.record_failure()
+            yield f"⚠️ Lỗi: {str(e)}"
+            return
+        finally:
+            self._release_slot(lease, time.monotonic() - started)
+        
+        text = "".join(chunks).strip()
+        if use_cache and text and self._cacheable(payload):
+            self.cache.store(cache_key, cache_scope, text)
+    
+    @staticmethod
+    def _flight_key(payload: Dict[str, Any]) -> str:
+        """Khoá single-flight: prompt đã chuẩn hoá + tham số sinh (+ context)"""
+        return json.dumps(
+            {**payload, "prompt": normalize_query(payload["prompt"])},
+            sort_keys=True
+        )
+    
+    def _use_cache(self, cache_key: Optional[str]) -> bool:
+        """
+        Semantic cache tra theo câu hỏi + scope (system prompt, slot), không
+        theo context Ollama của sender, nên dùng được cho mọi lượt của hội
+        thoại chứ không chỉ tin nhắn đầu.
+        
+        Đánh đổi: câu tiếp nối ("còn liều dùng thì sao?") giống một câu đã
+        cache sẽ nhận câu trả lời độc lập với hội thoại trước, và lượt hit
+        cache không được nối vào context Ollama của sender. Để giới hạn điều
+        này, chỉ câu trả lời sinh ra không có context mới được lưu (_cacheable).
+        """
+        return bool(self.cache and cache_key)
+    
+    @staticmethod
+    def _cacheable(payload: Dict[str, Any]) -> bool:
+        """Câu trả lời sinh từ context của một hội thoại không dùng lại cho người khác"""
+        return "context" not in payload
+    
+    @staticmethod
+    def _cache_scope(system_prompt: Optional[str], cache_context: Optional[str]) -> str:
+        return f"{system_prompt or ''}\n{cache_context or ''}"
+    
+    def _build_payload(
+        self,
+        prompt: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        system_prompt: Optional[str],
+        stream: bool,
+        sender_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        temperature = temperature or float(os.getenv("MISTRAL_TEMPERATURE", 0.7))
+        max_tokens = max_tokens or int(os.getenv("MISTRAL_MAX_TOKENS", 512))
+        
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": temperature,
+                "top_p": 0.9,
+                "num_predict": max_tokens
+            }
+        }
+        
+        # System prompt đi qua field riêng: prefix giống nhau giữa các lần gọi
+        # nên Ollama dùng lại KV cache thay vì prefill lại toàn bộ
+        if system_prompt:
+            payload["system"] = system_prompt
+        
+        if sender_id:
+            context = self.contexts.get(sender_id)
+            if context:
+                payload["context"] = context
+        
+        return payload
+    
+    def _acquire_slot(self, priority: int) -> Optional[int]:
+        """
+        Slot của admission controller rồi slot chung giữa các process; chờ
+        tổng cộng không quá max_wait của admission
+        
+        Returns:
+            Lease của slot chung (None nếu tắt), trả lại bằng _release_slot
+        
+        Raises:
+            OverloadedError: bị shed ở một trong hai tầng
+        """
+        waited = self.admission.acquire(priority)
+        if self.shared_slots is None:
+            return None
+        try:
+            return self.shared_slots.acquire(max(0.0, self.admission.max_wait - waited))
+        except BaseException:
+            self.admission.release()
+            raise
+    
+    def _release_slot(self, lease: Optional[int], service_time: Optional[float] = None):
+        if lease is not None:
+            self.shared_slots.release(lease)
+        self.admission.release(service_time)
+    
+    @contextmanager
+    def _slot(self, priority: int):
+        lease = self._acquire_slot(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release_slot(lease, time.monotonic() - started)
+    
+    def _admitted_post(self, payload: Dict[str, Any], priority: int) -> Dict[str, Any]:
+        """_post trong một slot của admission controller (có thể raise OverloadedError)"""
+        with self._slot(priority):
+            return self._post(payload)
+    
+    async def _admitted_post_async(self, payload: Dict[str, Any], priority: int) -> Dict[str, Any]:
+        """
+        _post_async trong một slot của admission controller
+        
+        AdmissionController chờ bằng threading.Condition nên acquire chạy
+        trong thread pool, event loop vẫn phục vụ các action khác.
+        """
+        acquire = asyncio.get_running_loop().run_in_executor(
+            self._admission_pool, self._acquire_slot, priority
+        )
+        try:
+            lease = await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # Bị huỷ khi đang chờ: slot vẫn có thể được cấp sau đó, trả lại ngay
+            acquire.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or self._release_slot(f.result())
+            )
+            raise
+        started = time.monotonic()
+        try:
+            return await self._post_async(payload)
+        finally:
+            self._release_slot(lease, time.monotonic() - started)
+    
+    def _session_async(self) -> "aiohttp.ClientSession":
+        """Session aiohttp dùng chung (tạo lại nếu event loop đổi)"""
+        loop = asyncio.get_running_loop()
+        if self._aio_session is None or self._aio_session.closed or self._aio_loop is not loop:
+            self._aio_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=int(os.getenv("LLM_POOL_SIZE", 10))),
+                timeout=aiohttp.ClientTimeout(connect=self.timeout[0], sock_read=self.timeout[1])
+            )
+            self._aio_loop = loop
+        return self._aio_session
+    
+    async def _post_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Như _post nhưng qua aiohttp (retry / backoff / circuit breaker giống hệt)"""
+        if not self.breaker.allow_request():
+            raise CircuitOpenError()
+        probe = self.breaker.state == CircuitBreaker.HALF_OPEN
+        
+        settled = False
+        attempt = 0
+        try:
+            while True:
+                try:
+                    async with self._session_async().post(self.api_endpoint, json=payload) as response:
+                        response.raise_for_status()
+                        result = await response.json(content_type=None)
+                    settled = True
+                    self.breaker.record_success()
+                    return result
+                
+                # Read timeout (ServerTimeoutError) không thử lại, như bản sync
+                except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError) as e:
+                    retryable = (
+                        e.status in RETRYABLE_STATUS if isinstance(e, aiohttp.ClientResponseError)
+                        else not isinstance(e, asyncio.TimeoutError)
+                    )
+                    
+                    if not retryable or attempt >= self.max_retries:
+                        settled = True
+                        self.breaker.record_failure()
+                        raise
+                    
+                    delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                    logger.warning(f"LLM request lỗi ({e}), thử lại sau {delay:.2f}s")
+                    attempt += 1
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+                
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    settled = True
+                    self.breaker.record_failure()
+                    raise
+        finally:
+            # Bị huỷ (kể cả lúc đang backoff): không tính thành công hay lỗi,
+            # nhưng phải trả lượt probe để breaker không kẹt ở half-open
+            if probe and not settled:
+                self.breaker.release_probe()
+    
+    def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST tới Ollama qua session pool, thử lại có giới hạn với backoff
+        jitter, đi qua circuit breaker
+        
+        Raises:
+            CircuitOpenError: breaker đang mở, không gọi backend
+            requests.exceptions.RequestException: lỗi sau khi hết lượt thử lại
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError()
+        
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    self.api_endpoint,
+                    json=payload,
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                result = response.json()
+                self.breaker.record_success()
+                return result
+            
+            # ReadTimeout không nằm ở đây (không thử lại): model chỉ đang chậm,
+            # gửi lại chỉ làm Ollama tắc thêm
+            except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+                retryable = not isinstance(e, requests.exceptions.HTTPError) or (
+                    e.response is not None and e.response.status_code in RETRYABLE_STATUS
+                )
+                
+                if not retryable or attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                logger.warning(f"LLM request lỗi ({e}), thử lại sau {delay:.2f}s")
+                attempt += 1
+                self.retries += 1
+                time.sleep(delay)
+            
+            except Exception:
+                self.breaker.record_failure()
+                raise
+    
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê transport / cache của client"""
+        return {
+            "retries": self.retries,
+            "breaker": self.breaker.stats(),
+            "single_flight": self.flight.stats(),
+            "async_single_flight": self.async_flight.stats(),
+            "admission": self.admission.stats(),
+            "shared_slots": self.shared_slots.stats() if self.shared_slots else None,
+            "contexts": self.contexts.stats(),
+            "cache": self.cache.stats() if self.cache else None
+        }
+
+def render_llm_metrics(client: "MistralLLMClient") -> str:
+    """Stats của client (queue depth, thời gian chờ, shed, ...) dạng Prometheus text"""
+    counters = {"admitted", "shed", "timed_out", "wait_time_sum", "upstream_calls", "requests_saved"}
+    stats = client.stats()
+    lines = []
+    for section in ("admission", "single_flight"):
+        for key, value in stats[section].items():
+            if key in counters:
+                name = f"unigrow_llm_{section}_{key}_total"
+                lines.append(f"# TYPE {name} counter")
+            else:
+                name = f"unigrow_llm_{section}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    if stats["shared_slots"]:
+        for key in ("acquired", "timed_out", "wait_time_sum"):
+            name = f"unigrow_llm_shared_slots_{key}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {stats['shared_slots'][key]}")
+    lines.append("# TYPE unigrow_llm_retries_total counter")
+    lines.append(f"unigrow_llm_retries_total {stats['retries']}")
+    lines.append("# TYPE unigrow_llm_breaker_open gauge")
+    lines.append(f"unigrow_llm_breaker_open {int(stats['breaker']['state'] != CircuitBreaker.CLOSED)}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(client: "MistralLLMClient", port: int):
+    """HTTP server nhỏ phục vụ /metrics của LLM client trong action server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_llm_metrics(client).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="llm-metrics", daemon=True).start()
+    logger.info(f"LLM metrics: http://0.0.0.0:{port}/metrics")
+    return server
+
+# Client của action server, tạo khi được dùng lần đầu: app.py import module
+# này nhưng có client riêng, không được nạp / ghi đè cache file của action server
+_llm_client: Optional[MistralLLMClient] = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> MistralLLMClient:
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = MistralLLMClient()
+    return _llm_client
+
+
+def __getattr__(name: str) -> Any:
+    # `from actions.utils import llm_client` vẫn dùng được
+    if name == "llm_client":
+        return get_llm_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# input_channel của UserMessage khi web UI nhận câu trả lời dạng stream (SSE)
+STREAM_INPUT_CHANNEL = "sse"
+
 
-# Khởi tạo client
-llm_client = MistralLLMClient()
+def llm_stream_message(**kwargs: Any) -> Dict[str, Any]:
+    """
+    Custom payload báo cho app.py tự stream câu trả lời LLM tới trình duyệt
+    (kwargs là tham số của generate_stream)
+    """
+    return {"llm_stream": kwargs}
 
 # System prompt cho Unigrow Bot
 UNIGROW_SYSTEM_PROMPT = """
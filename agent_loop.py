@@ -0,0 +1,87 @@
+import asyncio
+import os
+import threading
+import logging
+from typing import Any, Awaitable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AgentLoop:
+    """
+    Một event loop sống lâu cho mỗi worker.
+
+    Loop chạy trong background thread; các Flask thread gửi coroutine
+    (ví dụ agent.handle_text) vào loop này thay vì tạo/đóng loop mới
+    cho mỗi request, nên nhiều cuộc hội thoại chạy song song trên cùng
+    một loop.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        """Khởi động loop nếu chưa chạy (hoặc sau khi fork sang process mới)"""
+        if self.loop is not None and self._pid == os.getpid():
+            return self.loop
+
+        with self._lock:
+            if self.loop is not None and self._pid == os.getpid():
+                return self.loop
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self.thread = threading.Thread(
+                target=_run,
+                name="agent-event-loop",
+                daemon=True
+            )
+            self.thread.start()
+            ready.wait()
+
+            self.loop = loop
+            self._pid = os.getpid()
+            logger.info("Agent event loop started")
+            return loop
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Chạy coroutine trên loop chung và chờ kết quả
+
+        Args:
+            coro: Coroutine cần chạy
+            timeout: Thời gian chờ tối đa (giây)
+
+        Returns:
+            Kết quả của coroutine
+        """
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            future.cancel()
+            raise
+
+    def stop(self):
+        """Dừng loop"""
+        if self.loop is None or self._pid != os.getpid():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.loop = None
+        logger.info("Agent event loop stopped")
+
+
+# Global loop instance (mỗi process/worker một loop)
+agent_loop = AgentLoop()
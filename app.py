@@ -1,14 +1,26 @@
 # File: app.py
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, send_file, Response
 from flask_cors import CORS
-from rasa.core.agent import Agent
 from models import db, User, Message, Analytics
 import os
 import json
+import base64
 from datetime import datetime
 import logging
+from sqlalchemy import inspect, text, tuple_
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
-import asyncio
+from agent_loop import agent_loop
+from write_queue import write_queue
+from metrics import chat_latency, stream_first_token, render_summary, render_stats
+from response_cache import response_cache, normalize_text, is_stateless_turn, turn_events
+from actions.utils import MistralLLMClient, render_llm_metrics, STREAM_INPUT_CHANNEL
+from actions.media_handler import media_handler, MEDIA_KINDS
+import atexit
+import gc
+import hmac
+import threading
+import weakref
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +30,9 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder='.', template_folder='.')
 CORS(app)
 
+# Đặt MEDIA_X_SENDFILE=true khi chạy sau nginx/Apache: proxy tự gửi file
+app.config['USE_X_SENDFILE'] = os.getenv('MEDIA_X_SENDFILE', 'false').lower() == 'true'
+
 # Cấu hình database
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbot.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -28,25 +43,436 @@ db.init_app(app)
 # Tạo bảng database khi khởi động
 with app.app_context():
     db.create_all()
+    
+    # create_all không thêm cột/index mới vào bảng đã tồn tại
+    inspector = inspect(db.engine)
+    analytics_columns = {col['name'] for col in inspector.get_columns('analytics')}
+    if 'response_time_count' not in analytics_columns:
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                'ALTER TABLE analytics ADD COLUMN response_time_count INTEGER DEFAULT 0'
+            ))
+        logger.info("Added column analytics.response_time_count")
+    
+    existing_indexes = {ix['name'] for ix in inspector.get_indexes('message')}
+    for index in Message.__table__.indexes:
+        if index.name not in existing_indexes:
+            index.create(db.engine)
+            logger.info(f"Created index {index.name}")
 
-# Global agent
+# Ghi Message/Analytics theo lô ở background, không chặn request chat
+write_queue.init_app(app)
+atexit.register(write_queue.close)
+
+# Global agent (được load ở background thread, xem start_model_loader)
 agent = None
 
-def load_agent():
-    """Load Rasa model"""
-    global agent
+# Tracker store theo user_id, giới hạn bộ nhớ (cấu hình qua TRACKER_STORE_*);
+# tạo cùng lúc load model vì import rasa rất chậm
+tracker_store = None
+
+# Trạng thái model cho /health/ready: loading -> warming_up -> ready (hoặc failed)
+model_state = {
+    'status': 'loading', 'error': None, 'load_seconds': None, 'warmup_seconds': None,
+    # Hot reload: model đang phục vụ, số lần reload, lỗi của lần reload gần nhất
+    'fingerprint': None, 'reloading': False, 'reloads': 0,
+    'reload_error': None, 'failed_fingerprint': None
+}
+
+MODEL_PATH = os.getenv("MODEL_PATH", "models/latest")
+
+# Kiểm tra model mới mỗi N giây (0 = tắt, chỉ reload qua /api/admin/reload-model)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 10))
+
+# File /api/admin/reload-model chạm vào: mtime của nó nằm trong fingerprint,
+# nên watcher của mọi worker (gunicorn) đều reload, không chỉ worker nhận request
+MODEL_RELOAD_TRIGGER = os.getenv("MODEL_RELOAD_TRIGGER", f"{MODEL_PATH}.reload")
+
+# Load model trong master trước khi fork (gunicorn --preload, xem gunicorn.conf.py).
+# Tắt mặc định: TensorFlow không fork-safe, phải kiểm tra với model thật
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "false").lower() == "true"
+
+# Token cho các route /api/admin/* (header X-Admin-Token); để trống = tắt
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Số lượt chat đang chạy trên từng agent (theo id), để reload biết khi nào
+# agent cũ không còn ai dùng
+_agent_users = {}
+_agent_users_cond = threading.Condition()
+_reload_lock = threading.Lock()
+
+# Câu mẫu chạy qua pipeline trước khi nhận traffic (trace graph TensorFlow,
+# nạp lookup table...), để user đầu tiên không phải chịu chi phí này
+WARMUP_UTTERANCES = [
+    "xin chào",
+    "unigrow là gì",
+    "giá bao nhiêu",
+    "tôi 16 tuổi cao 1m60 muốn cao thêm",
+    "cảm ơn",
+]
+WARMUP_SENDER_ID = "__warmup__"
+
+# Thời gian chờ tối đa cho một lượt chat (giây)
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", 60))
+
+# Thời gian tối đa chờ các lượt chat trên model cũ xong sau khi reload (giây)
+AGENT_DRAIN_TIMEOUT = float(os.getenv("AGENT_DRAIN_TIMEOUT", CHAT_TIMEOUT * 2))
+
+# LLM client riêng của web server (stream /api/chat/stream). Semantic cache
+# ghi ra file khác với action server, tránh hai process ghi đè file của nhau
+llm_client = MistralLLMClient(cache_path=os.getenv("WEB_LLM_CACHE_PATH", "llm_cache_web.json"))
+
+# Thời gian trình duyệt được cache media (giây)
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", 3600))
+
+# Tạo sẵn thumbnail ở background để request đầu không phải chờ resize
+thumbnail_thread = threading.Thread(
+    target=media_handler.pregenerate_thumbnails,
+    name="media-thumbnails",
+    daemon=True
+)
+thumbnail_thread.start()
+
+def _model_fingerprint(model_path=MODEL_PATH):
+    """
+    Dấu hiệu nhận biết model: đổi khi models/latest trỏ sang / chứa model
+    mới, hoặc khi admin yêu cầu reload (chạm MODEL_RELOAD_TRIGGER)
+    """
+    real = os.path.realpath(model_path)
+    fingerprint = None
+    if os.path.isdir(real):
+        files = [entry for entry in os.scandir(real) if entry.is_file()]
+        if files:
+            newest = max(files, key=lambda entry: entry.stat().st_mtime_ns)
+            stat = newest.stat()
+            fingerprint = f"{newest.path}:{stat.st_mtime_ns}:{stat.st_size}"
+    if fingerprint is None:
+        stat = os.stat(real)
+        fingerprint = f"{real}:{stat.st_mtime_ns}:{stat.st_size}"
+    
     try:
-        model_path = "models/latest"
-        if not os.path.exists(model_path):
-            logger.error(f"Model không tìm thấy: {model_path}")
-            return False
-        
-        agent = Agent.load(model_path)
-        logger.info("✅ Rasa model loaded thành công")
+        return f"{fingerprint}:reload={os.stat(MODEL_RELOAD_TRIGGER).st_mtime_ns}"
+    except FileNotFoundError:
+        return fingerprint
+
+def _build_agent(warm=True):
+    """Load + warm-up một Agent mới từ models/latest, chưa đưa vào phục vụ"""
+    global tracker_store
+    started = time.perf_counter()
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError(f"Model không tìm thấy: {MODEL_PATH}")
+    
+    from rasa.core.agent import Agent
+    from tracker_store import LRUSQLiteTrackerStore
+    
+    if tracker_store is None:
+        tracker_store = LRUSQLiteTrackerStore()
+        atexit.register(tracker_store.flush)
+    
+    # Lấy fingerprint trước khi load: model đổi trong lúc load sẽ được nạp lại
+    fingerprint = _model_fingerprint()
+    # Dùng chung tracker store và lock store với agent cũ: hội thoại giữ
+    # nguyên, và lượt của cùng một user không chạy song song trên hai agent
+    current = agent
+    loaded = Agent.load(
+        MODEL_PATH,
+        tracker_store=tracker_store,
+        lock_store=current.lock_store if current is not None else None
+    )
+    if not loaded.is_ready():
+        raise RuntimeError(f"Model không hợp lệ: {MODEL_PATH}")
+    model_state['load_seconds'] = round(time.perf_counter() - started, 2)
+    logger.info(f"✅ Rasa model loaded thành công ({model_state['load_seconds']}s)")
+    
+    if current is None:
+        model_state['status'] = 'warming_up'
+    if warm:
+        warm_up(loaded)
+    return loaded, fingerprint
+
+def load_agent(warm=True):
+    """
+    Load Rasa model lần đầu (import rasa ở đây, không phải lúc import app).
+    warm=False: chưa warm-up, status dừng ở warming_up (xem preload_for_fork)
+    """
+    model_state['status'] = 'loading'
+    try:
+        loaded, fingerprint = _build_agent(warm=warm)
+        _swap_agent(loaded)
+        model_state.update(
+            status='ready' if warm else 'warming_up',
+            error=None, fingerprint=fingerprint, failed_fingerprint=None
+        )
         return True
     except Exception as e:
         logger.error(f"Lỗi load model: {str(e)}")
+        model_state.update(status='failed', error=str(e), failed_fingerprint=_safe_fingerprint())
+        return False
+
+def reload_agent():
+    """
+    Hot reload: load + kiểm tra model mới ở background rồi đổi agent.
+    Request đang chạy hoàn tất trên agent cũ; agent cũ được giải phóng
+    ngay khi request cuối cùng dùng nó kết thúc. Model lỗi thì giữ agent cũ.
+    """
+    if not _reload_lock.acquire(blocking=False):
         return False
+    try:
+        if agent is None:
+            return load_agent()
+        
+        model_state['reloading'] = True
+        try:
+            loaded, fingerprint = _build_agent()
+        except Exception as e:
+            logger.error(f"Reload model thất bại, giữ model cũ: {str(e)}")
+            model_state.update(reload_error=str(e), failed_fingerprint=_safe_fingerprint())
+            return False
+        
+        old = weakref.ref(_swap_agent(loaded))
+        del loaded
+        model_state['reloads'] += 1
+        model_state.update(reload_error=None, failed_fingerprint=None, fingerprint=fingerprint)
+        logger.info(f"Đã chuyển sang model mới ({fingerprint})")
+        
+        _release_agent(old)
+        return True
+    finally:
+        model_state['reloading'] = False
+        _reload_lock.release()
+
+def _safe_fingerprint():
+    try:
+        return _model_fingerprint()
+    except OSError:
+        return None
+
+def _swap_agent(new_agent):
+    """Đổi agent phục vụ (atomic với run_turn), trả về agent cũ"""
+    global agent
+    with _agent_users_cond:
+        old, agent = agent, new_agent
+    # Câu trả lời cache từ model cũ có thể không còn đúng
+    response_cache.clear()
+    return old
+
+def _release_agent(old_ref):
+    """Chờ request cuối cùng trên agent cũ xong rồi thu hồi bộ nhớ của nó"""
+    old = old_ref()
+    if old is None:
+        return
+    key = id(old)
+    del old
+    with _agent_users_cond:
+        drained = _agent_users_cond.wait_for(
+            lambda: key not in _agent_users, timeout=AGENT_DRAIN_TIMEOUT
+        )
+    if not drained:
+        logger.warning("Hết thời gian chờ request trên model cũ, thu hồi sau khi chúng xong")
+    # Agent/graph của Rasa có vòng tham chiếu: refcount không đủ để giải phóng.
+    # Worker fork từ master đã gc.freeze() model cũ, phải unfreeze mới thu hồi được
+    if gc.get_freeze_count():
+        gc.unfreeze()
+    gc.collect()
+    if old_ref() is not None:
+        logger.warning("Model cũ vẫn còn được tham chiếu, chưa giải phóng được")
+    else:
+        logger.info("Đã giải phóng model cũ")
+
+def run_turn(text, sender_id, input_channel=None):
+    """
+    Chạy một lượt trên agent hiện tại, trả về (responses, intent).
+    Câu hỏi stateless (chào hỏi, giá, ...) trả thẳng từ cache nhưng lượt
+    vẫn được ghi vào tracker của user (replay_turn).
+    """
+    cache_key = normalize_text(text)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        intent, responses, events = cached
+        replayed, _ = _run_on_agent(
+            lambda current: replay_turn(current, text, sender_id, events, input_channel=input_channel)
+        )
+        if replayed:
+            return responses, intent
+    
+    (responses, intent, events), unchanged = _run_on_agent(
+        lambda current: handle_turn(current, text, sender_id, input_channel=input_channel)
+    )
+    # Không cache câu trả lời của model vừa bị thay
+    if events is not None and unchanged:
+        response_cache.put(cache_key, intent, responses, events)
+    return responses, intent
+
+def _run_on_agent(make_coro):
+    """
+    Chạy make_coro(agent hiện tại) trên event loop chung của worker, trả về
+    (kết quả, agent có còn là agent hiện tại không). Reload chờ các lượt
+    đang chạy trên agent cũ xong trước khi giải phóng nó.
+    """
+    with _agent_users_cond:
+        current = agent
+        key = id(current)
+        _agent_users[key] = _agent_users.get(key, 0) + 1
+    try:
+        result = agent_loop.run(make_coro(current), timeout=CHAT_TIMEOUT)
+        return result, current is agent
+    finally:
+        # Bỏ tham chiếu trước khi báo xong, để reload thu hồi được agent cũ ngay
+        del current
+        with _agent_users_cond:
+            _agent_users[key] -= 1
+            if not _agent_users[key]:
+                del _agent_users[key]
+                _agent_users_cond.notify_all()
+
+def warm_up(current_agent):
+    """
+    Chạy câu mẫu qua NLU và một lượt hội thoại đầy đủ trước khi nhận traffic;
+    cũng là smoke test cho model mới (lỗi hoặc không nhận ra intent -> raise)
+    """
+    started = time.perf_counter()
+    recognized = 0
+    for utterance in WARMUP_UTTERANCES:
+        result = agent_loop.run(current_agent.parse_message(utterance), timeout=CHAT_TIMEOUT)
+        if (result.get('intent') or {}).get('name'):
+            recognized += 1
+    if not recognized:
+        raise RuntimeError("Model không nhận diện được intent nào của câu mẫu")
+    # Một lượt chào hỏi đi qua cả policy (không gọi action server / LLM)
+    agent_loop.run(
+        handle_turn(current_agent, WARMUP_UTTERANCES[0], WARMUP_SENDER_ID),
+        timeout=CHAT_TIMEOUT
+    )
+    model_state['warmup_seconds'] = round(time.perf_counter() - started, 2)
+    logger.info(f"Warm-up xong ({model_state['warmup_seconds']}s)")
+
+def watch_model():
+    """
+    Theo dõi models/latest: khi model mới được ghi xong (fingerprint
+    giữ nguyên qua hai lần kiểm tra) thì hot reload
+    """
+    if MODEL_WATCH_INTERVAL <= 0:
+        return
+    
+    previous = None
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
+        fingerprint = _safe_fingerprint()
+        stable = fingerprint is not None and fingerprint == previous
+        previous = fingerprint
+        if not stable or fingerprint in (model_state['fingerprint'], model_state['failed_fingerprint']):
+            continue
+        logger.info(f"Phát hiện model mới: {fingerprint}")
+        reload_agent()
+
+def _load_and_watch():
+    load_agent()
+    watch_model()
+
+def start_model_loader():
+    """Load model ở background: server bind cổng ngay, /health/ready báo khi xong"""
+    threading.Thread(target=_load_and_watch, name="model-loader", daemon=True).start()
+
+def preload_for_fork():
+    """
+    Load model đồng bộ trong gunicorn master, trước khi fork worker: các
+    worker dùng chung trang nhớ của model (copy-on-write) thay vì mỗi
+    worker một bản.
+    
+    Master không warm-up: thread pool của TensorFlow được tạo ở op đầu tiên
+    và không tồn tại trong process con sau fork, nên inference chỉ chạy
+    trong worker (init_worker). Agent.load của Rasa vẫn có thể chạy vài op
+    TF, vì vậy MODEL_PRELOAD là tuỳ chọn và phải kiểm tra với model thật.
+    """
+    load_agent(warm=False)
+    # Thread không sống qua fork: đợi / dừng hết thread nền của master
+    thumbnail_thread.join()
+    agent_loop.stop()
+    # Dồn mọi object hiện có vào thế hệ permanent: GC của worker không
+    # ghi vào header của chúng nên trang nhớ của model không bị copy
+    gc.collect()
+    gc.freeze()
+
+def init_worker():
+    """Khởi tạo lại tài nguyên riêng của worker sau khi fork (gunicorn post_fork)"""
+    # Connection pool SQLAlchemy kế thừa từ master: bỏ đi nhưng không đóng
+    # socket/file mà master vẫn giữ
+    with app.app_context():
+        db.engine.dispose(close=False)
+    warm_up_worker()
+    # agent_loop, write_queue và tracker store tự khởi động lại theo pid;
+    # watcher là thread nên phải chạy lại trong từng worker
+    threading.Thread(target=watch_model, name="model-watcher", daemon=True).start()
+
+def warm_up_worker():
+    """
+    Warm-up model kế thừa từ master ngay trong worker, trước khi nhận
+    request: cũng là smoke test inference sau fork. Lỗi hoặc treo (hết
+    CHAT_TIMEOUT) thì worker báo failed ở /health/ready thay vì phục vụ
+    bằng model hỏng
+    """
+    if agent is None:
+        return
+    try:
+        warm_up(agent)
+        model_state.update(status='ready', error=None)
+    except Exception as e:
+        logger.error(
+            f"Warm-up sau fork thất bại ({str(e) or type(e).__name__}); "
+            "tắt MODEL_PRELOAD để mỗi worker tự load model"
+        )
+        _swap_agent(None)
+        model_state.update(status='failed', error=str(e) or type(e).__name__)
+
+async def handle_turn(current_agent, text, sender_id, input_channel=None):
+    """
+    Chạy một lượt hội thoại, trả về (responses, intent đã nhận diện,
+    event của lượt nếu cache được cho mọi user, ngược lại None)
+    """
+    from rasa.core.channels.channel import UserMessage
+    
+    responses = await current_agent.handle_message(
+        UserMessage(text, sender_id=sender_id, input_channel=input_channel)
+    )
+    
+    tracker = await current_agent.tracker_store.retrieve(sender_id)
+    intent = None
+    if tracker and tracker.latest_message:
+        intent = (tracker.latest_message.intent or {}).get('name')
+    
+    return responses, intent, turn_events(tracker) if is_stateless_turn(tracker) else None
+
+async def replay_turn(current_agent, text, sender_id, events, input_channel=None):
+    """
+    Ghi lượt trả lời từ cache vào tracker của user (UserUttered với tin nhắn
+    thật + các event action/bot của lượt gốc), như khi agent chạy lượt đó.
+    Trả về False (chạy lượt thật) nếu user chưa có hội thoại.
+    """
+    from rasa.core.channels.channel import CollectingOutputChannel
+    from rasa.shared.core.events import Event
+    
+    async with current_agent.lock_store.lock(sender_id):
+        # User mới: để agent chạy lượt thật (có action_session_start)
+        if await current_agent.tracker_store.retrieve(sender_id) is None:
+            return False
+        
+        # Mở session mới nếu session cũ đã hết hạn, như handle_message
+        tracker = await current_agent.processor.fetch_tracker_and_update_session(
+            sender_id, CollectingOutputChannel()
+        )
+        now = time.time()
+        for data in events:
+            data = dict(data, timestamp=now)
+            if data.get('event') == 'user':
+                data.update(
+                    text=text,
+                    parse_data=dict(data.get('parse_data') or {}, text=text),
+                    input_channel=input_channel,
+                    message_id=None
+                )
+            tracker.update(Event.from_parameters(data))
+        await current_agent.tracker_store.save(tracker)
+    return True
 
 # ==================== ROUTES - TRANG WEB ====================
 
@@ -56,14 +482,30 @@ def index():
     return send_from_directory('.', 'index.html')
 
 @app.route('/health', methods=['GET'])
+@app.route('/health/ready', methods=['GET'])
 def health():
-    """Kiểm tra hệ thống có bình thường không"""
+    """Readiness: 200 khi model đã load và warm-up xong, 503 khi chưa"""
+    ready = agent is not None and model_state['status'] == 'ready'
     return jsonify({
-        'status': 'healthy',
+        'status': 'healthy' if ready else model_state['status'],
+        'model': model_state,
         'bot_name': 'Unigrow Chatbot',
         'version': '1.0.0',
         'timestamp': datetime.now().isoformat()
-    }), 200
+    }), 200 if ready else 503
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: process còn phục vụ HTTP (kể cả khi model đang load)"""
+    return jsonify({'status': 'alive', 'timestamp': datetime.now().isoformat()}), 200
+
+def _agent_unavailable():
+    """Response 503 khi model chưa sẵn sàng"""
+    if model_state['status'] in ('loading', 'warming_up'):
+        response = jsonify({'error': 'Bot đang khởi động, vui lòng thử lại sau giây lát'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return jsonify({'error': 'Bot không hoạt động'}), 503
 
 # ==================== XÁC THỰC NGƯỜI DÙNG ====================
 
@@ -136,6 +578,7 @@ def login():
 def chat():
     """Chat - lưu lịch sử vào database"""
     try:
+        started = time.perf_counter()
         data = request.json
         user_id = data.get('user_id')
         user_message = data.get('message', '').strip()
@@ -147,20 +590,13 @@ def chat():
             return jsonify({'error': 'Cần đăng nhập trước'}), 401
         
         if not agent:
-            return jsonify({'error': 'Bot không hoạt động'}), 503
+            return _agent_unavailable()
         
         # Xử lý tin nhắn
         bot_response = "Xin lỗi, tôi không hiểu."
         
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            responses = loop.run_until_complete(
-                agent.handle_text(user_message)
-            )
-            
-            loop.close()
+            responses, intent = run_turn(user_message, str(user_id))
             
             if responses:
                 for resp in responses:
@@ -170,25 +606,14 @@ def chat():
         except Exception as e:
             logger.error(f"Lỗi Rasa: {str(e)}")
         
-        # LƯU VÀO DATABASE
-        try:
-            user = User.query.get(user_id)
-            if user:
-                message = Message(
-                    user_id=user_id,
-                    user_message=user_message,
-                    bot_response=bot_response
-                )
-                db.session.add(message)
-                
-                analytics = Analytics.query.filter_by(user_id=user_id).first()
-                if analytics:
-                    analytics.total_messages += 1
-                    analytics.last_active = datetime.utcnow()
-                
-                db.session.commit()
-        except Exception as e:
-            logger.error(f"Lỗi lưu DB: {str(e)}")
+        response_time = time.perf_counter() - started
+        chat_latency.record(str(user_id), response_time)
+        
+        # LƯU VÀO DATABASE (write-behind, không chờ commit)
+        write_queue.add_message(
+            user_id, user_message, bot_response,
+            response_time=response_time
+        )
         
         return jsonify({
             'success': True,
@@ -202,26 +627,168 @@ def chat():
         return jsonify({'error': str(e)}), 500
 
 
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
+# id tạm cho tin nhắn còn trong write-behind buffer: xếp sau mọi tin đã ghi
+# có cùng timestamp
+PENDING_MESSAGE_ID = 2 ** 63 - 1
+
+
+def _encode_cursor(timestamp, message_id):
+    """Cursor = (timestamp, id) của tin nhắn cũ nhất trong trang"""
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    timestamp, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+def _sse(event, data):
+    """Một event Server-Sent-Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Chat dạng stream (SSE): câu trả lời LLM được gửi từng token"""
+    started = time.perf_counter()
+    data = request.json or {}
+    user_id = data.get('user_id')
+    user_message = data.get('message', '').strip()
+    
+    if not user_message:
+        return jsonify({'error': 'Tin nhắn không được trống'}), 400
+    
+    if not user_id:
+        return jsonify({'error': 'Cần đăng nhập trước'}), 401
+    
+    if not agent:
+        return _agent_unavailable()
+    
+    try:
+        responses, intent = run_turn(
+            user_message, str(user_id), input_channel=STREAM_INPUT_CHANNEL
+        )
+    except Exception as e:
+        logger.error(f"Lỗi Rasa: {str(e)}")
+        responses = []
+    
+    def generate():
+        parts = []
+        first_token = True
+        try:
+            for resp in responses or []:
+                if not isinstance(resp, dict):
+                    continue
+                
+                if resp.get('text'):
+                    parts.append(resp['text'])
+                    yield _sse('message', {'text': resp['text']})
+                
+                llm_args = (resp.get('custom') or {}).get('llm_stream')
+                if llm_args:
+                    # Action LLM chuyển việc sinh câu trả lời sang đây để stream
+                    tokens = []
+                    parts.append(tokens)
+                    yield _sse('start', {})
+                    for token in llm_client.generate_stream(**llm_args):
+                        if first_token:
+                            stream_first_token.record(str(user_id), time.perf_counter() - started)
+                            first_token = False
+                        tokens.append(token)
+                        yield _sse('token', {'text': token})
+            
+            if not parts:
+                parts.append("Xin lỗi, tôi không hiểu.")
+                yield _sse('message', {'text': parts[0]})
+            
+            yield _sse('done', {'timestamp': datetime.utcnow().isoformat()})
+        
+        finally:
+            # Lưu toàn bộ câu trả lời khi stream kết thúc (kể cả khi client ngắt)
+            bot_response = "\n\n".join(
+                ''.join(part).strip() if isinstance(part, list) else part
+                for part in parts
+            )
+            response_time = time.perf_counter() - started
+            chat_latency.record(str(user_id), response_time)
+            write_queue.add_message(
+                user_id, user_message, bot_response,
+                response_time=response_time
+            )
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/history/<int:user_id>', methods=['GET'])
 def get_history(user_id):
-    """Xem lịch sử chat"""
+    """
+    Xem lịch sử chat (phân trang bằng cursor: ?before=<cursor>&limit=N)
+    
+    Tin nhắn chưa được write-behind ghi xuống DB được ghép vào từ buffer
+    của worker này (không flush trên request path)
+    """
     try:
-        messages = Message.query.filter_by(user_id=user_id).order_by(
-            Message.timestamp.desc()
-        ).limit(50).all()
+        limit = request.args.get('limit', HISTORY_DEFAULT_LIMIT, type=int)
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+        
+        query = Message.query.filter(Message.user_id == user_id)
+        
+        before = request.args.get('before')
+        if before:
+            try:
+                before_key = _decode_cursor(before)
+            except Exception:
+                return jsonify({'error': 'Cursor không hợp lệ'}), 400
+            
+            # Keyset: chỉ đi tiếp trên index (user_id, timestamp), không OFFSET
+            query = query.filter(
+                tuple_(Message.timestamp, Message.id) < tuple_(*before_key)
+            )
+        
+        stored, pending, _ = write_queue.read_through(
+            user_id,
+            lambda: query.order_by(
+                Message.timestamp.desc(),
+                Message.id.desc()
+            ).limit(limit + 1).all()
+        )
+        
+        rows = [
+            (msg.timestamp, msg.id, msg.user_message, msg.bot_response)
+            for msg in stored
+        ]
+        for msg in pending:
+            row = (msg['timestamp'], PENDING_MESSAGE_ID, msg['user_message'], msg['bot_response'])
+            if not before or row[:2] < before_key:
+                rows.append(row)
+        rows.sort(key=lambda row: row[:2], reverse=True)
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
         history = []
-        for msg in reversed(messages):
+        for timestamp, _, user_message, bot_response in reversed(rows):
             history.append({
-                'user_message': msg.user_message,
-                'bot_response': msg.bot_response,
-                'timestamp': msg.timestamp.isoformat()
+                'user_message': user_message,
+                'bot_response': bot_response,
+                'timestamp': timestamp.isoformat()
             })
         
         return jsonify({
             'success': True,
             'total': len(history),
-            'history': history
+            'history': history,
+            'has_more': has_more,
+            'next_cursor': _encode_cursor(*rows[-1][:2]) if has_more else None
         }), 200
         
     except Exception as e:
@@ -231,24 +798,159 @@ def get_history(user_id):
 
 @app.route('/api/analytics/<int:user_id>', methods=['GET'])
 def get_analytics(user_id):
-    """Xem thống kê"""
+    """Xem thống kê (cộng thêm các lượt còn trong write-behind buffer của worker này)"""
     try:
-        analytics = Analytics.query.filter_by(user_id=user_id).first()
+        analytics, _, delta = write_queue.read_through(
+            user_id,
+            lambda: Analytics.query.filter_by(user_id=user_id).first()
+        )
         
         if not analytics:
             return jsonify({'error': 'Không tìm thấy thống kê'}), 404
         
+        total_messages = analytics.total_messages or 0
+        average_response_time = analytics.average_response_time
+        last_active = analytics.last_active
+        if delta:
+            total_messages += delta['count']
+            last_active = max(last_active, delta['last_active']) if last_active else delta['last_active']
+            if delta['timed']:
+                timed = analytics.response_time_count or 0
+                average = average_response_time or 0.0
+                average_response_time = (average * timed + delta['time_sum']) / (timed + delta['timed'])
+        
         return jsonify({
             'success': True,
-            'total_messages': analytics.total_messages,
-            'average_response_time': analytics.average_response_time,
-            'last_active': analytics.last_active.isoformat()
+            'total_messages': total_messages,
+            'average_response_time': average_response_time,
+            'last_active': last_active.isoformat() if last_active else None,
+            # Phân vị từ sketch trong RAM (từ lúc server khởi động)
+            'latency': chat_latency.user_summary(str(user_id)),
+            'global_latency': chat_latency.global_summary()
         }), 200
         
     except Exception as e:
         logger.error(f"Lỗi thống kê: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# ==================== MEDIA ====================
+
+@app.route('/api/media/<kind>/<name>', methods=['GET'])
+def get_media(kind, name):
+    """
+    Gửi ảnh / tài liệu / video trong knowledge base
+
+    Hỗ trợ If-None-Match (304) và Range (206) để tua video. ?w=<px> trả về
+    ảnh thu nhỏ cho khung chat.
+    """
+    try:
+        if kind not in MEDIA_KINDS:
+            return jsonify({'error': 'Loại media không hợp lệ'}), 404
+        
+        # Chỉ gửi file có trong catalog (không ghép đường dẫn từ URL)
+        media = media_handler.get(kind, name)
+        if media is None:
+            return jsonify({'error': 'Không tìm thấy media'}), 404
+        
+        width = request.args.get('w', type=int)
+        if width and kind == 'images':
+            media = media_handler.get_thumbnail(name, width) or media
+        
+        response = send_file(
+            media.path,
+            conditional=True,
+            etag=f'{media.size:x}-{media.mtime_ns:x}',
+            last_modified=media.mtime,
+            max_age=MEDIA_MAX_AGE
+        )
+        # Báo cho trình duyệt biết có thể tua video bằng Range ngay từ lần đầu
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    
+    except Exception as e:
+        logger.error(f"Lỗi gửi media: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Thống kê nội bộ của server (tracker store, ...)"""
+    return jsonify({
+        'success': True,
+        'model': model_state,
+        'tracker_store': tracker_store.stats() if tracker_store else None,
+        'write_queue': write_queue.stats(),
+        'response_cache': response_cache.stats(),
+        'llm_client': llm_client.stats(),
+        'media': media_handler.stats()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metrics dạng Prometheus text format"""
+    lines = render_summary(
+        'unigrow_chat_response_seconds',
+        'Thời gian xử lý một lượt /api/chat',
+        chat_latency.snapshot()
+    )
+    lines += render_summary(
+        'unigrow_chat_stream_first_token_seconds',
+        'Thời gian tới token đầu tiên của /api/chat/stream',
+        stream_first_token.snapshot()
+    )
+    if tracker_store is not None:
+        lines += render_stats(
+            'unigrow_tracker_store', tracker_store.stats(),
+            counters=('hits', 'misses', 'disk_loads', 'evictions')
+        )
+    lines += render_stats(
+        'unigrow_write_queue', write_queue.stats(),
+        counters=('flushes', 'rows_written', 'dropped', 'errors')
+    )
+    lines += render_stats(
+        'unigrow_response_cache', response_cache.stats(),
+        counters=('hits', 'misses', 'stores', 'invalidations')
+    )
+    # LLM client của process này (dùng cho /api/chat/stream)
+    lines.append(render_llm_metrics(llm_client).rstrip('\n'))
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# ==================== QUẢN TRỊ ====================
+
+@app.route('/api/admin/reload-model', methods=['POST'])
+def reload_model():
+    """
+    Hot reload models/latest ở background (header X-Admin-Token)
+    
+    Worker nhận request reload ngay; các worker khác (gunicorn) reload qua
+    watcher khi thấy MODEL_RELOAD_TRIGGER đổi, nên cần MODEL_WATCH_INTERVAL > 0
+    """
+    try:
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Chưa cấu hình ADMIN_TOKEN'}), 403
+        
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Không có quyền'}), 401
+        
+        if model_state['reloading'] or _reload_lock.locked():
+            return jsonify({'error': 'Đang reload model', 'model': model_state}), 409
+        
+        # Chạm trigger trước khi reload: fingerprint của worker này đã gồm
+        # mtime mới nên watcher của nó không reload lần nữa
+        with open(MODEL_RELOAD_TRIGGER, 'a'):
+            os.utime(MODEL_RELOAD_TRIGGER)
+        
+        threading.Thread(target=reload_agent, name="model-reload", daemon=True).start()
+        return jsonify({
+            'success': True,
+            'message': 'Đang reload model',
+            'all_workers': MODEL_WATCH_INTERVAL > 0,
+            'model': model_state
+        }), 202
+    except Exception as e:
+        logger.error(f"Lỗi reload model: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # ==================== ERROR HANDLERS ====================
 
 @app.errorhandler(404)
@@ -259,6 +961,12 @@ def not_found(e):
 def internal_error(e):
     return jsonify({'error': 'Lỗi server'}), 500
 
+if MODEL_PRELOAD:
+    preload_for_fork()
+else:
+    # Bắt đầu load model ngay khi import
+    start_model_loader()
+
 # ==================== MAIN ====================
 
 if __name__ == '__main__':
@@ -266,17 +974,15 @@ if __name__ == '__main__':
     print("🤖 Unigrow AI Chatbot - API Server")
     print("=" * 50)
     
-    print("Loading Rasa model...")
-    if load_agent():
-        print("✅ Model loaded!")
-        print("\n" + "=" * 50)
-        print("🚀 Starting Flask server...")
-        print("📍 Web UI: http://localhost:5000")
-        print("📡 API: http://localhost:5000/api")
-        print("=" * 50 + "\n")
-        
-        app.run(debug=True, host='127.0.0.1', port=5000)
-    else:
-        print("❌ Failed to load model")
-        print("Hãy train model trước:")
+    # Model load ở background; theo dõi tiến độ qua /health/ready
+    if not os.path.exists(MODEL_PATH):
+        print("⚠️ Chưa có model, hãy train trước:")
         print("  rasa train --data data/ --domain domain.yml --config config.yml")
+    
+    print("\n" + "=" * 50)
+    print("🚀 Starting Flask server...")
+    print("📍 Web UI: http://localhost:5000")
+    print("📡 API: http://localhost:5000/api")
+    print("=" * 50 + "\n")
+    
+    app.run(debug=True, host='127.0.0.1', port=5000, threaded=True)
@@ -0,0 +1,148 @@
+"""
+Load test action server: action rẻ có bị LLM chặn không?
+
+Chạy rasa_sdk ActionExecutor (cùng code path với action server) trên một
+event loop, bắn đồng thời nhiều action_query_llm_fallback tới một Ollama
+giả lập chậm, trong lúc đó gọi action_provide_pricing_options đều đặn và
+đo độ trễ của chúng. So sánh run sync cũ (requests, chặn loop) với run
+async (aiohttp).
+
+Chạy:
+    python benchmarks/bench_async_actions.py --llm-calls 8 --latency 1.0
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_MAX_CONCURRENCY", "8")
+
+from rasa_sdk.executor import ActionExecutor
+
+from actions import actions as unigrow_actions
+from actions.utils import llm_client
+
+LATENCY = 1.0
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(LATENCY)
+        data = json.dumps({"response": "Unigrow hỗ trợ phát triển chiều cao.", "done": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class LegacySyncLLMFallback(unigrow_actions.ActionQueryLLMFallback):
+    """Run sync như trước: generate_response (requests) chặn event loop"""
+
+    def name(self):
+        return "legacy_llm_fallback"
+
+    def run(self, dispatcher, tracker, domain):
+        response = llm_client.generate_response(
+            prompt=tracker.latest_message["text"], sender_id=tracker.sender_id
+        )
+        dispatcher.utter_message(text=response)
+        return []
+
+
+def action_call(action, sender_id, text):
+    return {
+        "next_action": action,
+        "sender_id": sender_id,
+        "domain": {},
+        "tracker": {
+            "sender_id": sender_id,
+            "slots": {},
+            "latest_message": {"text": text, "intent": {"name": "nlu_fallback"}, "entities": []},
+            "events": [],
+            "paused": False,
+            "followup_action": None,
+            "active_loop": {},
+            "latest_action_name": None,
+        },
+    }
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_mode(executor, llm_action, llm_calls, probes):
+    async def timed(call):
+        started = time.perf_counter()
+        await executor.run(call)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    llm_tasks = [
+        asyncio.create_task(timed(action_call(llm_action, f"llm-{i}", f"câu hỏi tải thử {i} về giấc ngủ")))
+        for i in range(llm_calls)
+    ]
+
+    # Độ trễ tính từ thời điểm lẽ ra request tới (gồm cả thời gian loop bị chặn)
+    cheap = []
+    interval = LATENCY * 2 / probes
+    for i in range(probes):
+        due = started + (i + 1) * interval
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await executor.run(action_call("action_provide_pricing_options", f"cheap-{i}", "giá"))
+        cheap.append(time.perf_counter() - due)
+
+    llm = await asyncio.gather(*llm_tasks)
+    return cheap, llm, time.perf_counter() - started
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-calls", type=int, default=8)
+    parser.add_argument("--probes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=1.0, help="độ trễ Ollama giả lập (giây)")
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    llm_client.api_endpoint = f"http://127.0.0.1:{server.server_port}/api/generate"
+
+    executor = ActionExecutor()
+    for action in (
+        unigrow_actions.ActionQueryLLMFallback,
+        LegacySyncLLMFallback,
+        unigrow_actions.ActionProvidePricingOptions,
+    ):
+        executor.register_action(action)
+
+    print(f"{args.llm_calls} LLM calls đồng thời, Ollama trễ {args.latency:.1f}s, "
+          f"{args.probes} lần gọi action giá trong lúc chờ")
+    for label, llm_action in (("sync (cũ)", "legacy_llm_fallback"), ("async", "action_query_llm_fallback")):
+        cheap, llm, wall = asyncio.run(run_mode(executor, llm_action, args.llm_calls, args.probes))
+        print(f"  {label:10s} action giá p50/max: {percentile(cheap, 0.5) * 1000:7.1f} / "
+              f"{max(cheap) * 1000:7.1f} ms | LLM p50: {percentile(llm, 0.5):.2f}s | tổng {wall:.2f}s")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
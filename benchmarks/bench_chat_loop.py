@@ -0,0 +1,108 @@
+"""
+Benchmark: event loop mới cho mỗi request vs một event loop chung cho worker
+
+So sánh throughput và latency p95 của cách chạy agent.handle_text cũ
+(new_event_loop + run_until_complete + close mỗi request) với AgentLoop.
+
+Chạy:
+    python benchmarks/bench_chat_loop.py
+    python benchmarks/bench_chat_loop.py --model models/latest --requests 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_loop import AgentLoop
+
+
+class StubAgent:
+    """Agent giả lập: chờ I/O như một round trip NLU + action server"""
+
+    def __init__(self, io_latency: float):
+        self.io_latency = io_latency
+
+    async def handle_text(self, text: str, sender_id: str = "default"):
+        await asyncio.sleep(self.io_latency)
+        return [{"recipient_id": sender_id, "text": f"echo: {text}"}]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run_per_request_loop(agent, message, sender_id):
+    """Cách cũ trong app.py"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(agent.handle_text(message, sender_id=sender_id))
+    finally:
+        loop.close()
+
+
+def bench(name, call, total, concurrency):
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        call("xin chào", f"bench_{i % concurrency}")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{name:<20} {total / elapsed:>10.1f} req/s"
+        f"   p50={percentile(latencies, 50) * 1000:>8.1f} ms"
+        f"   p95={percentile(latencies, 95) * 1000:>8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--io-latency", type=float, default=0.02)
+    parser.add_argument("--model", help="Đường dẫn model Rasa thật (mặc định dùng StubAgent)")
+    args = parser.parse_args()
+
+    if args.model:
+        from rasa.core.agent import Agent
+        agent = Agent.load(args.model)
+    else:
+        agent = StubAgent(args.io_latency)
+
+    shared = AgentLoop()
+
+    print("=" * 72)
+    print(f"requests={args.requests} concurrency={args.concurrency}")
+    print("=" * 72)
+
+    bench(
+        "per-request loop",
+        lambda msg, sid: run_per_request_loop(agent, msg, sid),
+        args.requests,
+        args.concurrency
+    )
+    bench(
+        "shared AgentLoop",
+        lambda msg, sid: shared.run(agent.handle_text(msg, sender_id=sid)),
+        args.requests,
+        args.concurrency
+    )
+
+    shared.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark trích tuổi / chiều cao
+
+Corpus là các câu ví dụ thật trong data/nlu/*.yml (nhân lên cho đủ
+lớn). So sánh cách cũ (chạy lần lượt từng mẫu re.search / re.findall
+như ActionExtractAgeEntity + ActionValidateHeight trước đây) với
+actions.extraction.extract (một alternation đã compile, quét một lần).
+
+Chạy:
+    python benchmarks/bench_extraction.py --repeat 200
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from actions.extraction import extract
+
+AGE_PATTERNS = [
+    r'(\d{1,2})\s*tuổi',
+    r'tôi\s+(\d{1,2})',
+    r'mình\s+(\d{1,2})',
+    r'em\s+(\d{1,2})',
+]
+
+HEIGHT_PATTERNS = [
+    r'(\d{2,3})\s*cm',
+    r'(\d)m(\d{2})',
+    r'(\d\.\d{2})\s*m',
+]
+
+
+# (câu, tuổi, chiều cao, chiều cao mong muốn) phải trích đúng
+CHECKS = [
+    ("lên 180 được không", None, None, 180),
+    ("muốn 175 trở lên", None, None, 175),
+    ("em 16 tuổi cao 1m60 muốn lên 170", 16, 160, 170),
+    ("muốn 170 thì 180k được không", None, None, 170),
+    ("giá 150đ", None, None, None),
+    ("mục tiêu 180 tr", None, None, None),
+]
+
+
+def legacy(text):
+    user_message = text.lower()
+    age = None
+    for pattern in AGE_PATTERNS:
+        match = re.search(pattern, user_message)
+        if match and 0 <= int(match.group(1)) <= 150:
+            age = match.group(1)
+            break
+    heights = []
+    for pattern in HEIGHT_PATTERNS:
+        heights.extend(re.findall(pattern, user_message))
+    return age, heights
+
+
+def load_corpus():
+    lines = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "data", "nlu", "*.yml"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("- ") and not line.startswith("- intent:"):
+                    lines.append(line[2:])
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    with_numbers = [text for text in corpus if re.search(r"\d", text)]
+
+    for label, lines in (("toàn bộ corpus", corpus), ("chỉ câu có số", with_numbers)):
+        messages = lines * args.repeat
+        print(f"{label} ({len(messages):,} câu):")
+        for name, fn in (("legacy (per-pattern)", legacy), ("extract (single pass)", extract)):
+            started = time.perf_counter()
+            for text in messages:
+                fn(text)
+            elapsed = time.perf_counter() - started
+            print(f"  {name:24s} {elapsed * 1e6 / len(messages):6.2f} us/msg "
+                  f"({len(messages) / elapsed:,.0f} msg/s)")
+
+    failed = 0
+    for text, age, height, target in CHECKS:
+        m = extract(text)
+        ok = (m.age, m.height, m.target_height) == (age, height, target)
+        failed += not ok
+        print(f"  {'ok' if ok else 'FAIL':4s} {text!r:40s} -> {m}")
+    assert not failed, f"{failed} câu trích sai"
+
+    found = [(text, extract(text)) for text in corpus]
+    found = [(text, m) for text, m in found if m.age or m.heights]
+    print(f"corpus: {len(corpus)} câu, {len(found)} câu có tuổi/chiều cao")
+    for text, m in found[:10]:
+        print(f"  {text!r:50s} -> {m}  (cũ: {legacy(text)})")
+
+
+if __name__ == "__main__":
+    main()
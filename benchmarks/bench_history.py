@@ -0,0 +1,153 @@
+"""
+Benchmark: phân trang lịch sử chat OFFSET vs keyset trên bảng message lớn
+
+Tạo một database SQLite tạm với cùng schema bảng message của models.py,
+rồi đo thời gian lấy trang đầu và trang sâu của một user:
+  - OFFSET, không có index (giống get_history cũ khi phân trang)
+  - OFFSET, có index (user_id, timestamp)
+  - keyset (?before=<cursor>), có index (user_id, timestamp)
+
+Chạy:
+    python benchmarks/bench_history.py --rows 2000000 --users 200
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PAGE = 50
+
+
+def build(path, rows, users):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE message ("
+        "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+        "user_message TEXT NOT NULL, bot_response TEXT NOT NULL, timestamp DATETIME)"
+    )
+    start = datetime(2025, 1, 1)
+    batch = []
+    for i in range(rows):
+        ts = start + timedelta(seconds=i)
+        batch.append((
+            random.randint(1, users),
+            "giá bao nhiêu",
+            "Unigrow hiện có các gói...",
+            ts.strftime("%Y-%m-%d %H:%M:%S.%f")
+        ))
+        if len(batch) == 50000:
+            conn.executemany(
+                "INSERT INTO message (user_id, user_message, bot_response, timestamp) "
+                "VALUES (?, ?, ?, ?)", batch
+            )
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO message (user_id, user_message, bot_response, timestamp) "
+            "VALUES (?, ?, ?, ?)", batch
+        )
+    conn.commit()
+    return conn
+
+
+def timed(conn, sql, params, repeat=5):
+    best = float("inf")
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best, rows
+
+
+def offset_page(conn, user_id, page):
+    return timed(
+        conn,
+        "SELECT id, timestamp FROM message WHERE user_id = ? "
+        "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+        (user_id, PAGE, page * PAGE)
+    )
+
+
+def keyset_cursor_for(conn, user_id, page):
+    """Lấy cursor (timestamp, id) ở đầu trang `page` bằng cách đi tuần tự"""
+    cursor = None
+    for _ in range(page):
+        if cursor is None:
+            rows = conn.execute(
+                "SELECT id, timestamp FROM message WHERE user_id = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?", (user_id, PAGE)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, timestamp FROM message WHERE user_id = ? "
+                "AND (timestamp, id) < (?, ?) "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (user_id, cursor[1], cursor[0], PAGE)
+            ).fetchall()
+        cursor = rows[-1]
+    return cursor
+
+
+def keyset_page(conn, user_id, cursor):
+    if cursor is None:
+        return timed(
+            conn,
+            "SELECT id, timestamp FROM message WHERE user_id = ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?", (user_id, PAGE)
+        )
+    return timed(
+        conn,
+        "SELECT id, timestamp FROM message WHERE user_id = ? "
+        "AND (timestamp, id) < (?, ?) "
+        "ORDER BY timestamp DESC, id DESC LIMIT ?",
+        (user_id, cursor[1], cursor[0], PAGE)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "history_bench.db")
+    print(f"Building {args.rows} rows in {path} ...")
+    conn = build(path, args.rows, args.users)
+
+    user_id = 1
+    user_rows = conn.execute(
+        "SELECT COUNT(*) FROM message WHERE user_id = ?", (user_id,)
+    ).fetchone()[0]
+    pages = [0, user_rows // PAGE // 2, user_rows // PAGE - 1]
+
+    print("=" * 72)
+    print(f"user {user_id}: {user_rows} messages, page size {PAGE}")
+    print("=" * 72)
+
+    for page in pages:
+        elapsed, _ = offset_page(conn, user_id, page)
+        print(f"OFFSET, no index      page {page:>6}: {elapsed * 1000:>9.2f} ms")
+
+    conn.execute("CREATE INDEX ix_message_user_timestamp ON message (user_id, timestamp)")
+    conn.execute("ANALYZE")
+
+    for page in pages:
+        elapsed, _ = offset_page(conn, user_id, page)
+        print(f"OFFSET, index         page {page:>6}: {elapsed * 1000:>9.2f} ms")
+
+    for page in pages:
+        cursor = keyset_cursor_for(conn, user_id, page)
+        elapsed, _ = keyset_page(conn, user_id, cursor)
+        print(f"keyset, index         page {page:>6}: {elapsed * 1000:>9.2f} ms")
+
+    conn.close()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Kiểm tra transport của MistralLLMClient với một Ollama giả lập
+
+Stub server trả lời /api/generate và có thể bơm độ trễ hoặc lỗi.
+Script chạy các kịch bản: bình thường, lỗi 503 tạm thời (retry),
+Ollama chậm (read timeout), Ollama sập (circuit breaker mở, fail fast),
+và probe half-open của bản stream bị shed (breaker không được kẹt).
+
+Chạy:
+    python benchmarks/bench_llm_transport.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_READ_TIMEOUT", "1")
+os.environ.setdefault("LLM_BREAKER_FAILURES", "3")
+os.environ.setdefault("LLM_BREAKER_RESET", "2")
+
+from actions.resilience import AdmissionController
+from actions.utils import MistralLLMClient, LLM_UNAVAILABLE_RESPONSE
+
+
+class StubState:
+    latency = 0.0
+    fail_next = 0          # số request tiếp theo trả về 503
+    down = False           # trả 500 cho mọi request
+    requests = 0
+    connections = set()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        StubState.requests += 1
+        StubState.connections.add(self.client_address)
+        length = int(self.headers.get("Content-Length", 0))
+        json.loads(self.rfile.read(length) or b"{}")
+
+        time.sleep(StubState.latency)
+
+        if StubState.down:
+            status, body = 500, {"error": "down"}
+        elif StubState.fail_next > 0:
+            StubState.fail_next -= 1
+            status, body = 503, {"error": "busy"}
+        else:
+            status, body = 200, {"response": "Unigrow hỗ trợ phát triển chiều cao.", "done": True}
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except BrokenPipeError:
+            pass  # client đã bỏ đi (read timeout)
+
+
+def scenario(name, client, calls=1):
+    start = time.perf_counter()
+    results = [client.generate_response("Unigrow là gì?") for _ in range(calls)]
+    elapsed = time.perf_counter() - start
+    print(f"{name:<34} {elapsed * 1000 / calls:>8.1f} ms/call  -> {results[-1][:50]!r}")
+    return results
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = MistralLLMClient(base_url=f"http://127.0.0.1:{server.server_port}")
+
+    print("=" * 72)
+
+    scenario("healthy (keep-alive pool)", client, calls=50)
+    print(f"{'':<34} {StubState.requests} requests over {len(StubState.connections)} TCP connection(s)")
+
+    StubState.fail_next = 2
+    before = client.retries
+    scenario("2x 503 then OK (retry)", client)
+    print(f"{'':<34} retries={client.retries - before}")
+
+    StubState.latency = 1.5
+    scenario("slow backend (read timeout 1s)", client)
+    StubState.latency = 0.0
+
+    StubState.down = True
+    results = scenario("backend down", client, calls=10)
+    print(f"{'':<34} breaker={client.breaker.stats()}")
+    assert results[-1] == LLM_UNAVAILABLE_RESPONSE
+
+    StubState.down = False
+    time.sleep(float(os.environ["LLM_BREAKER_RESET"]) + 0.1)
+    scenario("recovered (half-open probe)", client)
+    print(f"{'':<34} breaker={client.breaker.stats()['state']}")
+
+    # Probe half-open của bản stream bị shed không được làm kẹt breaker
+    StubState.down = True
+    scenario("backend down again", client, calls=3)
+    StubState.down = False
+    time.sleep(float(os.environ["LLM_BREAKER_RESET"]) + 0.1)
+    admission = client.admission
+    client.admission = AdmissionController(max_concurrency=1, max_wait=0)
+    client.admission.acquire()
+    shed = "".join(client.generate_stream("Unigrow là gì?"))
+    client.admission = admission
+    results = scenario("half-open after shed stream", client)
+    print(f"{'':<34} shed={shed[:30]!r} breaker={client.breaker.stats()['state']}")
+    assert results[-1] != LLM_UNAVAILABLE_RESPONSE
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
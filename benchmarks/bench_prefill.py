@@ -0,0 +1,111 @@
+"""
+So sánh thời gian prefill của Ollama khi có / không dùng lại prefix
+
+Ba chế độ, mỗi chế độ chạy một hội thoại nhiều lượt:
+  - legacy:  system prompt nối vào prompt (cách cũ), không keep_alive
+  - system:  system prompt qua field "system" + keep_alive
+  - context: như "system" và gửi lại mảng context của lượt trước
+
+Số liệu lấy từ prompt_eval_count / prompt_eval_duration Ollama trả về.
+Cần một Ollama thật đang chạy (MISTRAL_BASE_URL).
+
+Chạy:
+    python benchmarks/bench_prefill.py --turns 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+from actions.utils import MistralLLMClient, UNIGROW_SYSTEM_PROMPT
+
+QUESTIONS = [
+    "Unigrow là gì?",
+    "Trẻ 12 tuổi có dùng được không?",
+    "Mỗi ngày uống mấy viên?",
+    "Bao lâu thì thấy kết quả?",
+    "Có tác dụng phụ không?",
+    "Mua ở đâu để đảm bảo hàng chính hãng?",
+]
+
+
+def legacy_payload(client: MistralLLMClient, question: str) -> dict:
+    """Payload kiểu cũ: nối system prompt vào prompt, tham số ở top-level"""
+    return {
+        "model": client.model_name,
+        "prompt": f"{UNIGROW_SYSTEM_PROMPT}\n\n{question}",
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "num_predict": 64,
+        "stream": False
+    }
+
+
+def run_mode(client: MistralLLMClient, mode: str, turns: int):
+    sender_id = f"bench-{mode}-{time.time()}"
+    rows = []
+    for i in range(turns):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if mode == "legacy":
+            payload = legacy_payload(client, question)
+        else:
+            payload = client._build_payload(
+                question, 0.7, 64, UNIGROW_SYSTEM_PROMPT, stream=False,
+                sender_id=sender_id if mode == "context" else None
+            )
+
+        started = time.perf_counter()
+        response = requests.post(f"{client.base_url}/api/generate", json=payload, timeout=300)
+        response.raise_for_status()
+        wall = time.perf_counter() - started
+        result = response.json()
+
+        if mode == "context":
+            client.contexts.put(sender_id, result.get("context"))
+
+        rows.append((
+            result.get("prompt_eval_count", 0),
+            result.get("prompt_eval_duration", 0) / 1e6,
+            wall * 1000
+        ))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    client = MistralLLMClient()
+
+    # Nạp model trước để lượt đầu không tính thời gian load
+    try:
+        requests.post(
+            f"{client.base_url}/api/generate",
+            json={"model": client.model_name, "prompt": "", "keep_alive": client.keep_alive},
+            timeout=300
+        ).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Không kết nối được Ollama tại {client.base_url}: {e}")
+        return 1
+
+    print(f"{'mode':<8} {'turn':>4} {'prompt_tokens':>14} {'prefill_ms':>11} {'wall_ms':>9}")
+    for mode in ("legacy", "system", "context"):
+        rows = run_mode(client, mode, args.turns)
+        for turn, (tokens, prefill_ms, wall_ms) in enumerate(rows, 1):
+            print(f"{mode:<8} {turn:>4} {tokens:>14} {prefill_ms:>11.1f} {wall_ms:>9.1f}")
+        total = sum(r[1] for r in rows)
+        print(f"{mode:<8} {'sum':>4} {sum(r[0] for r in rows):>14} {total:>11.1f}")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Benchmark rule lặp lại với cohort lớn
+
+So sánh bộ nhớ đỉnh khi gửi một lượt cho N recipient theo cách cũ (tạo
+sẵn một job cho mỗi recipient) với rule mở rộng theo trang.
+
+Chạy:
+    python benchmarks/bench_schedule_rules.py --recipients 1000000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.scheduler import MessageScheduler
+
+
+def synthetic_cohort(size):
+    def fetch(after, limit):
+        start = int(after) + 1 if after is not None else 0
+        return [str(i) for i in range(start, min(size, start + limit))]
+    return fetch
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, default=1000000)
+    args = parser.parse_args()
+
+    # ---- cách cũ: một job trong heap cho mỗi recipient ----
+    scheduler = MessageScheduler(db_path="", rate_limits="")
+    tracemalloc.start()
+    for i in range(args.recipients):
+        scheduler.schedule_message(str(i), "Nhắc nhở uống Unigrow", 3600)
+    eager_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del scheduler
+
+    # ---- rule: đọc cohort theo trang ----
+    scheduler = MessageScheduler(db_path="", rate_limits="")
+    scheduler.register_cohort("synthetic", synthetic_cohort(args.recipients))
+    sent = 0
+    done = threading.Event()
+
+    def send(recipient_id, message):
+        nonlocal sent
+        sent += 1
+        if sent >= args.recipients:
+            done.set()
+
+    tracemalloc.start()
+    rule_id = scheduler.schedule_recurring("bench", "synthetic", "Nhắc nhở uống Unigrow", "09:00")
+    scheduler._rules.finish_rule(rule_id, time.time())  # đến hạn ngay
+    started = time.perf_counter()
+    scheduler.start(send)
+    done.wait(timeout=600)
+    elapsed = time.perf_counter() - started
+    lazy_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    scheduler.stop()
+
+    print(f"recipients:                   {args.recipients:,}")
+    print(f"eager jobs peak memory:       {eager_peak / 2**20:.1f} MiB")
+    print(f"lazy rule peak memory:        {lazy_peak / 2**20:.1f} MiB (page_size={scheduler.page_size})")
+    print(f"lazy rule send throughput:    {sent / elapsed:,.0f} msg/s ({sent:,} sent)")
+
+
+if __name__ == "__main__":
+    main()
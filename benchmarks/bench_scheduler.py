@@ -0,0 +1,95 @@
+"""
+Benchmark MessageScheduler với nhiều job đang chờ
+
+So sánh chi phí mỗi lần kiểm tra của cách cũ (quét toàn bộ list mỗi giây)
+với heap, đo tốc độ lên lịch / huỷ, và độ trễ gửi thực tế (jitter) khi
+có 1M job đang chờ.
+
+Chạy:
+    python benchmarks/bench_scheduler.py --jobs 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.scheduler import MessageScheduler
+
+
+def legacy_tick(scheduled_messages, now):
+    """Một vòng kiểm tra của process_scheduled_messages cũ"""
+    return [
+        (i, scheduled) for i, scheduled in enumerate(scheduled_messages)
+        if scheduled["scheduled_time"] <= now
+    ]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=1000000)
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    # Job nền: rải đều trong 30 ngày tới
+    delays = [random.uniform(3600, 30 * 86400) for _ in range(args.jobs)]
+
+    # ---- cách cũ: list + quét tuyến tính ----
+    now = time.time()
+    legacy = [
+        {"recipient_id": str(i), "message": "x", "scheduled_time": now + d, "callback": None}
+        for i, d in enumerate(delays)
+    ]
+    started = time.perf_counter()
+    legacy_tick(legacy, time.time())
+    legacy_tick_ms = (time.perf_counter() - started) * 1000
+    del legacy
+
+    # ---- heap ----
+    scheduler = MessageScheduler(db_path="", rate_limits="")
+    started = time.perf_counter()
+    job_ids = [scheduler.schedule_message(str(i), "x", d) for i, d in enumerate(delays)]
+    schedule_s = time.perf_counter() - started
+
+    cancel_ids = random.sample(job_ids, min(100000, len(job_ids)))
+    started = time.perf_counter()
+    for job_id in cancel_ids:
+        scheduler.cancel(job_id)
+    cancel_us = (time.perf_counter() - started) / len(cancel_ids) * 1e6
+
+    # Độ trễ gửi: các job đến hạn trong vài giây tới, chen giữa 1M job nền
+    lateness = []
+    done = threading.Event()
+
+    def send(recipient_id, message):
+        lateness.append(time.time() - float(message))
+        if len(lateness) >= args.probes:
+            done.set()
+
+    scheduler.start(send)
+    for _ in range(args.probes):
+        delay = random.uniform(0.1, 3.0)
+        scheduler.schedule_message("probe", repr(time.time() + delay), delay)
+    done.wait(timeout=30)
+    scheduler.stop()
+
+    print(f"jobs pending:                 {args.jobs:,}")
+    print(f"legacy scan per tick:         {legacy_tick_ms:.1f} ms (mỗi giây)")
+    print(f"heap schedule throughput:     {args.jobs / schedule_s:,.0f} jobs/s")
+    print(f"heap cancel:                  {cancel_us:.2f} us/job")
+    print(f"dispatch lateness p50/p99:    "
+          f"{percentile(lateness, 0.5) * 1000:.2f} / {percentile(lateness, 0.99) * 1000:.2f} ms "
+          f"(cách cũ: tới 1000 ms + thời gian quét)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Đo thời gian khôi phục MessageScheduler từ SQLite với hàng triệu job
+
+Tạo N job pending rải trong 30 ngày tới (có một phần đến hạn trong giờ
+tới), rồi đo thời gian từ lúc khởi tạo scheduler tới khi heap đã nạp
+xong khoảng thời gian sắp tới, so với đọc toàn bộ bảng vào RAM.
+
+Chạy:
+    python benchmarks/bench_scheduler_recovery.py --jobs 2000000
+"""
+
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.scheduler import MessageScheduler
+from actions.scheduler_store import ScheduledMessageStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=2000000)
+    parser.add_argument("--near", type=float, default=0.01, help="tỉ lệ job đến hạn trong giờ tới")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "scheduler.db")
+    store = ScheduledMessageStore(db_path)
+
+    now = time.time()
+    started = time.perf_counter()
+    batch = []
+    for i in range(args.jobs):
+        if random.random() < args.near:
+            due = now + random.uniform(60, 3600)
+        else:
+            due = now + random.uniform(3600, 30 * 86400)
+        batch.append((f"user-{i % 100000}", "Nhắc uống Unigrow", due, "default"))
+        if len(batch) == 50000:
+            store.add(batch)
+            batch = []
+    store.add(batch)
+    store.close()
+    print(f"inserted {args.jobs:,} jobs in {time.perf_counter() - started:.1f} s "
+          f"({os.path.getsize(db_path) / 1e6:.0f} MB)")
+
+    # Khôi phục: chỉ nạp khoảng thời gian sắp tới
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    scheduler = MessageScheduler(db_path=db_path)
+    scheduler._heartbeat()  # nhận lease của mọi shard
+    with scheduler._cond:
+        scheduler._refill(time.time())
+    recovery_s = time.perf_counter() - started
+    print(f"recovery (window={scheduler.window:.0f}s): {recovery_s * 1000:.0f} ms, "
+          f"{scheduler.stats()['loaded']:,} jobs in heap")
+
+    # So sánh: đọc toàn bộ job pending vào RAM
+    started = time.perf_counter()
+    rows = scheduler.store.load_pending((-float("inf"), 0), float("inf"), args.jobs)
+    full_s = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"full load of {len(rows):,} rows: {full_s * 1000:.0f} ms "
+          f"(peak RSS +{(rss_after - rss_before) / 1024:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
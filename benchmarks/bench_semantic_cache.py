@@ -0,0 +1,53 @@
+"""
+Kiểm tra SemanticCache: câu gần giống được dùng lại, câu khác số thì không
+
+Đo thời gian lookup khi cache đầy và kiểm tra các cặp câu chỉ khác
+nhau ở con số (tuổi, số hộp): n-gram ký tự cho độ tương đồng rất cao
+nhưng câu trả lời không được dùng chung.
+
+Chạy:
+    python benchmarks/bench_semantic_cache.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.llm_cache import SemanticCache
+
+# (câu đã cache, câu mới, có được dùng lại không)
+PAIRS = [
+    ("Unigrow là gì vậy?", "unigrow là gì vậy", True),
+    ("tôi 15 tuổi có dùng unigrow được không", "tôi 15 tuổi có dùng unigrow được không ạ", True),
+    ("tôi 15 tuổi có dùng unigrow được không", "tôi 45 tuổi có dùng unigrow được không", False),
+    ("giá 1 hộp", "giá 6 hộp", False),
+    ("giá 1 hộp", "giá 1 hộp bao nhiêu", False),
+    ("cao 1m60 uống bao lâu", "cao 1m65 uống bao lâu", False),
+]
+
+
+def main():
+    cache = SemanticCache(path="", max_entries=2000)
+
+    failed = 0
+    for cached, query, expected in PAIRS:
+        cache.store(cached, "", f"answer: {cached}")
+        hit = cache.lookup(query, "") == f"answer: {cached}"
+        status = "ok" if hit == expected else "FAIL"
+        failed += hit != expected
+        print(f"{status:<5} hit={hit!s:<5} {cached!r} -> {query!r}")
+
+    for i in range(2000):
+        cache.store(f"câu hỏi số {i} về chiều cao và dinh dưỡng", "", "x")
+    started = time.perf_counter()
+    for i in range(1000):
+        cache.lookup(f"câu hỏi số {i} về chiều cao và dinh dưỡng nhé", "")
+    print(f"\nlookup với 2000 entry: {(time.perf_counter() - started):.3f} ms/lần")
+
+    assert not failed, f"{failed} cặp sai"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Báo cáo bộ nhớ của gunicorn master và từng worker (Linux, /proc)
+
+Với preload_app (MODEL_PRELOAD=true), trọng số model nằm trong trang nhớ dùng chung với
+master; thứ thực sự tăng theo số worker là USS (Private_Clean +
+Private_Dirty) của mỗi worker. RSS cộng dồn thì đếm trùng phần dùng
+chung, PSS chia đều phần đó cho các process nên tổng PSS là bộ nhớ
+thực tế. Nên đo sau khi đã có traffic (worker "ấm").
+
+Chạy:
+    MODEL_PRELOAD=true gunicorn -c gunicorn.conf.py --pid gunicorn.pid app:app
+    python benchmarks/report_worker_rss.py --pidfile gunicorn.pid
+"""
+
+import argparse
+import os
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def read_rollup(pid):
+    """Các trường của /proc/<pid>/smaps_rollup, đơn vị KiB"""
+    values = dict.fromkeys(FIELDS, 0)
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in values:
+                values[name] = int(rest.split()[0])
+    values["Uss"] = values["Private_Clean"] + values["Private_Dirty"]
+    values["Shared"] = values["Shared_Clean"] + values["Shared_Dirty"]
+    return values
+
+
+def children(pid):
+    """PID các process con trực tiếp (worker)"""
+    path = f"/proc/{pid}/task/{pid}/children"
+    if os.path.exists(path):
+        with open(path) as f:
+            return [int(p) for p in f.read().split()]
+
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Tên process nằm trong ngoặc và có thể chứa dấu cách
+                ppid = int(f.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == pid:
+            found.append(int(entry))
+    return sorted(found)
+
+
+def mib(kib):
+    return f"{kib / 1024:9.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pid", type=int, nargs="?", help="PID của gunicorn master")
+    parser.add_argument("--pidfile", help="File pid của gunicorn (--pid)")
+    parser.add_argument("--max-workers", type=int, default=8, help="Ước tính tới N worker")
+    args = parser.parse_args()
+
+    master = args.pid
+    if master is None:
+        if not args.pidfile:
+            parser.error("Cần PID của master hoặc --pidfile")
+        with open(args.pidfile) as f:
+            master = int(f.read().strip())
+
+    workers = children(master)
+    rows = [("master", master, read_rollup(master))]
+    rows += [("worker", pid, read_rollup(pid)) for pid in workers]
+
+    print(f"{'role':<8}{'pid':>8} {'RSS':>9} {'PSS':>9} {'shared':>9} {'USS':>9} {'swap':>9}  (MiB)")
+    for role, pid, v in rows:
+        print(
+            f"{role:<8}{pid:>8} {mib(v['Rss'])} {mib(v['Pss'])} "
+            f"{mib(v['Shared'])} {mib(v['Uss'])} {mib(v['Swap'])}"
+        )
+
+    total_rss = sum(v["Rss"] for _, _, v in rows)
+    total_pss = sum(v["Pss"] for _, _, v in rows)
+    print(f"\ntổng RSS (đếm trùng phần dùng chung): {total_rss / 1024:.1f} MiB")
+    print(f"tổng PSS (bộ nhớ thực tế):            {total_pss / 1024:.1f} MiB")
+
+    if not workers:
+        print("Không tìm thấy worker nào")
+        return
+
+    worker_uss = [v["Uss"] for role, _, v in rows if role == "worker"]
+    avg_uss = sum(worker_uss) / len(worker_uss)
+    master_rss = rows[0][2]["Rss"]
+    print(f"USS trung bình mỗi worker:            {avg_uss / 1024:.1f} MiB "
+          f"(min {min(worker_uss) / 1024:.1f}, max {max(worker_uss) / 1024:.1f})")
+    print(f"phần dùng chung với master:           "
+          f"{sum(v['Shared'] for r, _, v in rows if r == 'worker') / len(workers) / 1024:.1f} MiB/worker")
+
+    # Ước tính: phần dùng chung tính một lần (RSS của master) + USS mỗi worker
+    print("\nước tính tổng bộ nhớ theo số worker (preload / mỗi worker tự load model):")
+    worker_rss = sum(v["Rss"] for r, _, v in rows if r == "worker") / len(workers)
+    for n in range(1, max(args.max_workers, len(workers)) + 1):
+        shared = master_rss + n * avg_uss
+        separate = master_rss + n * worker_rss
+        mark = "  <- hiện tại" if n == len(workers) else ""
+        print(f"  {n:>2} worker: {shared / 1024:9.1f} MiB / {separate / 1024:9.1f} MiB{mark}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Cấu hình gunicorn cho web server nhiều worker
+
+Mặc định mỗi worker tự load model Rasa (an toàn với TensorFlow, nhưng
+bộ nhớ nhân theo số worker). MODEL_PRELOAD=true bật preload_app: model
+(DIET, ResponseSelector, TED) được load một lần trong master rồi mới
+fork worker, nên trang nhớ chứa trọng số được chia sẻ copy-on-write.
+
+TensorFlow không fork-safe (thread pool tạo ở op đầu tiên không tồn tại
+trong process con), nên master không warm-up; mỗi worker warm-up ngay
+sau fork và báo failed ở /health/ready nếu inference lỗi hoặc treo. Chỉ
+bật MODEL_PRELOAD sau khi đã kiểm tra với models/latest thật:
+    MODEL_PRELOAD=true GUNICORN_WORKERS=4 gunicorn -c gunicorn.conf.py app:app
+rồi gửi /api/chat tới từng worker. Đo RSS riêng của từng worker bằng
+benchmarks/report_worker_rss.py để chọn số worker.
+
+Chạy:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+# Các worker đọc/ghi chung trackers.db: request của cùng user có thể rơi
+# vào worker khác nhau
+os.environ.setdefault("TRACKER_STORE_SHARED", "true")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+
+# Mỗi worker nhiều thread dùng chung agent_loop của worker đó
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# Load model trong master trước khi fork (app.py đọc cùng biến MODEL_PRELOAD)
+preload_app = os.getenv("MODEL_PRELOAD", "false").lower() == "true"
+
+# Đủ cho một lượt chat gọi LLM (CHAT_TIMEOUT) cộng dư
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+
+# Tái chế worker sau N request (0 = không) nếu bộ nhớ riêng tăng dần
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+
+def post_fork(server, worker):
+    """Preload: khởi tạo lại DB connection, warm-up model và thread nền trong worker vừa fork"""
+    if not preload_app:
+        # Không preload: worker import app sau fork và tự load model
+        return
+
+    from app import init_worker
+
+    init_worker()
+    server.log.info(f"Worker {worker.pid} đã khởi tạo lại tài nguyên sau fork")
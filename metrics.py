@@ -0,0 +1,168 @@
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Các phân vị được báo cáo
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencySketch:
+    """
+    Sketch độ trễ dạng bucket logarit (kiểu DDSketch / HDR).
+
+    Không lưu mẫu thô: mỗi giá trị chỉ làm tăng một bucket, sai số
+    tương đối của phân vị <= relative_accuracy. Hai sketch cùng cấu
+    hình có thể merge bằng cách cộng bucket.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-6):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        return int(math.ceil(math.log(max(value, self.min_value)) / self._log_gamma))
+
+    def _value(self, index: int) -> float:
+        # Điểm giữa của bucket (theo sai số tương đối)
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value: float):
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencySketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Không thể merge sketch khác relative_accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        result = {"count": self.count, "mean": self.mean}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = self.quantile(q)
+        return result
+
+
+class LatencyTracker:
+    """Thống kê độ trễ toàn cục và theo user (giới hạn số user giữ trong RAM)"""
+
+    def __init__(self, max_users: int = 10000, relative_accuracy: float = 0.01):
+        self.max_users = max_users
+        self.relative_accuracy = relative_accuracy
+        self.global_sketch = LatencySketch(relative_accuracy)
+        self._users: "OrderedDict[Any, LatencySketch]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, user_id: Any, seconds: float):
+        with self._lock:
+            self.global_sketch.add(seconds)
+
+            sketch = self._users.get(user_id)
+            if sketch is None:
+                sketch = LatencySketch(self.relative_accuracy)
+                self._users[user_id] = sketch
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            sketch.add(seconds)
+
+    def user_summary(self, user_id: Any) -> Optional[Dict[str, float]]:
+        with self._lock:
+            sketch = self._users.get(user_id)
+            return sketch.summary() if sketch else None
+
+    def global_summary(self) -> Dict[str, float]:
+        with self._lock:
+            return self.global_sketch.summary()
+
+    def snapshot(self) -> LatencySketch:
+        """Bản sao sketch toàn cục (để render mà không giữ lock)"""
+        with self._lock:
+            copy = LatencySketch(self.relative_accuracy)
+            copy.merge(self.global_sketch)
+            return copy
+
+
+# ==================== PROMETHEUS TEXT FORMAT ====================
+
+def _labels(labels: Optional[Dict[str, Any]]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_summary(name: str, help_text: str, sketch: LatencySketch) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+    for q in QUANTILES:
+        lines.append(f"{name}{_labels({'quantile': q})} {sketch.quantile(q)}")
+    lines.append(f"{name}_sum {sketch.sum}")
+    lines.append(f"{name}_count {sketch.count}")
+    return lines
+
+
+def render_metric(
+    name: str,
+    help_text: str,
+    metric_type: str,
+    samples: Iterable[Tuple[Optional[Dict[str, Any]], float]]
+) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return lines
+
+
+def render_stats(prefix: str, stats: Dict[str, Any], counters: Iterable[str] = ()) -> List[str]:
+    """Render dict stats() của một subsystem thành các metric gauge/counter"""
+    counters = set(counters)
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        metric_type = "counter" if key in counters else "gauge"
+        name = f"{prefix}_{key}_total" if metric_type == "counter" else f"{prefix}_{key}"
+        lines.extend(render_metric(name, f"{prefix} {key}", metric_type, [(None, value)]))
+    return lines
+
+
+# Global latency tracker cho /api/chat
+chat_latency = LatencyTracker()
+
+# Time-to-first-token của /api/chat/stream
+stream_first_token = LatencyTracker()
@@ -26,6 +26,11 @@ class Message(db.Model):
     bot_response = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Index cho lịch sử chat theo user, sắp xếp theo thời gian (keyset pagination)
+    __table_args__ = (
+        db.Index('ix_message_user_timestamp', 'user_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<Message {self.user_id}>'
 
@@ -36,6 +41,7 @@ class Analytics(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     total_messages = db.Column(db.Integer, default=0)
     average_response_time = db.Column(db.Float, default=0.0)
+    response_time_count = db.Column(db.Integer, default=0)  # Số lượt đã đo thời gian
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
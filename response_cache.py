@@ -0,0 +1,172 @@
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Intent chỉ trả về template utter_* cố định (không phụ thuộc slot/ngữ cảnh).
+# Không có ask_purchase (action_confirm_purchase_intent trả text theo slot)
+# và ask_unigrow_info (có slot mapping user_age: cache hit sẽ bỏ qua slot)
+DEFAULT_STATELESS_INTENTS = (
+    "greet",
+    "goodbye",
+    "thanks",
+    "ask_about_me",
+    "ask_dosage",
+    "ask_results",
+    "ask_price",
+)
+
+# Event được phép xuất hiện trong một lượt stateless (ngoài ActionExecuted utter_*)
+_STATELESS_EVENTS = {"action", "bot", "user_featurization"}
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = re.compile(r"^[\s.,!?…]+|[\s.,!?…]+$")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Chuẩn hoá tin nhắn làm khoá cache
+
+    Dấu tiếng Việt được đưa về dạng NFC (tổ hợp sẵn và tổ hợp rời
+    cho ra cùng một chuỗi), chữ thường, gộp khoảng trắng và bỏ dấu câu
+    ở đầu/cuối câu.
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _WHITESPACE.sub(" ", text)
+    return _EDGE_PUNCTUATION.sub("", text)
+
+
+def is_stateless_turn(tracker) -> bool:
+    """
+    Lượt vừa chạy có dùng lại được cho user khác không: tin nhắn không có
+    entity, không có SlotSet (hay event đổi trạng thái nào khác) và chỉ
+    chạy action utter_* (template cố định)
+    """
+    if tracker is None or tracker.latest_message is None or tracker.latest_message.entities:
+        return False
+
+    for event in reversed(tracker.events):
+        if event.type_name == "user":
+            return True
+        if event.type_name not in _STATELESS_EVENTS:
+            return False
+        if event.type_name == "action":
+            name = event.action_name or ""
+            if name != "action_listen" and not name.startswith("utter_"):
+                return False
+    return False
+
+
+def turn_events(tracker) -> List[Dict[str, Any]]:
+    """Event của lượt vừa chạy (từ UserUttered cuối cùng), dạng dict để phát lại"""
+    events = []
+    for event in reversed(tracker.events):
+        events.append(event.as_dict())
+        if event.type_name == "user":
+            break
+    events.reverse()
+    return events
+
+
+class ResponseCache:
+    """
+    Cache LRU + TTL cho câu trả lời của agent, khoá theo tin nhắn đã chuẩn hoá.
+
+    Chỉ lưu câu trả lời của các intent stateless, và chỉ khi lượt đó
+    thực sự stateless (is_stateless_turn); phải clear() khi model được
+    load lại.
+
+    Cache chỉ bỏ qua NLU + dự đoán action, không bỏ qua tracker: mỗi entry
+    giữ event của lượt gốc (UserUttered, ActionExecuted utter_*, BotUttered)
+    để app.py phát lại vào tracker của user khi hit, nên các lượt sau thấy
+    cùng một hội thoại dù lượt này có hit cache hay không.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        ttl: float = None,
+        stateless_intents: Optional[List[str]] = None
+    ):
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000))
+        self.ttl = ttl or float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+
+        if stateless_intents is None:
+            configured = os.getenv("RESPONSE_CACHE_INTENTS")
+            stateless_intents = (
+                [name.strip() for name in configured.split(",") if name.strip()]
+                if configured is not None else DEFAULT_STATELESS_INTENTS
+            )
+        self.stateless_intents = set(stateless_intents)
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, List[Dict[str, Any]], List[Dict[str, Any]]]]:
+        """(intent, câu trả lời, event của lượt gốc) hoặc None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1:]
+
+    def put(
+        self,
+        key: str,
+        intent: Optional[str],
+        responses: List[Dict[str, Any]],
+        events: List[Dict[str, Any]]
+    ) -> bool:
+        """Lưu câu trả lời (và event của lượt) nếu intent là stateless và chỉ gồm text"""
+        if intent not in self.stateless_intents or not responses or not events:
+            return False
+        if any(set(resp) - {"recipient_id", "text"} for resp in responses):
+            return False
+
+        # Bỏ recipient_id: câu trả lời được dùng chung cho mọi user
+        responses = [{"text": resp["text"]} for resp in responses if "text" in resp]
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, intent, responses, events)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stores += 1
+        return True
+
+    def clear(self):
+        """Xoá toàn bộ cache (gọi khi load model mới)"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Global response cache cho /api/chat
+response_cache = ResponseCache()
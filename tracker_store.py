@@ -0,0 +1,268 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Text
+
+from rasa.core.tracker_store import InMemoryTrackerStore
+
+logger = logging.getLogger(__name__)
+
+
+class SpillingTrackerCache(MutableMapping):
+    """
+    Dict sender_id -> tracker (đã serialize) có giới hạn bộ nhớ.
+
+    Tracker nóng nằm trong RAM theo thứ tự LRU; khi vượt quá số lượng
+    hoặc số byte cho phép, tracker lạnh nhất được ghi xuống SQLite và
+    được nạp lại khi user quay lại.
+
+    shared=True khi nhiều process (gunicorn worker) dùng chung file:
+    mỗi lần ghi đi thẳng xuống SQLite, và bản trong RAM chỉ được dùng
+    nếu updated_at trên đĩa chưa đổi (worker khác chưa ghi đè).
+    """
+
+    def __init__(
+        self,
+        db_path: str = "trackers.db",
+        max_trackers: int = 10000,
+        max_bytes: int = 256 * 1024 * 1024,
+        shared: bool = False
+    ):
+        self.db_path = db_path
+        self.max_trackers = max_trackers
+        self.max_bytes = max_bytes
+        self.shared = shared
+
+        self._hot: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        # shared: updated_at của bản trong RAM
+        self._stamps: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_loads = 0
+        self.evictions = 0
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._db()
+
+    def _db(self) -> sqlite3.Connection:
+        """Connection SQLite của process hiện tại (mở lại sau khi fork)"""
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        # Không đóng connection kế thừa từ process cha: nó vẫn dùng tiếp
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._pid = os.getpid()
+        if self.shared:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trackers ("
+            "sender_id TEXT PRIMARY KEY, "
+            "tracker TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _size(value: str) -> int:
+        return len(value.encode("utf-8"))
+
+    def _put(self, key: str, value: str):
+        self._drop(key)
+        self._hot[key] = value
+        self._bytes += self._size(value)
+        self._evict()
+
+    def _drop(self, key: str) -> Optional[str]:
+        """Bỏ tracker khỏi RAM (không đụng tới SQLite)"""
+        self._stamps.pop(key, None)
+        value = self._hot.pop(key, None)
+        if value is not None:
+            self._bytes -= self._size(value)
+        return value
+
+    def _evict(self):
+        """Đẩy tracker lạnh nhất xuống SQLite cho tới khi nằm trong ngân sách"""
+        spilled = []
+        while len(self._hot) > 1 and (
+            len(self._hot) > self.max_trackers or self._bytes > self.max_bytes
+        ):
+            key, value = self._hot.popitem(last=False)
+            self._bytes -= self._size(value)
+            self.evictions += 1
+            if self._stamps.pop(key, None) is None:
+                spilled.append((key, value, time.time()))
+
+        if spilled:
+            self._write(spilled)
+
+    def _write(self, rows):
+        conn = self._db()
+        conn.executemany(
+            "INSERT OR REPLACE INTO trackers (sender_id, tracker, updated_at) "
+            "VALUES (?, ?, ?)",
+            rows
+        )
+        conn.commit()
+
+    def _fresh(self, key: str) -> bool:
+        """shared: bản trong RAM còn khớp với SQLite không"""
+        if not self.shared:
+            return True
+        row = self._db().execute(
+            "SELECT updated_at FROM trackers WHERE sender_id = ?", (key,)
+        ).fetchone()
+        return row is not None and row[0] == self._stamps.get(key)
+
+    def _load(self, key: str, count: bool) -> Optional[str]:
+        with self._lock:
+            if key in self._hot and self._fresh(key):
+                self._hot.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return self._hot[key]
+
+            if count:
+                self.misses += 1
+
+            row = self._db().execute(
+                "SELECT tracker, updated_at FROM trackers WHERE sender_id = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._drop(key)
+                return None
+
+            if count:
+                self.disk_loads += 1
+            self._put(key, row[0])
+            if self.shared:
+                self._stamps[key] = row[1]
+            return row[0]
+
+    def __contains__(self, key: object) -> bool:
+        return self._load(str(key), count=True) is not None
+
+    def get(self, key: Text, default: Any = None) -> Any:
+        value = self._load(key, count=True)
+        return default if value is None else value
+
+    def __getitem__(self, key: Text) -> str:
+        value = self._load(key, count=False)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Text, value: str):
+        with self._lock:
+            self._put(key, value)
+            if self.shared:
+                # Ghi ngay để worker khác đọc được lượt mới nhất
+                stamp = time.time()
+                self._write([(key, value, stamp)])
+                self._stamps[key] = stamp
+
+    def __delitem__(self, key: Text):
+        with self._lock:
+            value = self._drop(key)
+            conn = self._db()
+            cursor = conn.execute(
+                "DELETE FROM trackers WHERE sender_id = ?", (key,)
+            )
+            conn.commit()
+            if value is None and cursor.rowcount == 0:
+                raise KeyError(key)
+
+    def keys(self):
+        with self._lock:
+            keys = set(self._hot.keys())
+            keys.update(
+                row[0] for row in self._db().execute("SELECT sender_id FROM trackers")
+            )
+            return keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def flush(self):
+        """Ghi toàn bộ tracker đang nóng xuống SQLite (gọi khi tắt server)"""
+        with self._lock:
+            now = time.time()
+            # shared: tracker đã có trên đĩa, ghi lại sẽ đè lượt mới hơn của worker khác
+            self._write([
+                (key, value, now) for key, value in self._hot.items() if key not in self._stamps
+            ])
+
+    def stats(self) -> Dict[str, Any]:
+        """Bộ đếm hit/miss/eviction để chọn kích thước cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hot_trackers": len(self._hot),
+                "hot_bytes": self._bytes,
+                "max_trackers": self.max_trackers,
+                "max_bytes": self.max_bytes,
+                "shared": self.shared,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_loads": self.disk_loads,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class LRUSQLiteTrackerStore(InMemoryTrackerStore):
+    """
+    Tracker store theo user_id: giữ hội thoại nóng trong RAM (LRU),
+    hội thoại lạnh được ghi xuống file SQLite cục bộ.
+
+    Dùng trong endpoints.yml:
+        tracker_store:
+          type: tracker_store.LRUSQLiteTrackerStore
+          db: trackers.db
+          max_trackers: 10000
+          max_bytes: 268435456
+          shared: true   # nhiều worker gunicorn dùng chung trackers.db
+    """
+
+    def __init__(
+        self,
+        domain=None,
+        host: Optional[Text] = None,
+        event_broker=None,
+        db: Optional[Text] = None,
+        max_trackers: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        shared: Optional[bool] = None,
+        **kwargs: Any
+    ):
+        super().__init__(domain, event_broker, **kwargs)
+        self.store = SpillingTrackerCache(
+            db_path=db or os.getenv("TRACKER_STORE_DB", "trackers.db"),
+            max_trackers=int(max_trackers or os.getenv("TRACKER_STORE_MAX_TRACKERS", 10000)),
+            max_bytes=int(max_bytes or os.getenv("TRACKER_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+            shared=(
+                shared if shared is not None
+                else os.getenv("TRACKER_STORE_SHARED", "false").lower() == "true"
+            )
+        )
+        logger.info(
+            f"Tracker store: tối đa {self.store.max_trackers} tracker / "
+            f"{self.store.max_bytes} bytes trong RAM, spill -> {self.store.db_path}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
+
+    def flush(self):
+        self.store.flush()
@@ -0,0 +1,314 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+
+from models import db, User, Message, Analytics
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Hàng đợi ghi trễ (write-behind) cho Message và Analytics.
+
+    Request chat chỉ đẩy dữ liệu vào buffer trong RAM; một background
+    thread gom lại và ghi theo lô trong một transaction khi đủ
+    batch_size hoặc sau flush_interval giây. Khi tắt server, close()
+    ghi nốt phần còn lại.
+
+    Đọc lịch sử / thống kê không flush (không ghi DB trên request path) mà
+    dùng read_through(): kết quả DB cộng với các dòng còn trong buffer của
+    process này. Với nhiều worker gunicorn, buffer của worker khác không
+    thấy được cho tới lần flush kế tiếp (tối đa flush_interval giây).
+    """
+
+    # Số lần đọc lại khi một lô được commit đúng lúc đang đọc
+    READ_RETRIES = 5
+
+    def __init__(
+        self,
+        app=None,
+        batch_size: int = None,
+        flush_interval: float = None,
+        max_pending: int = None
+    ):
+        self.app = app
+        self.batch_size = batch_size or int(os.getenv("WRITE_QUEUE_BATCH_SIZE", 200))
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_QUEUE_FLUSH_INTERVAL", 1.0))
+        self.max_pending = max_pending or int(os.getenv("WRITE_QUEUE_MAX_PENDING", 100000))
+
+        # Đầy thì tin cũ nhất tự rơi ra (O(1), không dịch cả list)
+        self._messages: deque = deque(maxlen=self.max_pending)
+        self._analytics: Dict[int, Dict[str, Any]] = {}
+        # Lô đang được ghi: đã rời buffer nhưng chưa commit
+        self._inflight_messages: List[Dict[str, Any]] = []
+        self._inflight_analytics: Dict[int, Dict[str, Any]] = {}
+        # Tăng trước và sau khi commit một lô (lẻ = đang commit), để
+        # read_through biết DB có đổi trong lúc nó đọc không
+        self._version = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._running = False
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def init_app(self, app):
+        self.app = app
+
+    def _ensure_started(self):
+        """Khởi động flush thread (lazy, và khởi động lại sau khi fork)"""
+        if self._running and self._pid == os.getpid():
+            return
+        self._running = True
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="write-behind-flush",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info("Write-behind queue started")
+
+    def add_message(
+        self,
+        user_id: int,
+        user_message: str,
+        bot_response: str,
+        timestamp: Optional[datetime] = None,
+        response_time: Optional[float] = None
+    ):
+        """
+        Đưa một lượt chat vào buffer (không chờ database)
+
+        Args:
+            user_id: ID người dùng
+            user_message: Tin nhắn của user
+            bot_response: Câu trả lời của bot
+            timestamp: Thời điểm chat (mặc định: bây giờ)
+            response_time: Thời gian xử lý lượt chat (giây)
+        """
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            logger.warning(f"Bỏ qua tin nhắn với user_id không hợp lệ: {user_id!r}")
+            return
+
+        timestamp = timestamp or datetime.utcnow()
+
+        with self._cond:
+            self._ensure_started()
+
+            if len(self._messages) >= self.max_pending:
+                # Database không theo kịp: deque bỏ tin cũ nhất thay vì tràn RAM
+                self.dropped += 1
+
+            self._messages.append({
+                "user_id": user_id,
+                "user_message": user_message,
+                "bot_response": bot_response,
+                "timestamp": timestamp
+            })
+
+            delta = self._analytics.setdefault(
+                user_id,
+                {"count": 0, "last_active": timestamp, "timed": 0, "time_sum": 0.0}
+            )
+            delta["count"] += 1
+            delta["last_active"] = max(delta["last_active"], timestamp)
+            if response_time is not None:
+                delta["timed"] += 1
+                delta["time_sum"] += response_time
+
+            if len(self._messages) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._messages) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_interval)
+                running = self._running
+            self.flush()
+            if not running:
+                return
+
+    def _take(self):
+        with self._cond:
+            messages = list(self._messages)
+            self._messages.clear()
+            analytics, self._analytics = self._analytics, {}
+            self._inflight_messages, self._inflight_analytics = messages, analytics
+        return messages, analytics
+
+
+    @staticmethod
+    def _merge_delta(target: Dict[str, Any], delta: Dict[str, Any]):
+        target["count"] += delta["count"]
+        target["last_active"] = max(target["last_active"], delta["last_active"])
+        target["timed"] += delta["timed"]
+        target["time_sum"] += delta["time_sum"]
+
+    def _pending_for(self, user_id: int) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Tin nhắn và analytics delta chưa commit của user (gọi khi giữ _cond)"""
+        messages = [
+            m for batch in (self._inflight_messages, self._messages)
+            for m in batch if m["user_id"] == user_id
+        ]
+        delta = None
+        for source in (self._inflight_analytics, self._analytics):
+            if user_id in source:
+                if delta is None:
+                    delta = dict(source[user_id])
+                else:
+                    self._merge_delta(delta, source[user_id])
+        return messages, delta
+
+    def read_through(self, user_id: int, read: Callable[[], Any]):
+        """
+        Chạy read() (query DB) và lấy các dòng chưa ghi của user_id sao cho
+        không thiếu hay trùng dòng với kết quả DB
+
+        Returns:
+            (kết quả read(), tin nhắn đang chờ, analytics delta đang chờ hoặc None)
+        """
+        for _ in range(self.READ_RETRIES):
+            with self._cond:
+                version = self._version
+                if version % 2 == 0:
+                    messages, delta = self._pending_for(user_id)
+            if version % 2:
+                # Một lô đang commit: chờ chút rồi đọc lại
+                time.sleep(0.005)
+                continue
+            result = read()
+            if self._version == version:
+                return result, messages, delta
+
+        # Commit liên tục (hiếm): chờ lô đang ghi xong để đọc nhất quán
+        with self._flush_lock:
+            with self._cond:
+                messages, delta = self._pending_for(user_id)
+            return read(), messages, delta
+
+    def _requeue(self, messages, analytics):
+        with self._cond:
+            # Lô lỗi cũ hơn mọi tin đang chờ: khi DB sập lâu, bỏ phần cũ nhất
+            # của lô để tổng vẫn trong max_pending
+            overflow = len(messages) + len(self._messages) - self.max_pending
+            if overflow > 0:
+                messages = messages[overflow:]
+                self.dropped += overflow
+            self._messages.extendleft(reversed(messages))
+            for user_id, delta in analytics.items():
+                current = self._analytics.get(user_id)
+                if current:
+                    self._merge_delta(current, delta)
+                else:
+                    self._analytics[user_id] = delta
+            self._inflight_messages, self._inflight_analytics = [], {}
+
+    def flush(self) -> int:
+        """Ghi toàn bộ buffer xuống database trong một transaction"""
+        with self._flush_lock:
+            messages, analytics = self._take()
+            if not messages and not analytics:
+                return 0
+
+            try:
+                with self.app.app_context():
+                    user_ids = set(analytics) | {m["user_id"] for m in messages}
+                    existing = set(db.session.execute(
+                        select(User.id).where(User.id.in_(user_ids))
+                    ).scalars())
+
+                    rows = [m for m in messages if m["user_id"] in existing]
+                    if rows:
+                        db.session.execute(insert(Message), rows)
+
+                    for user_id, delta in analytics.items():
+                        if user_id not in existing:
+                            continue
+
+                        values = {
+                            "total_messages": Analytics.total_messages + delta["count"],
+                            "last_active": delta["last_active"]
+                        }
+                        if delta["timed"]:
+                            # Running mean: (avg * n + tổng mới) / (n + số mẫu mới),
+                            # SET dùng giá trị cũ của các cột nên tính trong một UPDATE
+                            timed = func.coalesce(Analytics.response_time_count, 0)
+                            average = func.coalesce(Analytics.average_response_time, 0.0)
+                            values["average_response_time"] = (
+                                (average * timed + delta["time_sum"]) /
+                                (timed + delta["timed"])
+                            )
+                            values["response_time_count"] = timed + delta["timed"]
+
+                        db.session.execute(
+                            update(Analytics)
+                            .where(Analytics.user_id == user_id)
+                            .values(**values)
+                        )
+
+                    with self._cond:
+                        self._version += 1
+                    try:
+                        db.session.commit()
+                    except Exception:
+                        # DB không đổi; lô vẫn là inflight cho tới khi _requeue trả lại buffer
+                        with self._cond:
+                            self._version += 1
+                        raise
+                    with self._cond:
+                        self._version += 1
+                        self._inflight_messages, self._inflight_analytics = [], {}
+
+                self.flushes += 1
+                self.rows_written += len(rows)
+                return len(rows)
+
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Lỗi ghi DB (write-behind): {str(e)}")
+                with self.app.app_context():
+                    db.session.rollback()
+                self._requeue(messages, analytics)
+                return 0
+
+    def close(self):
+        """Dừng flush thread và ghi nốt dữ liệu còn lại"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout=10)
+        self.flush()
+        logger.info("Write-behind queue closed")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._messages)
+        return {
+            "pending": pending,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "dropped": self.dropped,
+            "errors": self.errors
+        }
+
+
+# Global write queue (gắn app trong app.py)
+write_queue = WriteBehindQueue()